@@ -0,0 +1,288 @@
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from collections.abc import Mapping
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+import stages
+from instrumentation import Instrumentation
+
+# Benchmark de todo el ETL sin red: los artículos de los CSV guardados en extract/ se sirven como páginas html desde
+# un servidor local (extract/standin_server.py) y pasan por extract -> transform -> load, cada sitio por su cuenta,
+# contra una base de datos temporal (newspaper.db, seen_urls.db y el cache http no se tocan).
+#
+# Para tener más filas se repiten los artículos guardados con otra url y otro título (si no, transform los quitaría
+# por duplicados). Los datos de entrada son siempre los mismos, así dos corridas se pueden comparar.
+#
+# Cada corrida se agrega a benchmark_results.jsonl con el commit en el que se corrió. Para correrlo:
+#   python benchmark.py run --rows 10000 100000 1000000
+#   python benchmark.py compare                 (las dos últimas corridas)
+#   python benchmark.py compare 1d68542 HEAD    (las últimas corridas de esos commits)
+#
+# La tokenización es el paso más lento (del orden de mil filas por segundo por proceso), por eso el default es solo
+# 10000 filas; con 1000000 la corrida tarda más de media hora.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROWS = [10000]
+DEFAULT_RESULTS_PATH = os.path.join(stages.BASE_DIR, "benchmark_results.jsonl")
+
+
+class ScaledCorpus(Mapping):
+    # {path: html} con `rows` artículos repartidos entre los sitios en la misma proporción que en los CSV guardados.
+    # La portada de cada sitio está en /<sitio> y sus artículos en /<sitio>/<n>.html. Cada artículo se arma cuando el
+    # servidor lo pide, pero la portada lista todos los links y extract junta las filas de un sitio en un DataFrame
+    # (FrameWriter): la memoria sigue creciendo con `rows`.
+    def __init__(self, rows):
+        self._standin_server = stages.load_module("extract", "standin_server")
+        self.news_sites_uids = sorted(set(path.split("/")[1] for path in self._standin_server.load_corpus()
+                                          if path.endswith(".html")))
+        self.rows = rows
+        self._sample = pd.concat([_read_sample(news_site_uid) for news_site_uid in self.news_sites_uids],
+                                 ignore_index=True)
+        self._homepages = {}
+
+    def _article_path(self, index):
+        return "/{}/{}.html".format(self._sample["news_site_uid"].iat[index % len(self._sample)], index)
+
+    def _article(self, index):
+        row = self._sample.iloc[index % len(self._sample)]
+        copy = index // len(self._sample)
+        # la copia 0 es el artículo tal cual
+        title = row["title"] if not copy else "{} ({})".format(row["title"], copy)
+
+        return self._standin_server.render_article(row["news_site_uid"], title, row["body"])
+
+    def _homepage(self, news_site_uid):
+        if news_site_uid not in self._homepages:
+            paths = ["/{}.html".format(index) for index in range(self.rows)
+                     if self._sample["news_site_uid"].iat[index % len(self._sample)] == news_site_uid]
+            self._homepages[news_site_uid] = self._standin_server.render_homepage(news_site_uid, paths)
+
+        return self._homepages[news_site_uid]
+
+    def __getitem__(self, path):
+        parts = path.strip("/").split("/")
+        if len(parts) == 1 and parts[0] in self.news_sites_uids:
+            return self._homepage(parts[0])
+        if len(parts) == 2 and parts[1].endswith(".html") and parts[1][:-len(".html")].isdigit():
+            index = int(parts[1][:-len(".html")])
+            if index < self.rows and self._article_path(index) == path:
+                return self._article(index)
+
+        raise KeyError(path)
+
+    def __iter__(self):
+        for news_site_uid in self.news_sites_uids:
+            yield "/{}".format(news_site_uid)
+        for index in range(self.rows):
+            yield self._article_path(index)
+
+    def __len__(self):
+        return len(self.news_sites_uids) + self.rows
+
+
+def _read_sample(news_site_uid):
+    filename = os.path.join(stages.BASE_DIR, "extract", "{}_2020_05_09_articles.csv".format(news_site_uid))
+    sample = stages.load_module("transform")._read_data(filename)[["title", "body"]].fillna("")
+    sample["news_site_uid"] = news_site_uid
+
+    return sample
+
+
+def _extract_settings(server_url, directory, rows):
+    # los sitios apuntan al servidor local; el índice de urls vistas y la cola de links van en el directorio
+    # temporal, sin cache http (con el cache la segunda escala solo recibiría 304) y sin límite de peticiones por
+    # dominio (el servidor local es uno solo, mediríamos el límite y no el pipeline)
+    settings = stages.load_module("extract").config()
+    for news_site_uid, site in settings["news_sites"].items():
+        site["url"] = "{}/{}".format(server_url, news_site_uid)
+    settings["url_index"] = {"path": os.path.join(directory, "seen_urls.db")}
+    # sin secciones: el servidor local solo tiene la portada de cada sitio
+    settings["frontier"] = {"path": os.path.join(directory, "frontier.db"), "max_size": rows}
+    for site in settings["news_sites"].values():
+        site.pop("frontier", None)
+    settings.setdefault("http_cache", {})["enabled"] = False
+    settings.setdefault("crawl", {})["enabled"] = False
+
+
+def _throughput(count, seconds):
+    return {"count": count, "seconds": seconds, "per_second": count / seconds if seconds else None}
+
+
+def bench_scale(rows, workers=1, load_mode="upsert"):
+    # Corre el ETL completo sobre `rows` artículos y regresa pages/s de extract, rows/s de cada paso de transform
+    # (medidos con instrumentation) y rows/s de load
+    standin_server = stages.load_module("extract", "standin_server")
+    load_main = stages.load_module("load")
+    pages = ScaledCorpus(rows)
+    result = {"rows": rows, "extract": {}, "transform": {}, "load": {}}
+
+    instrumentation = Instrumentation(stages.instrument)
+    instrumentation.install(["transform"])
+    with tempfile.TemporaryDirectory() as directory, standin_server.StandInServer(pages) as server:
+        _extract_settings(server.url, directory, rows)
+        engine = create_engine("sqlite:///{}".format(os.path.join(directory, "newspaper.db")))
+        timings = {"extract": [0, 0.0], "transform": [0, 0.0], "load": [0, 0.0]}
+
+        try:
+            for news_site_uid in pages.news_sites_uids:
+                requests_before = server.requests_served
+                start = time.perf_counter()
+                # extract imprime el título de cada artículo
+                with open(os.devnull, mode="w") as devnull, contextlib.redirect_stdout(devnull):
+                    articles = stages.extract(news_site_uid, full=True)
+                timings["extract"][0] += server.requests_served - requests_before
+                timings["extract"][1] += time.perf_counter() - start
+
+                start = time.perf_counter()
+                cleaned_articles = stages.transform(articles, news_site_uid, workers=workers)
+                timings["transform"][0] += len(articles)
+                timings["transform"][1] += time.perf_counter() - start
+
+                start = time.perf_counter()
+                load_main.load(cleaned_articles, mode=load_mode, engine=engine)
+                timings["load"][0] += len(cleaned_articles)
+                timings["load"][1] += time.perf_counter() - start
+        finally:
+            instrumentation.uninstall()
+            engine.dispose()
+
+    result["extract"]["pages"] = _throughput(*timings["extract"])
+    result["transform"]["total"] = _throughput(*timings["transform"])
+    for label, record in instrumentation.functions.items():
+        # rows/s sobre las filas que recibe cada paso
+        result["transform"][label.split(".", 1)[1]] = _throughput(record["rows_in"] or 0, record["wall_time"])
+    result["load"]["rows"] = _throughput(*timings["load"])
+
+    return result
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git"] + list(args), cwd=stages.BASE_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _environment():
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def bench_run(args):
+    record = {
+        "commit": _git("rev-parse", "--short", "HEAD") or "unknown",
+        # con cambios sin commit los números no corresponden del todo al commit
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "date": datetime.datetime.now().isoformat(),
+        "environment": _environment(),
+        "options": {"workers": args.workers, "load_mode": args.load_mode},
+        "scales": [],
+    }
+
+    for rows in args.rows:
+        logger.warning("Running the pipeline on {} rows".format(rows))
+        scale = bench_scale(rows, workers=args.workers, load_mode=args.load_mode)
+        record["scales"].append(scale)
+        _print_scale(scale)
+
+    with open(args.results, mode="a", encoding="utf-8") as file:
+        file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print("Saved results of {}{} to {}".format(record["commit"], " (dirty)" if record["dirty"] else "",
+                                               args.results))
+
+
+def _metrics(scale):
+    # (etapa, medida) --> por segundo
+    return {(stage, name): value["per_second"]
+            for stage in ("extract", "transform", "load")
+            for name, value in scale[stage].items()}
+
+
+def _print_scale(scale):
+    print("{} rows".format(scale["rows"]))
+    for (stage, name), per_second in _metrics(scale).items():
+        print("  {:<10} {:<32} {:>12.1f} /s".format(stage, name, per_second or 0))
+
+
+def _read_results(filename):
+    with open(filename, mode="r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def _find_run(runs, commit):
+    # la última corrida de ese commit (acepta HEAD, ramas o hashes cortos)
+    commit = _git("rev-parse", "--short", commit) or commit
+    for run in reversed(runs):
+        if run["commit"] == commit:
+            return run
+
+    raise SystemExit("No results for {} in the results file".format(commit))
+
+
+def bench_compare(args):
+    runs = _read_results(args.results)
+    if args.commits:
+        if len(args.commits) != 2:
+            raise SystemExit("compare takes two commits or none")
+        before, after = (_find_run(runs, commit) for commit in args.commits)
+    elif len(runs) >= 2:
+        before, after = runs[-2], runs[-1]
+    else:
+        raise SystemExit("Need at least two runs in {}".format(args.results))
+
+    print("before: {} ({}), after: {} ({})".format(before["commit"], before["date"], after["commit"], after["date"]))
+    before_scales = {scale["rows"]: scale for scale in before["scales"]}
+    if not any(scale["rows"] in before_scales for scale in after["scales"]):
+        raise SystemExit("The two runs have no number of rows in common")
+    for scale in after["scales"]:
+        if scale["rows"] not in before_scales:
+            continue
+
+        print("{} rows".format(scale["rows"]))
+        print("  {:<10} {:<32} {:>12} {:>12} {:>8}".format("stage", "step", "before /s", "after /s", "change"))
+        before_metrics = _metrics(before_scales[scale["rows"]])
+        for key, per_second in _metrics(scale).items():
+            previous = before_metrics.get(key)
+            change = "{:+.0%}".format(per_second / previous - 1) if previous and per_second else "-"
+            print("  {:<10} {:<32} {:>12.1f} {:>12.1f} {:>8}".format(key[0], key[1], previous or 0, per_second or 0,
+                                                                    change))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser("run", help="Run the whole pipeline offline and save the throughput")
+    run_parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS,
+                            help="Number of articles of each run (10000 100000 1000000 for the full suite)")
+    run_parser.add_argument("--workers", type=int, default=1, help="Processes used to tokenize")
+    run_parser.add_argument("--load-mode", choices=["orm", "bulk", "upsert"], default="upsert")
+    run_parser.add_argument("--results", type=str, default=DEFAULT_RESULTS_PATH)
+    run_parser.set_defaults(func=bench_run)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare the throughput of two runs")
+    compare_parser.add_argument("commits", nargs="*", help="Two commits (the last two runs by default)")
+    compare_parser.add_argument("--results", type=str, default=DEFAULT_RESULTS_PATH)
+    compare_parser.set_defaults(func=bench_compare)
+
+    args = parser.parse_args()
+    # antes de cargar los main.py de cada paso, así su logging.basicConfig(level=logging.INFO) ya no hace nada
+    logging.basicConfig(level=logging.WARNING)
+    args.func(args)
@@ -0,0 +1,215 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import requests
+import soupsieve
+
+import http_cache
+import main as extract
+import parsers
+import sessions
+from common import config
+from crawl_scheduler import crawl_metrics, crawl_scheduler
+from fetcher import FetchEngine
+from sites import registry
+from standin_server import StandInServer, load_corpus
+
+# Para correrlo (desde la carpeta extract):
+#   python benchmark.py fetch --latency 0.05
+
+logger = logging.getLogger(__name__)
+
+
+def _article_jobs(server):
+    return [(path.split("/")[1], server.url + path) for path in server.pages if path.endswith(".html")]
+
+
+def _report(name, count, elapsed):
+    print("{:<12} {:>6} articles {:>8.2f} s {:>10.1f} articles/s".format(name, count, elapsed, count / elapsed))
+
+
+def bench_fetch(args):
+    with StandInServer(load_corpus(), latency=args.latency) as server:
+        jobs = _article_jobs(server)[:args.limit]
+
+        # el ciclo original: un artículo detrás de otro
+        start = time.perf_counter()
+        serial = [extract._fetch_article(news_site_uid, link) for news_site_uid, link in jobs]
+        _report("serial", len([article for article in serial if article]), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        engine = FetchEngine(max_concurrency=args.max_concurrency, site_concurrency=args.site_concurrency)
+        concurrent = engine.run(jobs, extract._fetch_article)
+        _report("async", len([article for article in concurrent if article]), time.perf_counter() - start)
+
+
+def bench_sessions(args):
+    with StandInServer(load_corpus(), latency=args.latency) as server:
+        jobs = _article_jobs(server)[:args.limit]
+
+        # sin sesión: requests.get abre una conexión nueva por cada página
+        before = server.connections_accepted
+        start = time.perf_counter()
+        FetchEngine().run(jobs, lambda news_site_uid, link: requests.get(link).raise_for_status())
+        _report("requests.get", len(jobs), time.perf_counter() - start)
+        print("  connections opened: {}".format(server.connections_accepted - before))
+
+        sessions.close_sessions()
+        before = server.connections_accepted
+        start = time.perf_counter()
+        FetchEngine().run(jobs,
+                          lambda news_site_uid, link: sessions.session_for(news_site_uid).get(link).raise_for_status())
+        _report("session", len(jobs), time.perf_counter() - start)
+        print("  connections opened: {}".format(server.connections_accepted - before))
+        print("  client metrics: {}".format(sessions.metrics()))
+
+
+def bench_parse(args):
+    pages = [(path.split("/")[1], page) for path, page in load_corpus().items() if path.endswith(".html")]
+    total_bytes = sum(len(page.encode("utf-8")) for _, page in pages)
+
+    for backend in args.backends:
+        try:
+            parsers.parse("<html></html>", backend)
+        except ImportError as e:
+            print("{:<12} skipped ({})".format(backend, e))
+            continue
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for news_site_uid, page in pages:
+                selectors = registry()[news_site_uid].selectors
+                document = parsers.parse(page, backend)
+                document.select_text(selectors["article_title"])
+                document.select_text(selectors["article_body"])
+        elapsed = time.perf_counter() - start
+
+        count = len(pages) * args.repeat
+        _report(backend, count, elapsed)
+        print("  {:.2f} MB/s".format(total_bytes * args.repeat / elapsed / 1e6))
+
+
+def bench_selectors(args):
+    # Mismas consultas con el texto del selector y con el selector compilado de sites.registry(). purge vacía el
+    # cache de soupsieve antes de cada página, como pasaría con cientos de sitios (guarda solo unos cientos)
+    pages = [(path.split("/")[1], parsers.parse(page)) for path, page in load_corpus().items()
+             if path.endswith(".html")]
+
+    for name in ("text", "text + purge", "compiled"):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for news_site_uid, document in pages:
+                site = registry()[news_site_uid]
+                if name == "compiled":
+                    selectors = [site.selectors["article_title"], site.selectors["article_body"]]
+                else:
+                    if name == "text + purge":
+                        soupsieve.purge()
+                    selectors = [site.settings["queries"]["article_title"], site.settings["queries"]["article_body"]]
+                for selector in selectors:
+                    document.select_text(selector)
+        _report(name, len(pages) * args.repeat, time.perf_counter() - start)
+
+
+def bench_polite(args):
+    # Un servidor por sitio que acepta `server_rate` peticiones por segundo y contesta 429 a las demás. Sin límite
+    # urllib3 reintenta los 429 con backoff; con crawl_scheduler cada dominio baja su ritmo hasta lo que aguanta el
+    # servidor, y mientras un sitio espera avanzan los otros.
+    pages = load_corpus()
+    robots_txt = "User-agent: *\nCrawl-delay: {}\n".format(args.crawl_delay) if args.crawl_delay else None
+    servers = {news_site_uid: StandInServer(pages, rate_limit=args.server_rate, burst=args.server_burst,
+                                            robots_txt=robots_txt)
+               for news_site_uid in config()["news_sites"]}
+
+    for server in servers.values():
+        server.__enter__()
+    try:
+        jobs = [(news_site_uid, server.url + path) for news_site_uid, server in servers.items()
+                for path in pages if path.startswith("/{}/".format(news_site_uid))][:args.limit]
+
+        for name, enabled in (("unlimited", False), ("polite", True)):
+            config().setdefault("crawl", {}).update({"enabled": enabled, "rate": args.rate, "burst": args.burst})
+            sessions.close_sessions()
+            crawl_scheduler().reset()
+            throttled_before = sum(server.throttled for server in servers.values())
+
+            start = time.perf_counter()
+            articles = FetchEngine().run(jobs, extract._fetch_article)
+            _report(name, len([article for article in articles if article]), time.perf_counter() - start)
+            print("  429 responses: {}".format(sum(server.throttled for server in servers.values())
+                                               - throttled_before))
+            if enabled:
+                print("  crawl metrics: {}".format(crawl_metrics()))
+    finally:
+        for server in servers.values():
+            server.__exit__(None, None, None)
+
+
+def bench_cache(args):
+    with tempfile.TemporaryDirectory() as directory, StandInServer(load_corpus(), latency=args.latency) as server:
+        settings = config().setdefault("http_cache", {})
+        settings.update({"enabled": True, "path": os.path.join(directory, "http_cache.db")})
+        jobs = _article_jobs(server)[:args.limit]
+
+        # primera corrida con el cache vacío, la segunda solo debería recibir 304
+        for name in ("cold cache", "warm cache"):
+            bytes_before, not_modified_before = server.bytes_sent, server.not_modified
+            start = time.perf_counter()
+            articles = FetchEngine().run(jobs, extract._fetch_article)
+            _report(name, len([article for article in articles if article]), time.perf_counter() - start)
+            print("  bytes transferred: {}, 304 responses: {}".format(server.bytes_sent - bytes_before,
+                                                                     server.not_modified - not_modified_before))
+        print("  client metrics: {}".format(http_cache.cache_metrics()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    fetch_parser = subparsers.add_parser("fetch", help="Serial loop vs FetchEngine against a local server")
+    fetch_parser.add_argument("--latency", type=float, default=0.05, help="Simulated network latency in seconds")
+    fetch_parser.add_argument("--limit", type=int, default=None, help="Maximum number of articles to fetch")
+    fetch_parser.add_argument("--max-concurrency", type=int, default=None)
+    fetch_parser.add_argument("--site-concurrency", type=int, default=None)
+    fetch_parser.set_defaults(func=bench_fetch)
+
+    sessions_parser = subparsers.add_parser("sessions", help="Connections opened with and without pooled sessions")
+    sessions_parser.add_argument("--latency", type=float, default=0.0, help="Simulated network latency in seconds")
+    sessions_parser.add_argument("--limit", type=int, default=None, help="Maximum number of articles to fetch")
+    sessions_parser.set_defaults(func=bench_sessions)
+
+    parse_parser = subparsers.add_parser("parse", help="Parse throughput of each parser backend")
+    parse_parser.add_argument("--backends", nargs="+", default=list(parsers.BACKENDS), choices=list(parsers.BACKENDS))
+    parse_parser.add_argument("--repeat", type=int, default=5, help="Passes over the article corpus")
+    parse_parser.set_defaults(func=bench_parse)
+
+    selectors_parser = subparsers.add_parser("selectors", help="CSS selectors compiled per query vs once per site")
+    selectors_parser.add_argument("--repeat", type=int, default=20, help="Passes over the article corpus")
+    selectors_parser.set_defaults(func=bench_selectors)
+
+    polite_parser = subparsers.add_parser("polite", help="Fetching from throttling servers with and without "
+                                                         "per-domain rate limits")
+    polite_parser.add_argument("--server-rate", type=float, default=10, help="Requests/s each server accepts")
+    polite_parser.add_argument("--server-burst", type=int, default=2)
+    polite_parser.add_argument("--rate", type=float, default=20, help="Requests/s we start with per domain")
+    polite_parser.add_argument("--burst", type=int, default=4)
+    polite_parser.add_argument("--crawl-delay", type=float, default=None, help="Crawl-delay in each robots.txt")
+    polite_parser.add_argument("--limit", type=int, default=None, help="Maximum number of articles to fetch")
+    polite_parser.set_defaults(func=bench_polite)
+
+    cache_parser = subparsers.add_parser("cache", help="Bytes transferred with a cold and a warm HTTP cache")
+    cache_parser.add_argument("--latency", type=float, default=0.0, help="Simulated network latency in seconds")
+    cache_parser.add_argument("--limit", type=int, default=None, help="Maximum number of articles to fetch")
+    cache_parser.set_defaults(func=bench_cache)
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    # el cache solo se activa en el benchmark "cache" y el límite por dominio en "polite", en los demás
+    # falsearían los tiempos
+    config().setdefault("http_cache", {})["enabled"] = False
+    config().setdefault("crawl", {})["enabled"] = False
+    args.func(args)
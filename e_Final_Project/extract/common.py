@@ -1,16 +1,35 @@
 # va a permitir cargar la configuración cuando iniciemos nuestro software
-import yaml
+import os
 
-# nos va a servir para cachear la información (esto es importante porque queremos leer a disco y si queremos
-# instalar nuestra configuración en varias partes de nuestro código, no queremos leer a discocada vez que queramos
-# utilizar la configuración)
-__config = None
+import sites
 
+# config.yaml se busca junto a este archivo (o en la ruta que se le pase a sites.load_registry), no en el
+# directorio actual, así el paso extract funciona igual si se corre desde su carpeta o desde pipeline.py
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+
+# La configuración la lee y la valida una sola vez sites.registry() (ver sites.py); config() regresa el mismo
+# diccionario, así no leemos a disco cada vez que queramos utilizar la configuración
 def config():
-    global __config
-    if not __config:
-        with open("config.yaml", mode="r") as file:
-            __config = yaml.safe_load(file)
+    return sites.registry().config
+
+
+def resolve_path(path):
+    # rutas de config.yaml como "seen_urls.db" o "../load/newspaper.db", relativas al archivo de configuración
+    if path is None:
+        return None
+
+    return os.path.join(sites.registry().base_dir, path)
+
+
+# sqlite no acepta más de 999 parámetros por consulta en versiones viejas, así que las consultas con una lista de
+# valores (WHERE ... IN (...)) se hacen por lotes
+SQLITE_BATCH_SIZE = 500
+
 
-    return __config
+def select_in(connection, query, values, batch_size=SQLITE_BATCH_SIZE):
+    # query lleva {} en el lugar de la lista: "SELECT url FROM seen_urls WHERE url IN ({})"
+    values = list(values)
+    for start in range(0, len(values), batch_size):
+        batch = values[start:start + batch_size]
+        yield from connection.execute(query.format(",".join("?" * len(batch))), batch)
@@ -0,0 +1,337 @@
+import email.utils
+import logging
+import threading
+import time
+import urllib.robotparser
+from urllib.parse import urlparse
+
+import requests
+
+from common import config
+
+logger = logging.getLogger(__name__)
+
+# Límite de peticiones por dominio para no saturar a los sitios (ni que nos bloqueen). Cada dominio tiene una cubeta
+# de fichas (token bucket) que se llena a `rate` fichas por segundo hasta `burst`; cada petición gasta una. El rate
+# máximo es el menor entre el de config.yaml y el Crawl-delay / Request-rate del robots.txt del dominio.
+# Si el sitio responde 429 o 503 el rate baja a la mitad (y se espera el Retry-After); con cada respuesta buena va
+# subiendo de nuevo hasta el máximo.
+#
+# Las peticiones pasan por aquí en sessions.PooledAdapter.send, así cuentan todas: portada, artículos y reintentos.
+# El estado es de todo el proceso: los hilos de varios sitios que comparten un dominio comparten su cubeta.
+
+DEFAULT_CRAWL_SETTINGS = {
+    "enabled": True,
+    # peticiones por segundo por dominio
+    "rate": 4.0,
+    "burst": 4,
+    # el rate nunca baja de aquí por más 429 que recibamos
+    "min_rate": 0.2,
+    # reintentos de una petición que recibió 429 / 503
+    "retries": 3,
+    "robots_txt": True,
+    # segundos que se guarda el robots.txt de cada dominio
+    "robots_ttl": 24 * 60 * 60,
+    # el user agent con el que se leen las reglas de robots.txt (el de requests si no se indica)
+    "user_agent": None,
+}
+
+THROTTLE_STATUSES = (429, 503)
+
+# sin Retry-After esperamos esto después de un 429 / 503
+_DEFAULT_PAUSE = 1.0
+# el rate nunca llega a 0 (reserve y delay dividen entre él) aunque min_rate o el robots.txt lo pidan
+_LOWEST_RATE = 0.01
+# si no pudimos leer el robots.txt lo volvemos a intentar después de este tiempo
+_ROBOTS_RETRY = 5 * 60
+
+
+class RobotsDisallowed(requests.exceptions.RequestException):
+    pass
+
+
+def crawl_settings(news_site_uid):
+    # los valores de "crawl" en config.yaml se pueden sobreescribir por sitio
+    settings = dict(DEFAULT_CRAWL_SETTINGS)
+    settings.update(config().get("crawl") or {})
+    settings.update(config()["news_sites"][news_site_uid].get("crawl") or {})
+    if not settings["user_agent"]:
+        settings["user_agent"] = requests.utils.default_user_agent()
+
+    return settings
+
+
+def domain_of(url):
+    parsed = urlparse(url)
+
+    return "{}://{}".format(parsed.scheme, parsed.netloc)
+
+
+def retry_after_seconds(value):
+    # Retry-After viene en segundos o como fecha http
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_crawl_delay(lines, user_agent):
+    # urllib.robotparser solo entiende Crawl-delay enteros y muchos sitios usan 0.5 o 1.5: lo leemos aquí, del grupo
+    # que nombra a nuestro user agent o si no del de "*"
+    agent = user_agent.split("/")[0].lower()
+    delays = {}
+    group, in_rules = [], False
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if ":" not in line:
+            continue
+        field, value = (part.strip() for part in line.split(":", 1))
+        field = field.lower()
+        if field == "user-agent":
+            # varias líneas User-agent seguidas comparten las mismas reglas
+            if in_rules:
+                group, in_rules = [], False
+            group.append(value.lower())
+        else:
+            in_rules = True
+            if field == "crawl-delay":
+                try:
+                    delay = float(value)
+                except ValueError:
+                    continue
+                for name in group:
+                    delays.setdefault(name, delay)
+
+    for name, delay in delays.items():
+        if name != "*" and name in agent:
+            return delay
+
+    return delays.get("*")
+
+
+class DomainBucket:
+    def __init__(self, rate, burst, min_rate):
+        self.max_rate = max(_LOWEST_RATE, rate)
+        self.rate = self.max_rate
+        self.burst = max(1, burst)
+        self.min_rate = min(max(_LOWEST_RATE, min_rate), self.max_rate)
+        # puede quedar negativo: son las peticiones que ya reservaron su turno y están esperando
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now):
+        # durante una pausa no se juntan fichas, si no al terminar saldría una ráfaga que nos vuelve a frenar
+        if now > self._updated:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def reserve(self, now):
+        # gasta una ficha y regresa cuántos segundos hay que esperar para usarla
+        self._refill(now)
+        self._tokens -= 1
+
+        return max(0.0, -self._tokens / self.rate, self._paused_until - now)
+
+    def delay(self, now):
+        # cuánto falta para que haya una ficha, sin gastarla
+        self._refill(now)
+
+        return max(0.0, (1 - self._tokens) / self.rate, self._paused_until - now)
+
+    def limit(self, rate, burst):
+        # el robots.txt pide ir más despacio
+        self.max_rate = min(self.max_rate, max(_LOWEST_RATE, rate))
+        self.min_rate = min(self.min_rate, self.max_rate)
+        self.rate = min(self.rate, self.max_rate)
+        self.burst = min(self.burst, max(1, burst))
+        self._tokens = min(self._tokens, self.burst)
+
+    def throttled(self, now, pause):
+        # las peticiones que ya iban en camino también reciben 429: solo bajamos el rate una vez por pausa
+        if now < self._paused_until:
+            return False
+
+        self._refill(now)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._paused_until = now + pause
+        self._tokens = min(self._tokens, 0.0)
+        self._updated = self._paused_until
+
+        return True
+
+    def succeeded(self):
+        # sube un 1% del máximo por respuesta buena: unas 100 respuestas para volver al máximo, así no regresamos
+        # enseguida al ritmo que provocó el 429
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.01)
+
+
+class DomainMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.throttled = 0
+        self.disallowed = 0
+        self.waited = 0.0
+        self.crawl_delay = None
+
+    def as_dict(self, bucket):
+        return {"requests": self.requests, "throttled": self.throttled, "disallowed": self.disallowed,
+                "waited_seconds": round(self.waited, 3), "rate": round(bucket.rate, 3),
+                "crawl_delay": self.crawl_delay}
+
+
+class CrawlScheduler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # dominio --> DomainBucket, DomainMetrics, (RobotFileParser, vigente hasta), lock para leer el robots.txt
+        self._buckets = {}
+        self._metrics = {}
+        self._robots = {}
+        self._robots_locks = {}
+
+    def _bucket(self, domain, settings):
+        # la cubeta se crea con la configuración del primer sitio que usa el dominio
+        with self._lock:
+            if domain not in self._buckets:
+                self._buckets[domain] = DomainBucket(settings["rate"], settings["burst"], settings["min_rate"])
+                self._metrics[domain] = DomainMetrics()
+                self._robots_locks[domain] = threading.Lock()
+
+            return self._buckets[domain], self._metrics[domain]
+
+    def _robots_for(self, domain, settings):
+        with self._robots_locks[domain]:
+            robots, expires = self._robots.get(domain, (None, 0))
+            if time.monotonic() < expires:
+                return robots
+
+            robots, crawl_delay, ttl = self._read_robots(domain, settings)
+            self._robots[domain] = (robots, time.monotonic() + ttl)
+            if robots is not None:
+                self._apply_robots(domain, robots, crawl_delay, settings)
+
+            return robots
+
+    @staticmethod
+    def _read_robots(domain, settings):
+        url = "{}/robots.txt".format(domain)
+        try:
+            response = requests.get(url, headers={"User-Agent": settings["user_agent"]}, timeout=10)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Could not read {} ({}), crawling without it".format(url, e))
+            return None, None, _ROBOTS_RETRY
+
+        if response.status_code >= 500:
+            logger.warning("Could not read {} (HTTP {}), crawling without it".format(url, response.status_code))
+            return None, None, _ROBOTS_RETRY
+
+        robots = urllib.robotparser.RobotFileParser(url)
+        crawl_delay = None
+        if response.status_code >= 400:
+            # sin robots.txt todo está permitido
+            robots.allow_all = True
+            robots.modified()
+        else:
+            lines = response.text.splitlines()
+            robots.parse(lines)
+            crawl_delay = parse_crawl_delay(lines, settings["user_agent"])
+
+        return robots, crawl_delay, settings["robots_ttl"]
+
+    def _apply_robots(self, domain, robots, crawl_delay, settings):
+        request_rate = robots.request_rate(settings["user_agent"])
+        bucket, metrics = self._bucket(domain, settings)
+        with self._lock:
+            metrics.crawl_delay = crawl_delay
+            if crawl_delay and crawl_delay > 0:
+                # una petición cada crawl_delay segundos, sin ráfagas
+                bucket.limit(1.0 / crawl_delay, 1)
+            # un Request-rate con 0 segundos no dice nada
+            if request_rate and request_rate.seconds:
+                bucket.limit(request_rate.requests / float(request_rate.seconds), max(1, request_rate.requests))
+        if crawl_delay or request_rate:
+            logger.info("{} asks for crawl-delay {} and request-rate {}, rate limited to {:.2f} requests/s".format(
+                domain, crawl_delay, request_rate, bucket.max_rate))
+
+    def wait(self, url, settings):
+        # Se llama justo antes de cada petición: revisa robots.txt y espera el turno del dominio
+        domain = domain_of(url)
+        bucket, metrics = self._bucket(domain, settings)
+        if settings["robots_txt"]:
+            robots = self._robots_for(domain, settings)
+            if robots is not None and not robots.can_fetch(settings["user_agent"], url):
+                with self._lock:
+                    metrics.disallowed += 1
+                raise RobotsDisallowed("{} is disallowed by {}/robots.txt".format(url, domain))
+
+        with self._lock:
+            delay = bucket.reserve(time.monotonic())
+            metrics.requests += 1
+            metrics.waited += delay
+        if delay:
+            time.sleep(delay)
+
+    def delay(self, url):
+        # cuánto le falta al dominio para tener una ficha libre (0 si todavía no hemos hablado con él)
+        domain = domain_of(url)
+        with self._lock:
+            bucket = self._buckets.get(domain)
+
+            return bucket.delay(time.monotonic()) if bucket else 0.0
+
+    def record(self, url, status_code, retry_after=None):
+        domain = domain_of(url)
+        with self._lock:
+            bucket = self._buckets.get(domain)
+            if bucket is None:
+                return
+            if status_code in THROTTLE_STATUSES:
+                self._metrics[domain].throttled += 1
+                pause = retry_after_seconds(retry_after)
+                if bucket.throttled(time.monotonic(), _DEFAULT_PAUSE if pause is None else pause):
+                    logger.warning("{} answered {}, slowing down to {:.2f} requests/s".format(domain, status_code,
+                                                                                              bucket.rate))
+            else:
+                bucket.succeeded()
+
+    def metrics(self):
+        with self._lock:
+            return {domain: self._metrics[domain].as_dict(bucket) for domain, bucket in self._buckets.items()}
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self._metrics.clear()
+            self._robots.clear()
+            self._robots_locks.clear()
+
+
+def interleave(jobs, key=lambda job: domain_of(job[1])):
+    # Reparte los trabajos por turnos entre dominios (a, b, c, a, b, c, ...): mientras un dominio espera su ficha
+    # los demás pueden avanzar, en lugar de tener todos los trabajos de un sitio formados al principio
+    queues = {}
+    for job in jobs:
+        queues.setdefault(key(job), []).append(job)
+
+    interleaved = []
+    for position in range(max((len(queue) for queue in queues.values()), default=0)):
+        interleaved.extend(queue[position] for queue in queues.values() if position < len(queue))
+
+    return interleaved
+
+
+__scheduler = CrawlScheduler()
+
+
+def crawl_scheduler():
+    return __scheduler
+
+
+def crawl_metrics():
+    return __scheduler.metrics()
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common import config
+from crawl_scheduler import crawl_scheduler, domain_of, interleave
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_SITE_CONCURRENCY = 4
+
+# Un pool de hilos por proceso (por cada max_concurrency): todos los FetchEngine descargan en los mismos hilos, así
+# el límite global es de verdad global aunque corran varios extract a la vez. Los trabajos que no caben esperan en
+# la cola del pool sin ocupar un hilo.
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _shared_executor(max_workers):
+    with _executors_lock:
+        if max_workers not in _executors:
+            _executors[max_workers] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+
+        return _executors[max_workers]
+
+
+class FetchEngine:
+    # Descarga varios artículos al mismo tiempo. La función fetch sigue siendo bloqueante (requests + ArticlePage),
+    # asyncio solo se encarga de repartirla en hilos respetando un límite global y otro por sitio.
+    def __init__(self, max_concurrency=None, site_concurrency=None):
+        settings = config().get("fetch") or {}
+        self._max_concurrency = max_concurrency or settings.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)
+        self._site_concurrency = site_concurrency or settings.get("site_concurrency", DEFAULT_SITE_CONCURRENCY)
+
+    def site_limit(self, news_site_uid):
+        site_config = config()["news_sites"][news_site_uid]
+
+        return min(site_config.get("max_concurrency", self._site_concurrency), self._max_concurrency)
+
+    def run(self, jobs, fetch, on_result=None):
+        # jobs: lista de tuplas (news_site_uid, link)
+        # fetch: función fetch(news_site_uid, link) que regresa el artículo (o None)
+        # Sin on_result regresa los resultados en el mismo orden que jobs. Con on_result se llama
+        # on_result(news_site_uid, link, result) en cuanto termina cada descarga y no se guarda nada en memoria.
+        return asyncio.run(self._run(list(jobs), fetch, on_result))
+
+    async def _run(self, jobs, fetch, on_result):
+        loop = asyncio.get_running_loop()
+        scheduler = crawl_scheduler()
+        executor = _shared_executor(self._max_concurrency)
+        # el límite por sitio es de esta llamada y queda debajo del global
+        site_limits = {news_site_uid: asyncio.Semaphore(self.site_limit(news_site_uid))
+                       for news_site_uid in set(news_site_uid for news_site_uid, _ in jobs)}
+
+        logger.info("Fetching {} links with {} workers".format(len(jobs), self._max_concurrency))
+
+        async def fetch_job(news_site_uid, link):
+            # primero el límite del sitio, así un sitio lento no acapara los hilos del pool
+            async with site_limits[news_site_uid]:
+                # esperamos el turno del dominio (crawl_scheduler) sin ocupar un hilo, así mientras tanto avanzan
+                # las descargas de los otros sitios
+                delay = scheduler.delay(link)
+                if delay:
+                    await asyncio.sleep(delay)
+                result = await loop.run_in_executor(executor, fetch, news_site_uid, link)
+
+            if on_result is None:
+                return result
+
+            # on_result corre en el hilo del event loop, así que nunca se llama dos veces al mismo tiempo
+            on_result(news_site_uid, link, result)
+
+        # las tareas arrancan por turnos entre dominios, los resultados regresan en el orden de jobs
+        order = interleave(range(len(jobs)), key=lambda index: domain_of(jobs[index][1]))
+        tasks = {index: asyncio.ensure_future(fetch_job(*jobs[index])) for index in order}
+
+        return await asyncio.gather(*(tasks[index] for index in range(len(jobs))))
@@ -0,0 +1,126 @@
+import datetime
+import logging
+import sqlite3
+
+from common import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FRONTIER_SETTINGS = {
+    "path": "frontier.db",
+    # links de artículos en cola por sitio; al pasarse se descartan los de menor prioridad
+    "max_size": 10000,
+    # páginas que se recorren de cada sección (la primera y las siguientes con la consulta pagination_next)
+    "max_pages": 1,
+    # artículos que se descargan por sitio en cada corrida (None: todos), los demás se quedan para la siguiente
+    "max_articles_per_run": None,
+    # links que se sacan de la cola a la vez, así en memoria solo está un lote
+    "batch_size": 200,
+    # secciones además de la portada, rutas relativas a la url del sitio ("/mundo", "/economia/")
+    "sections": [],
+}
+
+
+def frontier_settings(news_site_uid):
+    # los valores de "frontier" en config.yaml se pueden sobreescribir por sitio (sections casi siempre es por sitio)
+    settings = dict(DEFAULT_FRONTIER_SETTINGS)
+    settings.update(config().get("frontier") or {})
+    settings.update(config()["news_sites"][news_site_uid].get("frontier") or {})
+
+    return settings
+
+
+class Frontier:
+    # Cola de links de artículos por descargar, guardada en disco: lo que no se alcanzó a descargar en una corrida
+    # se descarga en la siguiente. Cada url está una sola vez; sale primero la de menor prioridad (0 = encontrada en
+    # la portada o en la primera página de una sección, 1 = en la segunda página, ...) y con la misma prioridad la
+    # que se encontró antes.
+    #
+    # take() no borra los links, solo los marca como tomados; se borran con remove_taken() cuando los artículos ya
+    # están guardados (en el archivo de extract, o en newspaper.db con pipeline.py). Si el proceso se cae antes,
+    # release() los regresa a la cola.
+    def __init__(self, path, max_size=DEFAULT_FRONTIER_SETTINGS["max_size"]):
+        self.path = path
+        self.max_size = max_size
+        # los hilos de varios sitios (pipeline.py) escriben en el mismo archivo, cada uno con su conexión
+        self._connection = sqlite3.connect(path, timeout=60)
+        # id: orden en que se encontraron los links
+        self._connection.execute("CREATE TABLE IF NOT EXISTS frontier ("
+                                 "id INTEGER PRIMARY KEY, "
+                                 "url TEXT NOT NULL UNIQUE, "
+                                 "news_site_uid TEXT NOT NULL, "
+                                 "priority INTEGER NOT NULL, "
+                                 "discovered_at TEXT NOT NULL, "
+                                 "taken INTEGER NOT NULL DEFAULT 0)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS frontier_order "
+                                 "ON frontier (news_site_uid, taken, priority, id)")
+
+    def push_many(self, news_site_uid, urls, priority=0):
+        # Agrega los links que no estaban; si uno ya estaba con menor prioridad (un número mayor) se la subimos.
+        # Regresa cuántos links nuevos quedaron en la cola.
+        before = self.size(news_site_uid)
+        now = datetime.datetime.now().isoformat()
+        with self._connection:
+            self._connection.executemany("INSERT INTO frontier (url, news_site_uid, priority, discovered_at) "
+                                         "VALUES (?, ?, ?, ?) "
+                                         "ON CONFLICT (url) DO UPDATE SET priority = MIN(priority, excluded.priority)",
+                                         ((url, news_site_uid, priority, now) for url in urls))
+        added = self.size(news_site_uid) - before
+        dropped = self._trim(news_site_uid)
+
+        return added - dropped
+
+    def _trim(self, news_site_uid):
+        # la cola no crece más de max_size links por sitio: se van los de menor prioridad, y entre ellos los más
+        # recientes (los que llevan más tiempo esperando ya están cerca de salir). Los tomados no se tocan.
+        excess = self.size(news_site_uid) - self.max_size
+        if excess <= 0:
+            return 0
+
+        with self._connection:
+            dropped = self._connection.execute("DELETE FROM frontier WHERE id IN ("
+                                               "SELECT id FROM frontier WHERE news_site_uid = ? AND taken = 0 "
+                                               "ORDER BY priority DESC, id DESC LIMIT ?)",
+                                               (news_site_uid, excess)).rowcount
+        logger.info("Frontier of {} is full, dropped {} links".format(news_site_uid, dropped))
+
+        return dropped
+
+    def peek(self, news_site_uid, limit):
+        # los siguientes links por descargar, sin tomarlos
+        return [url for url, in self._connection.execute("SELECT url FROM frontier "
+                                                         "WHERE news_site_uid = ? AND taken = 0 "
+                                                         "ORDER BY priority, id LIMIT ?", (news_site_uid, limit))]
+
+    def take(self, news_site_uid, limit):
+        # los siguientes links por descargar; siguen en la cola (marcados) hasta remove_taken o release
+        with self._connection:
+            rows = self._connection.execute("SELECT id, url FROM frontier WHERE news_site_uid = ? AND taken = 0 "
+                                            "ORDER BY priority, id LIMIT ?", (news_site_uid, limit)).fetchall()
+            self._connection.executemany("UPDATE frontier SET taken = 1 WHERE id = ?", ((id_,) for id_, _ in rows))
+
+        return [url for _, url in rows]
+
+    def remove_taken(self, news_site_uid):
+        with self._connection:
+            return self._connection.execute("DELETE FROM frontier WHERE news_site_uid = ? AND taken = 1",
+                                            (news_site_uid,)).rowcount
+
+    def release(self, news_site_uid):
+        # regresa a la cola los links tomados por una corrida que no terminó
+        with self._connection:
+            return self._connection.execute("UPDATE frontier SET taken = 0 WHERE news_site_uid = ? AND taken = 1",
+                                            (news_site_uid,)).rowcount
+
+    def size(self, news_site_uid=None):
+        if news_site_uid is None:
+            return self._connection.execute("SELECT COUNT(*) FROM frontier").fetchone()[0]
+
+        return self._connection.execute("SELECT COUNT(*) FROM frontier WHERE news_site_uid = ?",
+                                        (news_site_uid,)).fetchone()[0]
+
+    def __len__(self):
+        return self.size()
+
+    def close(self):
+        self._connection.close()
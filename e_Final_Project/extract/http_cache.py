@@ -0,0 +1,140 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from common import config, resolve_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = "http_cache.db"
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+
+class HttpCache:
+    # Cache en disco de las respuestas que traen ETag o Last-Modified. En la siguiente corrida mandamos una
+    # petición condicional y si el servidor responde 304 usamos el cuerpo guardado en lugar de bajarlo otra vez.
+    # Cuando el cache pasa de max_bytes se borran las entradas que se usaron hace más tiempo (LRU).
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        # hits, misses y bytes_saved por sitio: los sitios comparten el cache pero cada extract reporta lo suyo
+        self._site_metrics = {}
+        # los hilos del FetchEngine comparten la misma conexión
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                 "url TEXT PRIMARY KEY, "
+                                 "etag TEXT, "
+                                 "last_modified TEXT, "
+                                 "body BLOB NOT NULL, "
+                                 "size INTEGER NOT NULL, "
+                                 "last_access REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def conditional_headers(self, url):
+        with self._lock:
+            row = self._connection.execute("SELECT etag, last_modified FROM responses WHERE url = ?",
+                                           (url,)).fetchone()
+        if row is None:
+            return {}
+
+        etag, last_modified = row
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        return headers
+
+    def cached_body(self, url, news_site_uid):
+        # se llama cuando el servidor respondió 304
+        with self._lock:
+            row = self._connection.execute("SELECT body FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+
+            with self._connection:
+                self._connection.execute("UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), url))
+            self._count(news_site_uid, hits=1, bytes_saved=len(row[0]))
+
+        return row[0]
+
+    def store(self, url, response, news_site_uid):
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        with self._lock:
+            self._count(news_site_uid, misses=1)
+            if not etag and not last_modified:
+                # sin validadores no hay forma de preguntar si cambió
+                return
+
+            body = response.content
+            with self._connection:
+                previous = self._connection.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+                self._connection.execute("INSERT OR REPLACE INTO responses "
+                                         "(url, etag, last_modified, body, size, last_access) "
+                                         "VALUES (?, ?, ?, ?, ?, ?)",
+                                         (url, etag, last_modified, body, len(body), time.time()))
+                self._size += len(body) - (previous[0] if previous else 0)
+                self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            rows = self._connection.execute("SELECT url, size FROM responses "
+                                            "ORDER BY last_access LIMIT 100").fetchall()
+            if not rows:
+                break
+
+            for url, size in rows:
+                self._connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self._size -= size
+                if self._size <= self.max_bytes:
+                    break
+
+    def _count(self, news_site_uid, **counts):
+        site_metrics = self._site_metrics.setdefault(news_site_uid, {"hits": 0, "misses": 0, "bytes_saved": 0})
+        for name, count in counts.items():
+            site_metrics[name] += count
+
+    def metrics(self, news_site_uid=None):
+        # los contadores de un sitio, o la suma de todos si no se pasa news_site_uid
+        with self._lock:
+            if news_site_uid is None:
+                sites = list(self._site_metrics.values())
+            else:
+                sites = [self._site_metrics.get(news_site_uid, {})]
+            metrics = {name: sum(site.get(name, 0) for site in sites) for name in ("hits", "misses", "bytes_saved")}
+            metrics["size"] = self._size
+
+        return metrics
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+__cache = None
+__cache_lock = threading.Lock()
+
+
+def cache_for(news_site_uid):
+    # Regresa el cache compartido si está activo para el sitio, si no None
+    global __cache
+    settings = config().get("http_cache") or {}
+    enabled = config()["news_sites"][news_site_uid].get("http_cache", settings.get("enabled", False))
+    if not enabled:
+        return None
+
+    with __cache_lock:
+        if __cache is None:
+            __cache = HttpCache(resolve_path(settings.get("path", DEFAULT_CACHE_PATH)),
+                                settings.get("max_bytes", DEFAULT_MAX_BYTES))
+
+        return __cache
+
+
+def cache_metrics(news_site_uid=None):
+    return __cache.metrics(news_site_uid) if __cache is not None else {}
@@ -1,13 +1,17 @@
 import argparse
 import datetime
-import csv
 import logging
 import news_page_objects as news
 import re  # for regular expressions
-from common import config
-
-from requests.exceptions import HTTPError
-from urllib3.exceptions import MaxRetryError
+from common import config, resolve_path
+from crawl_scheduler import crawl_metrics
+from fetcher import FetchEngine
+from frontier import Frontier, frontier_settings
+from http_cache import cache_metrics
+from sessions import metrics as session_metrics
+from sites import DEFAULT_CONFIG_PATH, load_registry, registry
+from url_index import UrlIndex, DEFAULT_INDEX_PATH
+from writer import WRITERS, DEFAULT_FLUSH_EVERY
 
 logging.basicConfig(level=logging.INFO)
 
@@ -22,39 +26,150 @@ is_root_path = re.compile(r"^/.+$")  # /some-text
 logger = logging.getLogger(__name__)
 
 
-def _news_scraper(news_site_uid):
-    host = config()["news_sites"][news_site_uid]["url"]
+def _news_scraper(news_site_uid, full=False, writer=None, output_format="csv", mark_seen=True):
+    # writer: por defecto escribe el archivo del día (CSV o Parquet según output_format),
+    # pipeline.py manda un FrameWriter
+    # mark_seen: con False las urls no se marcan como vistas ni salen de la cola al terminar; pipeline.py llama a
+    #            _mark_seen hasta que el paso load guardó los artículos, porque el FrameWriter no deja un archivo del
+    #            cual retomar
+    host = registry()[news_site_uid].url
 
     logging.info("Beginning scraper for {}".format(host))
+    settings = frontier_settings(news_site_uid)
+    url_index = _url_index()
+    frontier = _frontier(news_site_uid)
+    # los links que tomó una corrida que no terminó regresan a la cola (los que alcanzaron a quedar en el checkpoint
+    # del archivo se saltan con written_links)
+    released = frontier.release(news_site_uid)
+    if released:
+        logger.info("{} links of an unfinished run are back in the frontier".format(released))
+
+    # los links de la portada, de las secciones y de sus páginas siguientes se juntan en la cola (frontier.py) con
+    # los que quedaron pendientes de corridas anteriores
+    _harvest_links(news_site_uid, settings, frontier, url_index, full)
+
+    # cada artículo se escribe en el archivo en cuanto termina de descargarse, así la memoria no crece con el número
+    # de links y si el proceso se cae podemos retomar desde el último checkpoint
+    if writer is None:
+        flush_every = (config().get("fetch") or {}).get("flush_every", DEFAULT_FLUSH_EVERY)
+        writer = WRITERS[output_format](_output_filename(news_site_uid, output_format), flush_every=flush_every)
+
+    with writer:
+        def save_article(news_site_uid, link, article):
+            if article:
+                logger.info("Article fetched!!")
+                writer.write(article)
+                print(article.title)
+
+        # la cola se vacía por lotes: en memoria solo están los links del lote
+        budget = settings["max_articles_per_run"]
+        attempted = 0
+        while budget is None or attempted < budget:
+            limit = settings["batch_size"] if budget is None else min(settings["batch_size"], budget - attempted)
+            batch = frontier.take(news_site_uid, limit)
+            if not batch:
+                break
+
+            # solo descargamos los artículos que no hemos visto en corridas anteriores (a menos que pidamos --full)
+            links = batch if full else url_index.unseen(batch)
+            jobs = [(news_site_uid, link) for link in links if link not in writer.written_links]
+            FetchEngine().run(jobs, _fetch_article, on_result=save_article)
+            attempted += len(jobs)
+
+    url_index.close()
+    logger.info("{} links still waiting in the frontier of {}".format(frontier.size(news_site_uid), news_site_uid))
+    frontier.close()
+
+    # marcamos las urls como vistas hasta que la corrida terminó bien
+    if mark_seen:
+        _mark_seen(news_site_uid, writer.written_links)
+
+    print(writer.rows_written)
+    logger.info("HTTP session metrics: {}".format(session_metrics()))
+    logger.info("HTTP cache metrics: {}".format(cache_metrics(news_site_uid)))
+    logger.info("Crawl metrics: {}".format(crawl_metrics()))
+
+    return writer
+
+
+def _mark_seen(news_site_uid, links):
+    url_index = _url_index()
+    url_index.add_many(links)
+    url_index.close()
+
+    # solo entonces salen de la cola los links que tomó la corrida (también los que fallaron; si siguen publicados
+    # se vuelven a encontrar). Si la corrida no llega aquí, la siguiente los regresa a la cola con release()
+    frontier = _frontier(news_site_uid)
+    frontier.remove_taken(news_site_uid)
+    frontier.close()
+
+
+def _harvest_links(news_site_uid, settings, frontier, url_index, full=False):
+    # Recorre las páginas de listado por niveles: la portada y las secciones (nivel 0), sus páginas siguientes
+    # (nivel 1), ... hasta max_pages niveles. Los links de artículos nuevos van a la cola con el nivel como prioridad.
+    host = registry()[news_site_uid].url
     home_page = news.HomePage(news_site_uid, host)
+    sections = [host + section for section in settings["sections"]]
+    pages = [home_page] + _fetch_pages(news_site_uid, sections)
+    listing_pages, found, queued = 0, 0, 0
+
+    for depth in range(settings["max_pages"]):
+        next_urls = []
+        for page in pages:
+            links = list(page.article_links)
+            new_links = links if full else url_index.unseen(links)
+            queued += frontier.push_many(news_site_uid, new_links, priority=depth)
+            found += len(links)
+            next_url = getattr(page, "next_page", None)
+            if next_url:
+                next_urls.append(next_url)
+        listing_pages += len(pages)
+
+        if not next_urls or depth + 1 == settings["max_pages"]:
+            break
+        pages = _fetch_pages(news_site_uid, next_urls)
+
+    logger.info("{} new links out of {} on {} listing pages, {} links in the frontier".format(
+        queued, found, listing_pages, frontier.size(news_site_uid)))
+
 
-    articles = []
-    for link in home_page.article_links:
-        article = _fetch_article(news_site_uid, link)
+def _fetch_pages(news_site_uid, urls):
+    pages = FetchEngine().run([(news_site_uid, url) for url in urls], _fetch_section)
 
-        if article:
-            logger.info("Article fetched!!")
-            articles.append(article)
-            print(article.title)
+    return [page for page in pages if page is not None]
 
-    print(len(articles))
-    _save_articles(news_site_uid, articles)
+
+def _fetch_section(news_site_uid, link):
+    # una sección que no se pudo leer no detiene la corrida, solo nos quedamos sin sus links
+    try:
+        return news.SectionPage(news_site_uid, link)
+    except Exception as e:
+        logger.warning("Error while fetching the section page {} ({})".format(link, e))
+
+        return None
 
 
-def _save_articles(news_site_uid, articles):
+def _frontier(news_site_uid):
+    settings = frontier_settings(news_site_uid)
+
+    return Frontier(resolve_path(settings["path"]), max_size=settings["max_size"])
+
+
+def _url_index():
+    settings = config().get("url_index") or {}
+
+    return UrlIndex(resolve_path(settings.get("path", DEFAULT_INDEX_PATH)),
+                    seed_db=resolve_path(settings.get("seed_db")))
+
+
+def _output_filename(news_site_uid, output_format="csv"):
     now = datetime.datetime.now().strftime("%Y_%m_%d")
-    out_file_name = "{news_site_uid}_{datetime}_articles.csv".format(
+
+    return "{news_site_uid}_{datetime}_articles.{extension}".format(
         news_site_uid=news_site_uid,
-        datetime=now
+        datetime=now,
+        extension=output_format
     )
-    csv_headers = list(filter(lambda property: not property.startswith("_"), dir(articles[0])))
-    with open(out_file_name, mode="w+", newline="") as file:
-        writer = csv.writer(file)
-        writer.writerow(csv_headers)
-
-        for article in articles:
-            row = [str(getattr(article, prop))for prop in csv_headers]
-            writer.writerow(row)
 
 
 def _fetch_article(news_site_uid, link):
@@ -87,13 +202,27 @@ if __name__ == "__main__":
     # parecido a ClI, solo que un poco más fácil
     parser = argparse.ArgumentParser()
 
-    news_site_choices = list(config()["news_sites"].keys())
     # Le añadimos opciones
     parser.add_argument("news_site",
                         help="The new site that you want to scrape",
+                        type=str)
+    parser.add_argument("--config",
+                        help="Configuration file with the news sites",
                         type=str,
-                        choices=news_site_choices)
+                        default=DEFAULT_CONFIG_PATH)
+    parser.add_argument("--full",
+                        help="Fetch every article on the homepage, even the ones already seen",
+                        action="store_true")
+    parser.add_argument("--format",
+                        help="Output file format",
+                        choices=list(WRITERS),
+                        default="csv")
 
     # parsear
     args = parser.parse_args()
-    _news_scraper(args.news_site)
+    # los sitios válidos salen del archivo de configuración, que se lee y valida aquí una sola vez
+    load_registry(args.config)
+    if args.news_site not in registry():
+        parser.error("argument news_site: invalid choice: {!r} (choose from {})".format(
+            args.news_site, ", ".join(registry().uids)))
+    _news_scraper(args.news_site, full=args.full, output_format=args.format)
@@ -1,29 +1,59 @@
-import requests
-import bs4
+import hashlib
+
+import parsers
 import validators
-from common import config
+from http_cache import cache_for
+from sessions import session_for
+from sites import registry
 
 
 class NewsPage:
 
     def __init__(self, news_site_uid, url):
         self._url = url
-        self._config = config()["news_sites"][news_site_uid]
-        self._queries = self._config["queries"]
+        self._news_site_uid = news_site_uid
+        site = registry()[news_site_uid]
+        self._config = site.settings
+        # selectores ya compilados (ver sites.py)
+        self._selectors = site.selectors
         self._html = None
 
         self._visit(url)
 
-    def _select(self, query_string):
-        return self._html.select(query_string)
+    def _select_text(self, selector):
+        return self._html.select_text(selector)
 
-    def _visit(self, url):
-        response = requests.get(url)
-        response.encoding = "utf-8"
+    def _select_attribute(self, selector, attribute):
+        return self._html.select_attribute(selector, attribute)
 
-        # nos permite lanzar un error si la solicitud no fue concluida correctamente
-        response.raise_for_status()
-        self._html = bs4.BeautifulSoup(response.text, "html.parser")
+    def _visit(self, url):
+        # si el cache está activo para el sitio hacemos una petición condicional (If-None-Match / If-Modified-Since)
+        cache = cache_for(self._news_site_uid)
+        headers = cache.conditional_headers(url) if cache else {}
+
+        # reutilizamos la sesión del sitio para no abrir una conexión (y un handshake TLS) por cada página
+        response = session_for(self._news_site_uid).get(url, headers=headers)
+        body = None
+        if cache and response.status_code == 304:
+            body = cache.cached_body(url, self._news_site_uid)
+            if body is None:
+                # la entrada se borró del cache mientras tanto, la pedimos completa
+                response = session_for(self._news_site_uid).get(url)
+
+        if body is not None:
+            text = body.decode("utf-8", errors="replace")
+        else:
+            response.encoding = "utf-8"
+
+            # nos permite lanzar un error si la solicitud no fue concluida correctamente
+            response.raise_for_status()
+            text = response.text
+            if cache:
+                cache.store(url, response, self._news_site_uid)
+
+        # el parser se elige por sitio en config.yaml (html.parser, lxml o selectolax)
+        backend = self._config.get("parser", registry().config.get("parser", parsers.DEFAULT_PARSER))
+        self._html = parsers.parse(text, backend)
 
 
 class HomePage(NewsPage):
@@ -33,30 +63,67 @@ class HomePage(NewsPage):
 
     @property
     def article_links(self):
+        return self._links(self._selectors["homepage_article_links"])
+
+    def _links(self, selector):
         link_list = []
-        for link in self._select(self._queries["homepage_article_links"]):
-            if link and link.has_attr("href"):
-                if not validators.url(link["href"]):
-                    link_list.append(self._config["url"] + link["href"])
+        for href in self._select_attribute(selector, "href"):
+            if not validators.url(href):
+                link_list.append(self._config["url"] + href)
+
+        # sin repetidos y en el orden de la página (los primeros son los destacados), así salen antes de la cola
+        return list(dict.fromkeys(link_list))
 
-        return set(link for link in link_list)
+
+class SectionPage(HomePage):
+    # Una sección del sitio (o una de sus páginas siguientes). Los links a artículos se buscan con la consulta
+    # section_article_links, o con la de la portada si el sitio no la define.
+    @property
+    def article_links(self):
+        return self._links(self._selectors.get("section_article_links", self._selectors["homepage_article_links"]))
+
+    @property
+    def next_page(self):
+        # link de la consulta pagination_next (None si el sitio no la define o la página es la última)
+        if "pagination_next" not in self._selectors:
+            return None
+
+        hrefs = self._select_attribute(self._selectors["pagination_next"], "href")
+        if not hrefs:
+            return None
+
+        return hrefs[0] if validators.url(hrefs[0]) else self._config["url"] + hrefs[0]
 
 
 class ArticlePage(NewsPage):
     def __init__(self, news_site_uid, url):
         super(ArticlePage, self).__init__(news_site_uid, url)
+        # Extraemos todos los campos "article_*" de una sola vez y soltamos el árbol del parser,
+        # así cada artículo en memoria solo guarda los strings que nos interesan
+        self._fields = self._extract_fields()
+        self._html = None
+
+    def _extract_fields(self):
+        fields = {}
+        for query_name, selector in self._selectors.items():
+            if query_name.startswith("article_"):
+                fields[query_name[len("article_"):]] = self._select_text(selector)
+
+        return fields
 
     @property
     def body(self):
-        result = self._select(self._queries["article_body"])
-
-        return result[0].text if len(result) else ""
+        return self._fields.get("body", "")
 
     @property
     def title(self):
-        result = self._select(self._queries["article_title"])
+        return self._fields.get("title", "")
 
-        return result[0].text if len(result) else ""
+    @property
+    def content_hash(self):
+        # huella del contenido: el uid solo depende de la url, con esto sabemos si un artículo que ya teníamos
+        # cambió (transform --skip-unchanged). transform/main.py la calcula igual para los archivos viejos.
+        return hashlib.md5("{}\n{}".format(self.title, self.body).encode()).hexdigest()
 
     @property
     def article_links(self):
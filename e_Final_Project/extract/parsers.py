@@ -0,0 +1,77 @@
+import bs4
+import soupsieve
+
+# Backends para convertir el html en un documento que entienda los selectores CSS de config.yaml.
+#   html.parser --> el parser de python (no necesita nada extra, pero es el más lento)
+#   lxml        --> BeautifulSoup con el parser de lxml (pip install lxml)
+#   selectolax  --> parser en C con selectores nativos (pip install selectolax), el más rápido
+
+DEFAULT_PARSER = "html.parser"
+
+
+class Selector:
+    # Selector CSS compilado una sola vez (con soupsieve, lo mismo que hace BeautifulSoup.select en cada llamada).
+    # selectolax compila sus selectores en C en cada consulta, a él solo le pasamos el texto.
+    def __init__(self, query):
+        if not isinstance(query, str):
+            raise TypeError("A CSS selector must be a string, not {!r}".format(query))
+        self.query = query
+        try:
+            self.compiled = soupsieve.compile(query)
+        except soupsieve.SelectorSyntaxError as e:
+            raise ValueError(str(e).splitlines()[0])
+
+    def __str__(self):
+        return self.query
+
+
+def _compiled(selector):
+    # acepta un Selector o el texto del selector (soupsieve guarda en cache los que ya compiló)
+    return selector.compiled if isinstance(selector, Selector) else soupsieve.compile(selector)
+
+
+class SoupDocument:
+    def __init__(self, text, features):
+        self._soup = bs4.BeautifulSoup(text, features)
+
+    def select_text(self, selector):
+        # texto del primer elemento que coincide con el selector
+        node = _compiled(selector).select_one(self._soup)
+
+        return node.text if node is not None else ""
+
+    def select_attribute(self, selector, attribute):
+        return [node[attribute] for node in _compiled(selector).select(self._soup) if node.has_attr(attribute)]
+
+
+class SelectolaxDocument:
+    def __init__(self, text):
+        try:
+            from selectolax.lexbor import LexborHTMLParser as HTMLParser
+        except ImportError:
+            from selectolax.parser import HTMLParser
+
+        self._tree = HTMLParser(text)
+
+    def select_text(self, selector):
+        node = self._tree.css_first(str(selector))
+
+        return node.text() if node is not None else ""
+
+    def select_attribute(self, selector, attribute):
+        return [node.attributes[attribute] for node in self._tree.css(str(selector))
+                if node.attributes.get(attribute) is not None]
+
+
+BACKENDS = {
+    "html.parser": lambda text: SoupDocument(text, "html.parser"),
+    "lxml": lambda text: SoupDocument(text, "lxml"),
+    "selectolax": SelectolaxDocument,
+}
+
+
+def parse(text, backend=DEFAULT_PARSER):
+    if backend not in BACKENDS:
+        raise ValueError("Unknown parser backend {}, choose one of {}".format(backend, ", ".join(BACKENDS)))
+
+    return BACKENDS[backend](text)
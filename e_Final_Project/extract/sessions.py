@@ -0,0 +1,175 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from common import config
+from crawl_scheduler import THROTTLE_STATUSES, crawl_scheduler, crawl_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HTTP_SETTINGS = {
+    "pool_size": 8,
+    "timeout": 10,
+    "retries": 3,
+    "backoff_factor": 0.5,
+    "status_forcelist": [429, 500, 502, 503, 504],
+}
+# como en urllib3, solo se reintentan los métodos que no cambian nada en el servidor
+RETRY_METHODS = ("GET", "HEAD")
+
+
+class SessionMetrics:
+    # Cuenta cuántas conexiones TCP (y handshakes TLS) se abrieron contra cuántas peticiones se atendieron
+    def __init__(self):
+        self.connections_opened = 0
+        self.requests_served = 0
+        self._lock = threading.Lock()
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def request_served(self):
+        with self._lock:
+            self.requests_served += 1
+
+    def as_dict(self):
+        return {"connections_opened": self.connections_opened, "requests_served": self.requests_served}
+
+
+def _counting_pool(pool_class, metrics):
+    class CountingConnectionPool(pool_class):
+        def _new_conn(self):
+            metrics.connection_opened()
+
+            return super(CountingConnectionPool, self)._new_conn()
+
+    return CountingConnectionPool
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, metrics, timeout, crawl=None, http=None, **kwargs):
+        self._metrics = metrics
+        self._timeout = timeout
+        # crawl_scheduler.crawl_settings del sitio, None si no se limita el ritmo de las peticiones
+        self._crawl = crawl
+        # http_settings del sitio: con crawl los reintentos de urllib3 se hacen aquí (ver send)
+        self._http = http
+        super(PooledAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(PooledAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self._metrics),
+            "https": _counting_pool(HTTPSConnectionPool, self._metrics),
+        }
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self._timeout
+        if self._crawl is None:
+            self._metrics.request_served()
+            return super(PooledAdapter, self).send(request, **kwargs)
+
+        # con crawl urllib3 no reintenta nada, todos los reintentos pasan por este ciclo y cada intento espera su
+        # turno en el dominio. Los 429 / 503 cuentan contra crawl.retries (y crawl_scheduler baja el ritmo), los demás
+        # estados de status_forcelist y los errores de conexión contra http.retries, con el backoff de urllib3.
+        retries = self._http["retries"] if request.method in RETRY_METHODS else 0
+        throttle_retries = self._crawl["retries"] if request.method in RETRY_METHODS else 0
+        throttled, failed = 0, 0
+        while True:
+            crawl_scheduler().wait(request.url, self._crawl)
+            self._metrics.request_served()
+            try:
+                response = super(PooledAdapter, self).send(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if failed == retries:
+                    raise
+                failed += 1
+                time.sleep(self._backoff(failed))
+                continue
+
+            crawl_scheduler().record(request.url, response.status_code, response.headers.get("Retry-After"))
+            if response.status_code in THROTTLE_STATUSES and throttled < throttle_retries:
+                throttled += 1
+            elif (response.status_code not in THROTTLE_STATUSES
+                  and response.status_code in self._http["status_forcelist"] and failed < retries):
+                failed += 1
+                time.sleep(self._backoff(failed))
+            else:
+                return response
+            # vaciamos el cuerpo para que la conexión regrese al pool
+            response.raw.drain_conn()
+            response.close()
+
+    def _backoff(self, failed):
+        # igual que urllib3: sin espera el primer reintento, después backoff_factor * 2 ** (n - 1)
+        return 0 if failed < 2 else self._http["backoff_factor"] * (2 ** (failed - 1))
+
+
+def http_settings(news_site_uid):
+    # los valores de "http" en config.yaml se pueden sobreescribir por sitio
+    settings = dict(DEFAULT_HTTP_SETTINGS)
+    settings.update(config().get("http") or {})
+    settings.update(config()["news_sites"][news_site_uid].get("http") or {})
+
+    return settings
+
+
+def _build_session(news_site_uid):
+    settings = http_settings(news_site_uid)
+    crawl = crawl_settings(news_site_uid)
+    crawl = crawl if crawl["enabled"] else None
+    if crawl:
+        # los reintentos los hace PooledAdapter.send pasando cada uno por crawl_scheduler
+        retry = Retry(total=0, raise_on_status=False)
+    else:
+        retry = Retry(total=settings["retries"],
+                      backoff_factor=settings["backoff_factor"],
+                      status_forcelist=settings["status_forcelist"],
+                      allowed_methods=RETRY_METHODS,
+                      raise_on_status=False)
+    adapter = PooledAdapter(SessionMetrics(),
+                            settings["timeout"],
+                            crawl=crawl,
+                            http=settings,
+                            pool_connections=settings["pool_size"],
+                            pool_maxsize=settings["pool_size"],
+                            max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.metrics = adapter._metrics
+
+    return session
+
+
+__sessions = {}
+__sessions_lock = threading.Lock()
+
+
+def session_for(news_site_uid):
+    # Una sesión por sitio, compartida por HomePage, ArticlePage y todos los hilos del FetchEngine
+    with __sessions_lock:
+        if news_site_uid not in __sessions:
+            __sessions[news_site_uid] = _build_session(news_site_uid)
+
+        return __sessions[news_site_uid]
+
+
+def metrics():
+    with __sessions_lock:
+        return {news_site_uid: session.metrics.as_dict() for news_site_uid, session in __sessions.items()}
+
+
+def close_sessions():
+    with __sessions_lock:
+        for session in __sessions.values():
+            session.close()
+        __sessions.clear()
@@ -0,0 +1,235 @@
+import os
+import re
+
+import yaml
+
+import parsers
+
+# Registro de los sitios de noticias: config.yaml se lee una sola vez por proceso (de una ruta explícita, por default
+# la que está junto a este archivo), se valida completo antes de empezar y los selectores CSS de cada sitio se
+# compilan en ese momento. Así todas las etapas usan la misma lista de sitios y ninguna página vuelve a leer la
+# configuración ni a compilar sus selectores.
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yaml")
+
+# selectores que necesita cada sitio para encontrar sus artículos
+REQUIRED_QUERIES = ("homepage_article_links", "article_title", "article_body")
+
+# el uid va en el nombre de los archivos (<uid>_<fecha>_articles.csv) y transform lo saca de ahí cortando en "_"
+_valid_uid = re.compile(r"^[A-Za-z0-9-]+$")
+_valid_url = re.compile(r"^https?://[^/]+")
+
+
+def _positive_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def _non_negative_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _positive_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+
+def _non_negative_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+
+
+def _optional(check):
+    return lambda value: value is None or check(value)
+
+
+def _boolean(value):
+    return isinstance(value, bool)
+
+
+def _text(value):
+    return isinstance(value, str) and bool(value)
+
+
+def _paths(value):
+    return isinstance(value, list) and all(isinstance(path, str) and path.startswith("/") for path in value)
+
+
+def _statuses(value):
+    return isinstance(value, list) and all(_positive_integer(status) for status in value)
+
+
+# secciones globales de config.yaml: campo --> (revisión, lo que se espera). http, crawl y frontier se pueden
+# sobreescribir por sitio con los mismos campos (ver SITE_SECTIONS)
+SECTIONS = {
+    "fetch": {
+        "max_concurrency": (_positive_integer, "a positive integer"),
+        "site_concurrency": (_positive_integer, "a positive integer"),
+        "flush_every": (_positive_integer, "a positive integer"),
+    },
+    "http": {
+        "pool_size": (_positive_integer, "a positive integer"),
+        "timeout": (_positive_number, "a positive number"),
+        "retries": (_non_negative_integer, "a non negative integer"),
+        "backoff_factor": (_non_negative_number, "a non negative number"),
+        "status_forcelist": (_statuses, "a list of HTTP status codes"),
+    },
+    "http_cache": {
+        "enabled": (_boolean, "true or false"),
+        "path": (_text, "a file path"),
+        "max_bytes": (_positive_integer, "a positive integer"),
+    },
+    "crawl": {
+        "enabled": (_boolean, "true or false"),
+        # DomainBucket divide entre el rate: ninguno puede ser 0
+        "rate": (_positive_number, "a positive number of requests per second"),
+        "burst": (_positive_integer, "a positive integer"),
+        "min_rate": (_positive_number, "a positive number of requests per second"),
+        "retries": (_non_negative_integer, "a non negative integer"),
+        "robots_txt": (_boolean, "true or false"),
+        "robots_ttl": (_non_negative_number, "a non negative number"),
+        "user_agent": (_optional(_text), "a user agent string"),
+    },
+    "frontier": {
+        "path": (_text, "a file path"),
+        "max_size": (_positive_integer, "a positive integer"),
+        "max_pages": (_positive_integer, "a positive integer"),
+        "max_articles_per_run": (_optional(_positive_integer), "a positive integer"),
+        "batch_size": (_positive_integer, "a positive integer"),
+        "sections": (_paths, "a list of paths starting with /"),
+    },
+    "url_index": {
+        "path": (_text, "a file path"),
+        "seed_db": (_optional(_text), "a file path"),
+    },
+}
+SITE_SECTIONS = ("http", "crawl", "frontier")
+
+_registry = None
+
+
+class ConfigError(ValueError):
+    pass
+
+
+class Site:
+    def __init__(self, uid, settings):
+        self.uid = uid
+        # el diccionario de config.yaml tal cual (los demás módulos leen de ahí max_concurrency, http, ...)
+        self.settings = settings
+        # nombre de la consulta --> parsers.Selector
+        self.selectors = {name: parsers.Selector(query) for name, query in settings["queries"].items()}
+
+    @property
+    def url(self):
+        return self.settings["url"]
+
+    @property
+    def parser(self):
+        return self.settings.get("parser")
+
+
+class SiteRegistry:
+    def __init__(self, config, path=DEFAULT_CONFIG_PATH):
+        self.path = path
+        # las rutas relativas de la configuración (seen_urls.db, http_cache.db, ...) son relativas a su archivo
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        self.config = config
+        _validate(config, path)
+        self._sites = {uid: Site(uid, settings) for uid, settings in config["news_sites"].items()}
+
+    @property
+    def uids(self):
+        return list(self._sites)
+
+    def __getitem__(self, uid):
+        if uid not in self._sites:
+            raise KeyError("Unknown news site {}, {} has {}".format(uid, self.path, ", ".join(self._sites)))
+
+        return self._sites[uid]
+
+    def __contains__(self, uid):
+        return uid in self._sites
+
+    def __iter__(self):
+        return iter(self._sites.values())
+
+    def __len__(self):
+        return len(self._sites)
+
+
+def _validate(config, path):
+    # Junta todos los errores en vez de parar en el primero, así se corrige el archivo de una vez
+    errors = []
+    if not isinstance(config, dict) or not isinstance(config.get("news_sites"), dict) or not config["news_sites"]:
+        raise ConfigError("{}: news_sites must map each site uid to its settings".format(path))
+
+    if config.get("parser", parsers.DEFAULT_PARSER) not in parsers.BACKENDS:
+        errors.append("parser must be one of {}".format(", ".join(parsers.BACKENDS)))
+    for name in SECTIONS:
+        _validate_section(config.get(name), name, name, errors)
+
+    for uid, site in config["news_sites"].items():
+        if not _valid_uid.match(str(uid)):
+            errors.append("{}: the site uid can only have letters, digits and -".format(uid))
+        if not isinstance(site, dict):
+            errors.append("{}: the settings must be a mapping".format(uid))
+            continue
+        if not _valid_url.match(str(site.get("url", ""))):
+            errors.append("{}: url must start with http:// or https://".format(uid))
+        if site.get("parser", parsers.DEFAULT_PARSER) not in parsers.BACKENDS:
+            errors.append("{}: parser must be one of {}".format(uid, ", ".join(parsers.BACKENDS)))
+        concurrency = site.get("max_concurrency", 1)
+        if not _positive_integer(concurrency):
+            errors.append("{}: max_concurrency must be a positive integer".format(uid))
+        # por sitio http_cache solo prende o apaga el cache
+        if not _boolean(site.get("http_cache", False)):
+            errors.append("{}: http_cache must be true or false".format(uid))
+        for name in SITE_SECTIONS:
+            _validate_section(site.get(name), name, "{}: {}".format(uid, name), errors)
+
+        queries = site.get("queries")
+        if not isinstance(queries, dict):
+            errors.append("{}: queries must map each query name to a CSS selector".format(uid))
+            continue
+        for name in REQUIRED_QUERIES:
+            if name not in queries:
+                errors.append("{}: missing query {}".format(uid, name))
+        for name, query in queries.items():
+            try:
+                parsers.Selector(query)
+            except (TypeError, ValueError) as e:
+                errors.append("{}: query {} ({!r}) is not a valid CSS selector: {}".format(uid, name, query, e))
+
+    if errors:
+        raise ConfigError("{}:\n  {}".format(path, "\n  ".join(errors)))
+
+
+def _validate_section(section, name, label, errors):
+    # una sección que no está (o vacía) usa los valores por default
+    if section is None:
+        return
+    if not isinstance(section, dict):
+        errors.append("{} must be a mapping".format(label))
+        return
+
+    for field, value in section.items():
+        if field not in SECTIONS[name]:
+            errors.append("{} has an unknown setting {}".format(label, field))
+            continue
+        check, expected = SECTIONS[name][field]
+        if not check(value):
+            errors.append("{} {} must be {}, not {!r}".format(label, field, expected, value))
+
+
+def load_registry(path=DEFAULT_CONFIG_PATH):
+    # Lee y valida la configuración de `path`; a partir de aquí registry() (y common.config()) regresan esta
+    global _registry
+    with open(path, mode="r", encoding="utf-8") as file:
+        _registry = SiteRegistry(yaml.safe_load(file), path=path)
+
+    return _registry
+
+
+def registry():
+    if _registry is None:
+        return load_registry()
+
+    return _registry
@@ -0,0 +1,196 @@
+import csv
+import glob
+import hashlib
+import html
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import config, BASE_DIR
+
+# Servidor HTTP local que sirve los artículos guardados en los CSV como si fueran las páginas reales, así podemos
+# medir el scraper sin depender de la red ni de los sitios de noticias.
+
+LAST_MODIFIED = "Sat, 09 May 2020 00:00:00 GMT"
+
+
+def _wrap(query, inner):
+    # Construye el html mínimo para que un selector sencillo (".clase tag") encuentre el contenido
+    for part in reversed(query.split()):
+        if part.startswith("."):
+            inner = '<div class="{}">{}</div>'.format(part[1:], inner)
+        else:
+            inner = "<{tag}>{inner}</{tag}>".format(tag=part, inner=inner)
+
+    return inner
+
+
+def render_article(news_site_uid, title, body):
+    queries = config()["news_sites"][news_site_uid]["queries"]
+    title_html = _wrap(queries["article_title"], html.escape(title))
+    body_html = _wrap(queries["article_body"], html.escape(body))
+
+    return "<html><head><meta charset=\"utf-8\"></head><body>{}{}</body></html>".format(title_html, body_html)
+
+
+def render_homepage(news_site_uid, paths):
+    query = config()["news_sites"][news_site_uid]["queries"]["homepage_article_links"]
+    tag = query.split()[-1]
+    container = " ".join(query.split()[:-1])
+    links = "".join(_wrap(container, '<{tag} href="{path}">{path}</{tag}>'.format(tag=tag, path=path))
+                    for path in paths)
+
+    return "<html><body>{}</body></html>".format(links)
+
+
+def load_corpus(pattern=os.path.join(BASE_DIR, "*_articles.csv")):
+    # {path: html} con un artículo por cada fila de los CSV guardados
+    pages = {}
+    for filename in sorted(glob.glob(pattern)):
+        news_site_uid = os.path.basename(filename).split("_")[0]
+        if news_site_uid not in config()["news_sites"]:
+            continue
+
+        with open(filename, mode="r", encoding="ISO-8859-1", newline="") as file:
+            for index, row in enumerate(csv.DictReader(file)):
+                path = "/{}/{}.html".format(news_site_uid, index)
+                pages[path] = render_article(news_site_uid, row["title"], row["body"])
+
+    for news_site_uid in config()["news_sites"]:
+        paths = [path for path in pages if path.startswith("/{}/".format(news_site_uid))]
+        pages["/{}/".format(news_site_uid)] = render_homepage(news_site_uid, paths)
+
+    return pages
+
+
+class _CountingHTTPServer(ThreadingHTTPServer):
+    connections_accepted = 0
+
+    def process_request(self, request, client_address):
+        # cada llamada es una conexión TCP nueva
+        self.connections_accepted += 1
+        super(_CountingHTTPServer, self).process_request(request, client_address)
+
+
+class StandInServer:
+    def __init__(self, pages, latency=0.0, rate_limit=None, burst=1, robots_txt=None):
+        # rate_limit: peticiones por segundo que acepta el servidor (como un sitio que nos limita), las demás
+        # reciben 429 con Retry-After. robots_txt: texto de /robots.txt (sin él responde 404)
+        self.pages = pages
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.robots_txt = robots_txt
+        self.requests_served = 0
+        self.not_modified = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._server = _CountingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+
+        return "http://{}:{}".format(host, port)
+
+    @property
+    def connections_accepted(self):
+        return self._server.connections_accepted
+
+    def _allow(self):
+        # token bucket del lado del servidor
+        if not self.rate_limit:
+            return True
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_limit)
+            self._updated = now
+            if self._tokens < 1:
+                self.throttled += 1
+                return False
+            self._tokens -= 1
+
+            return True
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                # latencia artificial para simular la espera de red
+                if server.latency:
+                    time.sleep(server.latency)
+
+                with server._lock:
+                    server.requests_served += 1
+
+                if self.path == "/robots.txt" and server.robots_txt is not None:
+                    self._send_text(server.robots_txt, "text/plain")
+                    return
+
+                if not server._allow():
+                    self.send_response(429)
+                    self.send_header("Retry-After", "1")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                page = server.pages.get(self.path)
+                if page is None:
+                    self.send_error(404)
+                    return
+
+                payload = page.encode("utf-8")
+                # validadores para las peticiones condicionales
+                etag = '"{}"'.format(hashlib.md5(payload).hexdigest())
+                if self.headers.get("If-None-Match") == etag:
+                    with server._lock:
+                        server.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                with server._lock:
+                    server.bytes_sent += len(payload)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", LAST_MODIFIED)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_text(self, text, content_type):
+                payload = text.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "{}; charset=utf-8".format(content_type))
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,65 @@
+import datetime
+import logging
+import os
+import sqlite3
+
+from common import select_in
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_PATH = "seen_urls.db"
+
+
+class UrlIndex:
+    # Guarda en disco las urls que ya se descargaron para no volver a bajarlas en la siguiente corrida
+    def __init__(self, path=DEFAULT_INDEX_PATH, seed_db=None):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS seen_urls ("
+                                 "url TEXT PRIMARY KEY, "
+                                 "seen_at TEXT NOT NULL"
+                                 ") WITHOUT ROWID")
+
+        if seed_db and self._is_empty():
+            self._seed(seed_db)
+
+    def _is_empty(self):
+        return self._connection.execute("SELECT 1 FROM seen_urls LIMIT 1").fetchone() is None
+
+    def _seed(self, seed_db):
+        # la primera vez tomamos las urls de los artículos que ya están cargados en newspaper.db
+        if not os.path.exists(seed_db):
+            return
+
+        seed_connection = sqlite3.connect("file:{}?mode=ro".format(seed_db), uri=True)
+        try:
+            urls = [url for url, in seed_connection.execute("SELECT url FROM articles WHERE url IS NOT NULL")]
+        except sqlite3.OperationalError:
+            # la base de datos todavía no tiene la tabla articles
+            urls = []
+        finally:
+            seed_connection.close()
+
+        self.add_many(urls)
+        logger.info("Seeded url index with {} urls from {}".format(len(urls), seed_db))
+
+    def unseen(self, urls):
+        urls = list(urls)
+        seen = set(url for url, in select_in(self._connection, "SELECT url FROM seen_urls WHERE url IN ({})", urls))
+
+        return [url for url in urls if url not in seen]
+
+    def __contains__(self, url):
+        return self._connection.execute("SELECT 1 FROM seen_urls WHERE url = ?", (url,)).fetchone() is not None
+
+    def add_many(self, urls):
+        now = datetime.datetime.now().isoformat()
+        with self._connection:
+            self._connection.executemany("INSERT OR IGNORE INTO seen_urls (url, seen_at) VALUES (?, ?)",
+                                         ((url, now) for url in urls))
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM seen_urls").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
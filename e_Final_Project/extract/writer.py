@@ -0,0 +1,176 @@
+import csv
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Columnas fijas del CSV de salida (antes se sacaban de dir(articles[0]), por eso el orden alfabético)
+# content_hash va al final para que las primeras columnas sigan igual que en los archivos viejos
+ARTICLE_FIELDS = ["article_links", "body", "title", "content_hash"]
+
+DEFAULT_FLUSH_EVERY = 25
+
+
+class ArticleWriter:
+    # Escribe cada artículo en cuanto llega, en lugar de juntarlos todos en memoria.
+    # Cada flush_every filas se vacía el buffer a disco y se guarda un checkpoint (<archivo>.checkpoint) con la
+    # posición del archivo, así si el proceso se cae podemos continuar donde nos quedamos.
+    def __init__(self, filename, flush_every=DEFAULT_FLUSH_EVERY, resume=True):
+        self.filename = filename
+        self.flush_every = flush_every
+        self.resume = resume
+        self.rows_written = 0
+        self.written_links = set()
+        self._checkpoint_filename = "{}.checkpoint".format(filename)
+        self._file = None
+        self._writer = None
+
+    def open(self):
+        checkpoint = self._read_checkpoint() if self.resume else None
+
+        if checkpoint:
+            # descartamos lo que se haya escrito después del último checkpoint (puede ser una fila a medias)
+            os.truncate(self.filename, checkpoint["offset"])
+            self.written_links = self._read_written_links()
+            self.rows_written = len(self.written_links)
+            logger.info("Resuming {} after {} articles".format(self.filename, self.rows_written))
+            self._file = open(self.filename, mode="a", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+        else:
+            self._file = open(self.filename, mode="w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(ARTICLE_FIELDS)
+            self.flush()
+
+        return self
+
+    def write(self, article):
+        self._writer.writerow([str(getattr(article, field)) for field in ARTICLE_FIELDS])
+        self.written_links.add(article.article_links)
+        self.rows_written += 1
+
+        if self.rows_written % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        tmp_filename = "{}.tmp".format(self._checkpoint_filename)
+        with open(tmp_filename, mode="w") as file:
+            json.dump({"offset": self._file.tell(), "rows": self.rows_written}, file)
+        os.replace(tmp_filename, self._checkpoint_filename)
+
+    def close(self, completed=True):
+        self.flush()
+        self._file.close()
+
+        # si terminamos bien ya no hace falta el checkpoint
+        if completed and os.path.exists(self._checkpoint_filename):
+            os.remove(self._checkpoint_filename)
+
+    def _read_checkpoint(self):
+        if not (os.path.exists(self._checkpoint_filename) and os.path.exists(self.filename)):
+            return None
+
+        with open(self._checkpoint_filename, mode="r") as file:
+            return json.load(file)
+
+    def _read_written_links(self):
+        with open(self.filename, mode="r", newline="", encoding="utf-8") as file:
+            return set(row["article_links"] for row in csv.DictReader(file))
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(completed=exc_type is None)
+
+
+class ParquetArticleWriter:
+    # Igual que ArticleWriter pero en Parquet: cada flush_every artículos se escribe un row group.
+    # Un archivo Parquet solo se puede leer cuando se cierra (el footer va al final), así que aquí no hay checkpoint.
+    def __init__(self, filename, flush_every=DEFAULT_FLUSH_EVERY, compression="zstd"):
+        self.filename = filename
+        self.flush_every = flush_every
+        self.compression = compression
+        self.rows_written = 0
+        self.written_links = set()
+        self._rows = []
+        self._writer = None
+
+    def open(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._schema = pa.schema([(field, pa.string()) for field in ARTICLE_FIELDS])
+        self._writer = pq.ParquetWriter(self.filename, self._schema, compression=self.compression)
+
+        return self
+
+    def write(self, article):
+        # los campos vacíos se guardan como null, igual que los lee pandas de un CSV
+        self._rows.append({field: str(getattr(article, field)) or None for field in ARTICLE_FIELDS})
+        self.written_links.add(article.article_links)
+        self.rows_written += 1
+
+        if len(self._rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+
+        if self._rows:
+            self._writer.write_table(pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def close(self, completed=True):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(completed=exc_type is None)
+
+
+WRITERS = {
+    "csv": ArticleWriter,
+    "parquet": ParquetArticleWriter,
+}
+
+
+class FrameWriter:
+    # Misma interfaz que ArticleWriter pero guarda las filas en memoria para pasarlas como DataFrame al paso
+    # transform sin escribir un CSV (lo usa pipeline.py)
+    def __init__(self):
+        self.rows_written = 0
+        self.written_links = set()
+        self._rows = []
+
+    def open(self):
+        return self
+
+    def write(self, article):
+        self._rows.append([str(getattr(article, field)) for field in ARTICLE_FIELDS])
+        self.written_links.add(article.article_links)
+        self.rows_written += 1
+
+    def close(self, completed=True):
+        pass
+
+    def to_frame(self):
+        import pandas as pd
+
+        # al leer un CSV pandas convierte los campos vacíos en NaN, aquí hacemos lo mismo
+        df = pd.DataFrame(self._rows, columns=ARTICLE_FIELDS)
+
+        return df.where(df != "")
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(completed=exc_type is None)
@@ -0,0 +1,251 @@
+import cProfile
+import datetime
+import functools
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# Métricas de cada etapa del pipeline (extract, transform, load por sitio) y de cada función de los pasos que se
+# instrumente (stages.instrument reemplaza el atributo del módulo por una versión que mide, así los main.py no
+# cambian). Por cada llamada se guarda:
+#   wall_time   --> segundos de reloj
+#   cpu_time    --> segundos de CPU del hilo que corrió la función (no cuenta otros hilos ni otros procesos, por
+#                   ejemplo las descargas de FetchEngine se miden en _fetch_article y no en la etapa extract)
+#   peak_rss_kb --> el pico de memoria del proceso que la corrió hasta ese momento (ru_maxrss)
+#   rows_in / rows_out / bytes_out --> tamaño de lo que recibe y regresa (DataFrames o artículos)
+#
+# Además, para una etapa o función con nombre ("transform", "transform._tokenize_columns", ...) se puede prender
+# cProfile (se guarda un .prof por llamada) o tracemalloc (pico y las líneas que más memoria reservaron).
+
+_TOTALS = ("calls", "wall_time", "cpu_time", "rows_in", "rows_out", "bytes_out")
+
+# tracemalloc es de todo el proceso: varios hilos pueden estar midiendo a la vez (extract de varios sitios), se
+# apaga cuando termina el último que lo prendió
+_tracing_lock = threading.Lock()
+_tracing_calls = 0
+
+
+def _peak_rss_kb():
+    # en Linux ru_maxrss viene en KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _rows(value):
+    if value is None:
+        return 0
+    if hasattr(value, "shape"):
+        return len(value)
+    if hasattr(value, "body"):
+        # un artículo (extract/news_page_objects.ArticlePage)
+        return 1
+
+    return None
+
+
+def _bytes(value, deep=False):
+    if hasattr(value, "memory_usage"):
+        # deep=True recorre cada string, solo lo hacemos una vez por etapa y no en cada función
+        return int(value.memory_usage(index=True, deep=True).sum()) if deep else None
+    if hasattr(value, "body"):
+        return len(str(value.title).encode()) + len(str(value.body).encode())
+
+    return None
+
+
+def _start_tracing():
+    global _tracing_calls
+    with _tracing_lock:
+        if not _tracing_calls:
+            tracemalloc.start()
+        _tracing_calls += 1
+        # el pico es de todo el proceso: cuenta también lo que reserven otros hilos mientras tanto
+        tracemalloc.reset_peak()
+
+
+def _stop_tracing():
+    global _tracing_calls
+    with _tracing_lock:
+        _tracing_calls -= 1
+        if not _tracing_calls:
+            tracemalloc.stop()
+
+
+class Instrumentation:
+    def __init__(self, installer, profile=None, trace_memory=None, output_dir="."):
+        # installer(instrumentation, stage_names): envuelve las funciones de esos pasos con instrumentation.patch
+        # (stages.instrument); se guarda la función y no los módulos para poder mandar esto a otro proceso
+        self.installer = installer
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.output_dir = output_dir
+        self._reset()
+        self._remote = False
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._installed = set()
+        self._patched = []
+        self.stages = {}
+        self.functions = {}
+        self.profiles = []
+        self.memory_traces = []
+
+    def __getstate__(self):
+        # a los procesos de la etapa cpu solo les mandamos la configuración, las métricas empiezan en cero allá
+        return {"installer": self.installer, "profile": self.profile, "trace_memory": self.trace_memory,
+                "output_dir": self.output_dir}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+        self._remote = True
+
+    def install(self, stage_names):
+        pending = [stage_name for stage_name in stage_names if stage_name not in self._installed]
+        if pending:
+            self.installer(self, pending)
+            self._installed.update(pending)
+
+    def patch(self, module, function_name, label):
+        function = getattr(module, function_name)
+        # si ya estaba envuelta (otra Instrumentation en este proceso) medimos la original
+        original = getattr(function, "__instrumented__", function)
+        instrumentation = self
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            return instrumentation.measure(label, original, args, kwargs, rows_in=_rows(args[0]) if args else None)
+
+        wrapper.__instrumented__ = original
+        setattr(module, function_name, wrapper)
+        self._patched.append((module, function_name, function))
+
+    def uninstall(self):
+        for module, function_name, function in reversed(self._patched):
+            setattr(module, function_name, function)
+        self._patched = []
+        self._installed = set()
+
+    def measure(self, label, function, args, kwargs, rows_in=None, site=None, deep_bytes=False):
+        profiler = cProfile.Profile() if label == self.profile else None
+        tracing = label == self.trace_memory
+        if tracing:
+            _start_tracing()
+        if profiler:
+            profiler.enable()
+
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            wall_time, cpu_time = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+            if profiler:
+                profiler.disable()
+                self._save_profile(label, site, profiler)
+            if tracing:
+                self._save_memory_trace(label, site)
+
+        self._record(label, site, {
+            "calls": 1,
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            "peak_rss_kb": _peak_rss_kb(),
+            "rows_in": rows_in,
+            "rows_out": _rows(result),
+            "bytes_out": _bytes(result, deep=deep_bytes),
+        })
+
+        return result
+
+    def _save_profile(self, label, site, profiler):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with self._lock:
+            filename = os.path.join(self.output_dir, "{}{}.{}.{}.prof".format(
+                label, ".{}".format(site) if site else "", os.getpid(), len(self.profiles)))
+            self.profiles.append({"name": label, "site": site, "path": filename})
+        profiler.dump_stats(filename)
+        logger.info("Saved profile of {} to {} (python -m pstats {})".format(label, filename, filename))
+
+    def _save_memory_trace(self, label, site):
+        _, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+        _stop_tracing()
+        with self._lock:
+            self.memory_traces.append({
+                "name": label,
+                "site": site,
+                "traced_peak_kb": peak // 1024,
+                "top_allocations": ["{}: {} KB".format(stat.traceback, stat.size // 1024) for stat in top],
+            })
+
+    def _record(self, label, site, record):
+        with self._lock:
+            if site:
+                self._merge(self.stages, (site, label), record)
+            else:
+                self._merge(self.functions, label, record)
+
+    @staticmethod
+    def _merge(table, key, record):
+        if key not in table:
+            table[key] = dict(record, max_wall_time=record["wall_time"])
+            return
+
+        current = table[key]
+        for name in _TOTALS:
+            if record.get(name) is not None:
+                current[name] = (current.get(name) or 0) + record[name]
+        current["peak_rss_kb"] = max(current["peak_rss_kb"], record["peak_rss_kb"])
+        current["max_wall_time"] = max(current["max_wall_time"], record.get("max_wall_time", record["wall_time"]))
+
+    def call_stage(self, stage_name, news_site_uid, function, previous):
+        # Corre una etapa del pipeline (en el hilo o proceso del executor) midiéndola a ella y a sus funciones.
+        # Si estamos en otro proceso regresamos lo que se midió para juntarlo con merge() en el proceso principal.
+        self.install([stage_name])
+        result = self.measure(stage_name, function, (news_site_uid, previous), {},
+                              rows_in=_rows(previous), site=news_site_uid, deep_bytes=True)
+
+        if not self._remote:
+            return result, None
+
+        with self._lock:
+            snapshot = {"stages": self.stages, "functions": self.functions, "profiles": self.profiles,
+                        "memory_traces": self.memory_traces}
+            self.stages, self.functions, self.profiles, self.memory_traces = {}, {}, [], []
+
+        return result, snapshot
+
+    def merge(self, snapshot):
+        with self._lock:
+            for key, record in snapshot["stages"].items():
+                self._merge(self.stages, key, record)
+            for key, record in snapshot["functions"].items():
+                self._merge(self.functions, key, record)
+            self.profiles.extend(snapshot["profiles"])
+            self.memory_traces.extend(snapshot["memory_traces"])
+
+    def report(self, **run):
+        # run: datos de la corrida (fecha, sitios, opciones, wall time total) que se agregan tal cual
+        stages = {}
+        for (site, stage_name), record in self.stages.items():
+            stages.setdefault(site, {})[stage_name] = record
+
+        return {
+            "run": run,
+            "stages": stages,
+            "functions": {label: self.functions[label] for label in sorted(self.functions)},
+            "profiles": self.profiles,
+            "memory_traces": self.memory_traces,
+        }
+
+    def write(self, filename, **run):
+        run.setdefault("written_at", datetime.datetime.now().isoformat())
+        with open(filename, mode="w", encoding="utf-8") as file:
+            json.dump(self.report(**run), file, indent=2, ensure_ascii=False)
+        logger.info("Saved metrics to {}".format(filename))
@@ -14,8 +14,10 @@ class Article(Base):
     n_tokens_body = Column(Integer)
     n_tokens_title = Column(Integer)
     url = Column(String, unique=True)
+    # md5 del título y el body (ver extract/news_page_objects.py), para saber si el artículo cambió
+    content_hash = Column(String)
 
-    def __init__(self, uid, body, host, newspaper_uid, n_tokens_body, n_tokens_title, title, url):
+    def __init__(self, uid, body, host, newspaper_uid, n_tokens_body, n_tokens_title, title, url, content_hash=None):
         self.id = uid
         self.body = body
         self.host = host
@@ -24,3 +26,4 @@ class Article(Base):
         self.n_tokens_body = n_tokens_body
         self.title = title
         self.url = url
+        self.content_hash = content_hash
@@ -1,3 +1,5 @@
+import os
+
 from sqlalchemy import create_engine
 # permite tener acceso a las funcionalidades de orm (object relational mapper: nos permite
 # trabajar con objetos de python en lugar de querys de SQL directamente) de sqlalchemy
@@ -5,7 +7,9 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 # le decimos a sqlalchemy que queremos usar sqlite
-Engine = create_engine("sqlite:///newspaper.db")
+# newspaper.db vive junto a este archivo, sin importar desde qué carpeta se corra el paso load
+DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "newspaper.db")
+Engine = create_engine("sqlite:///{}".format(DATABASE_PATH))
 
 Session = sessionmaker(bind=Engine)
 
@@ -0,0 +1,128 @@
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+import main as load
+import search
+
+# Para correrlo (desde la carpeta load):
+#   python benchmark.py load --rows 100000
+#   python benchmark.py search --rows 1000000
+
+logger = logging.getLogger(__name__)
+
+# los CSV limpios de d_Data_systems, relativos a este archivo y no a la carpeta desde la que se corre
+CLEANED_CSV_PATTERN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "d_Data_systems",
+                                   "*_cleaned.csv")
+
+
+def synthetic_cleaned_articles(rows, pattern=CLEANED_CSV_PATTERN, start=0):
+    # Repite los CSV limpios que están en el repo hasta tener `rows` filas, con urls (y uids) distintas
+    # start: para generar un archivo grande por partes sin repetir urls
+    sample = pd.concat([pd.read_csv(filename) for filename in sorted(glob.glob(pattern))], ignore_index=True)
+    repeats = -(-rows // len(sample))
+    articles = pd.concat([sample] * repeats, ignore_index=True).iloc[:rows].copy()
+
+    articles["article_links"] = ["{}?copy={}".format(link, index)
+                                 for index, link in enumerate(articles["article_links"], start)]
+    articles["uid"] = [hashlib.md5(link.encode()).hexdigest() for link in articles["article_links"]]
+
+    return articles
+
+
+def bench_load(args):
+    articles = synthetic_cleaned_articles(args.rows)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "articles.csv")
+        articles.to_csv(filename, index=False)
+
+        for mode in args.modes:
+            engine = create_engine("sqlite:///{}".format(os.path.join(directory, "{}.db".format(mode))))
+            start = time.perf_counter()
+            load.main(filename, mode=mode, batch_size=args.batch_size, engine=engine)
+            elapsed = time.perf_counter() - start
+            engine.dispose()
+
+            print("{:<8} {:>8} rows {:>8.2f} s {:>10.0f} rows/s".format(mode, len(articles), elapsed,
+                                                                       len(articles) / elapsed))
+
+
+def _latencies(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = function()
+        times.append(time.perf_counter() - start)
+    times.sort()
+
+    return results, times[len(times) // 2], times[min(len(times) - 1, int(len(times) * 0.95))]
+
+
+def _like_search(engine, text):
+    # lo que había que hacer antes del índice: LIKE '%palabra%' sobre todos los artículos. Sin LIMIT, porque para
+    # ordenar por relevancia hay que encontrar todos los que coinciden (igual que hace bm25 con el índice)
+    words = search.match_expression(text).replace('"', "").split()
+    conditions = " AND ".join("(title LIKE ? OR body LIKE ?)" for _ in words)
+    parameters = [pattern for word in words for pattern in ("%{}%".format(word),) * 2]
+    with engine.connect() as connection:
+        return connection.exec_driver_sql("SELECT id FROM articles WHERE {}".format(conditions),
+                                          tuple(parameters)).fetchall()
+
+
+def bench_search(args):
+    # Latencia de search.search (FTS5) contra un LIKE sobre el body en una base con args.rows artículos.
+    # La base se llena por partes con la carga bulk, así el índice se construye con los triggers igual que en load.
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "newspaper.db")
+        engine = create_engine("sqlite:///{}".format(path))
+
+        start = time.perf_counter()
+        for chunk_start in range(0, args.rows, args.chunk_size):
+            articles = synthetic_cleaned_articles(min(args.chunk_size, args.rows - chunk_start), start=chunk_start)
+            load.load(articles, mode="bulk", engine=engine)
+        print("loaded {} articles with the index in {:.1f} s, database {:.0f} MB".format(
+            args.rows, time.perf_counter() - start, os.path.getsize(path) / 2 ** 20))
+
+        print("{:<25} {:>8} {:>12} {:>12} {:>12}".format("query", "results", "fts p50 ms", "fts p95 ms",
+                                                         "like p50 ms"))
+        for query in args.queries:
+            results, fts_p50, fts_p95 = _latencies(lambda: search.search(query, limit=args.limit, engine=engine),
+                                                   args.repeat)
+            _, like_p50, _ = _latencies(lambda: _like_search(engine, query), args.like_repeat)
+            print("{:<25} {:>8} {:>12.2f} {:>12.2f} {:>12.2f}".format(query, len(results), fts_p50 * 1000,
+                                                                     fts_p95 * 1000, like_p50 * 1000))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    load_parser = subparsers.add_parser("load", help="ORM loop vs bulk executemany")
+    load_parser.add_argument("--rows", type=int, default=100000, help="Rows in the scaled-up article file")
+    load_parser.add_argument("--modes", nargs="+", default=["orm", "bulk"], choices=["orm", "bulk", "upsert"])
+    load_parser.add_argument("--batch-size", type=int, default=load.DEFAULT_BATCH_SIZE)
+    load_parser.set_defaults(func=bench_load)
+
+    search_parser = subparsers.add_parser("search", help="FTS5 search vs LIKE scan")
+    search_parser.add_argument("--rows", type=int, default=1000000, help="Articles in the synthetic database")
+    search_parser.add_argument("--chunk-size", type=int, default=50000, help="Articles generated and loaded at once")
+    search_parser.add_argument("--queries", nargs="+",
+                               default=["coronavirus", "gobierno salud", "economía", "zzyzx"])
+    search_parser.add_argument("--limit", type=int, default=10)
+    search_parser.add_argument("--repeat", type=int, default=50, help="Runs of every FTS query")
+    search_parser.add_argument("--like-repeat", type=int, default=3, help="Runs of every LIKE query")
+    search_parser.set_defaults(func=bench_search)
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    args.func(args)
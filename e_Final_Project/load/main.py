@@ -1,18 +1,105 @@
 import argparse
+import json
 import logging
 import pandas as pd
+from sqlalchemy import delete, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import search
 from article import Article
 from base import Base, Engine, Session
+from term import ArticleTerm, Term
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_BATCH_SIZE = 1000
+
+# columnas del CSV limpio --> columnas de la tabla articles
+ARTICLE_COLUMNS = {
+    "uid": "id",
+    "body": "body",
+    "host": "host",
+    "title": "title",
+    "newspaper_uid": "newspaper_uid",
+    "n_tokens_body": "n_tokens_body",
+    "n_tokens_title": "n_tokens_title",
+    "article_links": "url",
+    "content_hash": "content_hash",
+}
+
+# columnas que agrega transform --term-frequencies: las palabras de cada campo en tf_terms_<field> y cuántas veces
+# aparece cada una en tf_counts_<field>
+TERMS_PREFIX = "tf_terms_"
+COUNTS_PREFIX = "tf_counts_"
+
+# sqlite no acepta más de 999 parámetros por consulta en versiones viejas, así que las consultas con una lista de
+# valores (column.in_(...)) se hacen por lotes
+SQLITE_BATCH_SIZE = 500
+
+
+def main(filename, mode="upsert", batch_size=DEFAULT_BATCH_SIZE, engine=Engine):
+    articles = _read_articles(filename)  # Leemos nuestros artículos con pandas
+
+    return load(articles, mode=mode, batch_size=batch_size, engine=engine)
+
+
+def _read_articles(filename):
+    if not filename.endswith(".parquet"):
+        return pd.read_csv(filename)
+
+    # en Parquet el uid y el content_hash vienen como 16 bytes (ver transform/main.py), la tabla los guarda en hex
+    articles = pd.read_parquet(filename)
+    for column in ("uid", "content_hash"):
+        if column in articles.columns:
+            articles[column] = [value.hex() for value in articles[column]]
+
+    return articles
+
+
+def load(articles, mode="upsert", batch_size=DEFAULT_BATCH_SIZE, engine=Engine):
+    # articles: DataFrame con las columnas del CSV limpio (uid puede venir como índice, como lo deja transform)
+    if "uid" not in articles.columns:
+        articles = articles.reset_index()
 
-def main(filename):
     # configurar sql
-    Base.metadata.create_all(Engine)  # permite generar nuestro scheme en nuestra base de datos
-    session = Session()  # Inicializar la sesión
-    articles = pd.read_csv(filename)  # Leemos nuestros artículos con pandas
+    Base.metadata.create_all(engine)  # permite generar nuestro scheme en nuestra base de datos
+    _add_missing_columns(engine)
+    # índice de texto completo sobre título y body, se actualiza solo con cada artículo que se carga (ver search.py)
+    search.ensure_index(engine)
+
+    if mode == "upsert":
+        result = _upsert_load(articles, engine, batch_size)
+    elif mode == "bulk":
+        result = _bulk_load(articles, engine, batch_size)
+    else:
+        result = _orm_load(articles, engine)
+
+    if any(column.startswith(TERMS_PREFIX) for column in articles.columns):
+        result["term_frequencies"] = _load_term_frequencies(articles, engine, batch_size)
+
+    return result
+
+
+def _add_missing_columns(engine):
+    # create_all no modifica las tablas que ya existen: si newspaper.db es de antes de que Article tuviera alguna
+    # columna (content_hash), la agregamos aquí. Las filas viejas quedan en NULL.
+    existing = {column["name"] for column in inspect(engine).get_columns(Article.__tablename__)}
+    missing = [column for column in Article.__table__.columns if column.name not in existing]
+
+    with engine.begin() as connection:
+        for column in missing:
+            logger.info("Adding column {} to {}".format(column.name, Article.__tablename__))
+            connection.exec_driver_sql("ALTER TABLE {} ADD COLUMN {} {}".format(
+                Article.__tablename__, column.name, column.type.compile(engine.dialect)))
+
+
+def _article_columns(articles):
+    # los archivos limpios de antes no traen content_hash; sin la columna no se toca lo que ya hay en la tabla
+    return {column: name for column, name in ARTICLE_COLUMNS.items() if column in articles.columns}
+
+
+def _orm_load(articles, engine):
+    session = Session(bind=engine)  # Inicializar la sesión
 
     # iterrows : es un método de pandas que permite generar un loop adentro de cada una de nuestras
     # filas de nuestro DataFrame
@@ -25,20 +112,155 @@ def main(filename):
                           row["n_tokens_body"],
                           row["n_tokens_title"],
                           row["title"],
-                          row["article_links"])
+                          row["article_links"],
+                          row.get("content_hash"))
 
         session.add(article)  # esto nos mete nuestro artículo dentro de la base de datos
 
     session.commit()
     session.close()
 
+    return {"inserted": len(articles)}
+
+
+def _article_records(articles):
+    # Convierte el DataFrame en diccionarios con los nombres de las columnas de la tabla. Pasamos a object para que
+    # sqlite reciba int/str de python en lugar de tipos de numpy, y los NaN como NULL.
+    columns = _article_columns(articles)
+    records = articles[list(columns)].rename(columns=columns).astype(object)
+
+    return records.where(records.notna(), None).to_dict("records")
+
+
+def _bulk_load(articles, engine, batch_size):
+    # Sin ORM: un solo INSERT por lote con executemany, todo dentro de una misma transacción
+    insert = Article.__table__.insert()
+    logger.info("Bulk loading {} articles in batches of {}".format(len(articles), batch_size))
+
+    with engine.begin() as connection:
+        if engine.dialect.name == "sqlite":
+            # más páginas en memoria y tablas temporales en RAM mientras dura la carga
+            connection.exec_driver_sql("PRAGMA cache_size = -65536")
+            connection.exec_driver_sql("PRAGMA temp_store = MEMORY")
+
+        for start in range(0, len(articles), batch_size):
+            batch = _article_records(articles.iloc[start:start + batch_size])
+            connection.execute(insert, batch)
+            logger.info("Loaded articles {} to {}".format(start, start + len(batch)))
+
+    return {"inserted": len(articles)}
+
+
+def _upsert_load(articles, engine, batch_size):
+    # Carga idempotente: los artículos nuevos se insertan, los que ya existen solo se actualizan si cambió algo y
+    # los que están iguales ni se tocan. Así podemos volver a cargar un archivo que se traslapa con cargas anteriores.
+    table = Article.__table__
+    columns = list(_article_columns(articles).values())
+    counts = {"inserted": 0, "updated": 0, "skipped": 0}
+
+    upsert = sqlite_insert(table)
+    updated_columns = {column: upsert.excluded[column] for column in columns if column != "id"}
+    upsert = upsert.on_conflict_do_update(index_elements=[table.c.id], set_=updated_columns)
+
+    with engine.begin() as connection:
+        for start in range(0, len(articles), batch_size):
+            batch = _article_records(articles.iloc[start:start + batch_size])
+            ids = [record["id"] for record in batch]
+            existing = {row.id: dict(row._mapping)
+                        for row in connection.execute(select(*[table.c[column] for column in columns])
+                                                      .where(table.c.id.in_(ids)))}
+
+            pending = []
+            for record in batch:
+                if record["id"] not in existing:
+                    counts["inserted"] += 1
+                elif existing[record["id"]] != record:
+                    counts["updated"] += 1
+                else:
+                    counts["skipped"] += 1
+                    continue
+                pending.append(record)
+                # si el mismo artículo viene dos veces en el archivo, la segunda vez ya existe
+                existing[record["id"]] = record
+
+            if pending:
+                connection.execute(upsert, pending)
+
+    logger.info("Upserted articles: {inserted} inserted, {updated} updated, {skipped} skipped".format(**counts))
+
+    return counts
+
+
+def _select_in(connection, query, column, values, batch_size=SQLITE_BATCH_SIZE):
+    # query: un select al que se le agrega where(column.in_(...)) con cada lote de values
+    values = list(values)
+    for start in range(0, len(values), batch_size):
+        yield from connection.execute(query.where(column.in_(values[start:start + batch_size])))
+
+
+def _term_list(value):
+    # del DataFrame o de Parquet llega como lista (o arreglo de numpy), de un CSV como JSON y sin transform como NaN
+    if isinstance(value, str):
+        return json.loads(value)
+    if value is None or isinstance(value, float):
+        return []
+
+    return list(value)
+
+
+def _term_ids(connection, terms):
+    # agrega al vocabulario las palabras nuevas y regresa {palabra: id} de todas las que se pidieron
+    terms = list(terms)
+    if terms:
+        connection.execute(sqlite_insert(Term.__table__).on_conflict_do_nothing(index_elements=["term"]),
+                           [{"term": term} for term in terms])
+
+    return {row.term: row.id for row in _select_in(connection, select(Term.id, Term.term), Term.term, terms)}
+
+
+def _load_term_frequencies(articles, engine, batch_size):
+    # Tabla normalizada: cada palabra una vez en terms y en article_terms solo (artículo, campo, id, veces).
+    # Los conteos de un artículo se reemplazan completos, así volver a cargarlo no deja palabras viejas.
+    fields = [column[len(TERMS_PREFIX):] for column in articles.columns if column.startswith(TERMS_PREFIX)]
+    rows = 0
+
+    with engine.begin() as connection:
+        for start in range(0, len(articles), batch_size):
+            batch = articles.iloc[start:start + batch_size]
+            frequencies = [(uid, field, list(zip(_term_list(terms), _term_list(counts))))
+                           for field in fields
+                           for uid, terms, counts in zip(batch["uid"], batch[TERMS_PREFIX + field],
+                                                         batch[COUNTS_PREFIX + field])]
+            term_ids = _term_ids(connection, set(term for _, _, counts in frequencies for term, _ in counts))
+
+            connection.execute(delete(ArticleTerm.__table__).where(ArticleTerm.article_id.in_(list(batch["uid"]))))
+            records = [{"article_id": uid, "field": field, "term_id": term_ids[term], "count": int(count)}
+                       for uid, field, counts in frequencies for term, count in counts]
+            if records:
+                # OR REPLACE: si el mismo artículo viene dos veces en el archivo se queda la última
+                connection.execute(ArticleTerm.__table__.insert().prefix_with("OR REPLACE"), records)
+            rows += len(records)
+
+    logger.info("Loaded {} term frequencies".format(rows))
+
+    return rows
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("filename",
                         help="The file you want to load into the db",
                         type=str)
+    parser.add_argument("--mode",
+                        help="orm adds one Article per row, bulk inserts in batches with executemany, "
+                             "upsert inserts new articles and updates only the ones that changed",
+                        choices=["orm", "bulk", "upsert"],
+                        default="upsert")
+    parser.add_argument("--batch-size",
+                        help="Rows per executemany batch in bulk and upsert modes",
+                        type=int,
+                        default=DEFAULT_BATCH_SIZE)
 
     args = parser.parse_args()
 
-    main(args.filename)
+    print(main(args.filename, mode=args.mode, batch_size=args.batch_size))
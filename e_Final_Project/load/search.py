@@ -0,0 +1,116 @@
+import argparse
+import re
+
+from article import Article  # noqa: F401 (registra la tabla articles en Base.metadata)
+from base import Base, Engine
+
+# Índice de texto completo (FTS5 de sqlite) sobre el título y el body de articles. Es una tabla "external content":
+# no guarda otra copia de los textos, solo el índice invertido, y lo mantienen al día los triggers sobre articles
+# (cada INSERT, UPDATE o DELETE de un artículo actualiza el índice en la misma transacción).
+#
+# Para buscar (desde la carpeta load):
+#   python search.py "coronavirus méxico" --limit 5
+
+FTS_TABLE = "articles_fts"
+
+# bm25 con más peso para las palabras del título que para las del body
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+_STATEMENTS = [
+    # remove_diacritics: "mexico" también encuentra "México"
+    "CREATE VIRTUAL TABLE {fts} USING fts5("
+    "title, body, content='articles', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER {fts}_insert AFTER INSERT ON articles BEGIN "
+    "INSERT INTO {fts}(rowid, title, body) VALUES (new.rowid, new.title, new.body); "
+    "END",
+    "CREATE TRIGGER {fts}_delete AFTER DELETE ON articles BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, title, body) VALUES ('delete', old.rowid, old.title, old.body); "
+    "END",
+    "CREATE TRIGGER {fts}_update AFTER UPDATE OF title, body ON articles BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, title, body) VALUES ('delete', old.rowid, old.title, old.body); "
+    "INSERT INTO {fts}(rowid, title, body) VALUES (new.rowid, new.title, new.body); "
+    "END",
+]
+
+_word = re.compile(r"\w+")
+
+
+def ensure_index(engine=Engine):
+    # Crea el índice y los triggers si todavía no existen. Si articles ya tenía artículos se indexan una vez aquí,
+    # después solo se indexa lo que se va cargando.
+    if engine.dialect.name != "sqlite":
+        return False
+
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                            (FTS_TABLE,)).fetchone()
+        if exists:
+            return False
+
+        for statement in _STATEMENTS:
+            connection.exec_driver_sql(statement.format(fts=FTS_TABLE))
+        connection.exec_driver_sql("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=FTS_TABLE))
+
+    return True
+
+
+def rebuild_index(engine=Engine):
+    # El índice apunta al rowid de cada artículo; un VACUUM puede cambiar esos rowid (articles no tiene una llave
+    # entera), así que después de un VACUUM hay que reconstruirlo
+    with engine.begin() as connection:
+        connection.exec_driver_sql("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=FTS_TABLE))
+
+
+def match_expression(text):
+    # Cada palabra entre comillas: el texto del usuario se busca tal cual (todas las palabras, en cualquier orden)
+    # sin que caracteres como "-" o ":" se interpreten como operadores de FTS5
+    return " ".join('"{}"'.format(word) for word in _word.findall(text))
+
+
+def search(text, limit=10, engine=Engine, raw=False):
+    # Regresa los artículos que tienen todas las palabras, del más al menos relevante (bm25).
+    # raw: text ya es una expresión de FTS5 (OR, NEAR, "frase exacta", title:palabra, prefijo*)
+    query = text if raw else match_expression(text)
+    if not query:
+        return []
+
+    sql = ("SELECT articles.id, articles.title, articles.url, articles.newspaper_uid, "
+           "bm25({fts}, ?, ?) AS score, snippet({fts}, 1, '[', ']', '...', 12) AS snippet "
+           "FROM {fts} JOIN articles ON articles.rowid = {fts}.rowid "
+           "WHERE {fts} MATCH ? "
+           "ORDER BY score "
+           "LIMIT ?").format(fts=FTS_TABLE)
+
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(sql, (TITLE_WEIGHT, BODY_WEIGHT, query, limit))
+
+        return [dict(row._mapping) for row in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("query",
+                        help="Words to look for in the title and body of the loaded articles",
+                        type=str)
+    parser.add_argument("--limit",
+                        help="Maximum number of results",
+                        type=int,
+                        default=10)
+    parser.add_argument("--raw",
+                        help="The query is an FTS5 expression (OR, NEAR, \"exact phrase\", title:word, prefix*)",
+                        action="store_true")
+    parser.add_argument("--rebuild",
+                        help="Rebuild the index from the articles table first (needed after a VACUUM)",
+                        action="store_true")
+
+    args = parser.parse_args()
+
+    Base.metadata.create_all(Engine)
+    if not ensure_index() and args.rebuild:
+        rebuild_index()
+
+    for result in search(args.query, limit=args.limit, raw=args.raw):
+        print("{score:8.2f}  {newspaper_uid:<12} {title}".format(**result))
+        print("          {url}".format(**result))
+        print("          {snippet}".format(**result))
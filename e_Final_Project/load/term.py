@@ -0,0 +1,20 @@
+from sqlalchemy import Column, ForeignKey, Integer, String
+from base import Base
+
+
+class Term(Base):
+    # vocabulario: cada palabra se guarda una sola vez y los artículos la referencian por su id
+    __tablename__ = "terms"
+
+    id = Column(Integer, primary_key=True)
+    term = Column(String, unique=True, nullable=False)
+
+
+class ArticleTerm(Base):
+    # cuántas veces aparece cada palabra en el título o en el body (field) de cada artículo
+    __tablename__ = "article_terms"
+
+    article_id = Column(String, ForeignKey("articles.id"), primary_key=True)
+    field = Column(String, primary_key=True)
+    term_id = Column(Integer, ForeignKey("terms.id"), primary_key=True, index=True)
+    count = Column(Integer, nullable=False)
@@ -1,65 +1,178 @@
+import argparse
 import datetime
+import functools
 import logging
-import subprocess
-# subprocess:
-#    Permite manipular directamente archivos del terminal (es }como si tuvieramos la terminal directamente en python)
+import os
+
+import stages
+from instrumentation import Instrumentation
+from scheduler import DagScheduler, Stage
 
 logging.basicConfig(level=logging.INFO)
 
 logger = logging.getLogger(__name__)
 
-news_sites_uids = ["eluniversal", "elpais"]
-
-
-def main():
-    _extract()
-    _transform()
-    _load()
-
-
-def _extract():
-    logger.info("Starting extract process")
-    for news_sites_uid in news_sites_uids:
-        # cwd--> que ejecute lo que he exrito antes dentro de la dirección que le mando
-        subprocess.run(["python", "main.py", news_sites_uid], cwd=".\\extract")
-        # ahora vamos a mover los archivos que se generaron
-        # "." --> que queremos que comience a partir de este directorio
-        # "-name", "{}*" --> queremos que encuentre algo con un cierto patrón (* el asterisco significa con lo que sea)
-        # "-exect" --> que ejecute algo por cada uno de los archivos que encuentre
-        # "mv" --> que los mueva
-        # "{}" --> el nombre del archivo
-        # ";" --> porque find nos obliga a terminar con un ;
-        # el siguiente comando es para linux o mac
-        # subprocess.run(["find", ".", "-name", "{}*".format(news_sites_uid), "-exec", "mv", "{}",
-        #                "../transform/{}_.csv".format(news_sites_uid), ";"], cwd="./extract")
-        # Para windwos
-        subprocess.run(["copy", "{}_{}*".format(news_sites_uid, now),
-                        "..\\transform\\{}_{}_.csv".format(news_sites_uid, now)], shell=True,
-                       cwd="./extract")
-        print("*"*50)
-
-
-def _transform():
-    logger.info("Starting transform process")
-    for news_sites_uid in news_sites_uids:
-        dirty_data_filename = "{}_{}_.csv".format(news_sites_uid, now)
-        clean_data_filename = "{}_cleaned.csv".format(dirty_data_filename[:-4])
-        subprocess.run(["python", "main.py", dirty_data_filename], cwd=".\\transform")
-        subprocess.run(["rm", dirty_data_filename], shell=True, cwd=".\\transform")
-        subprocess.run(["mv", clean_data_filename, "..\\load\\{}.csv".format(news_sites_uid)], shell=True,
-                       cwd=".\\transform")
-    print("*" * 50)
+# Antes cada paso se corría con subprocess ("python main.py ...") dentro de su carpeta y los datos pasaban de un
+# paso a otro en archivos CSV que se movían con copy/mv/rm. Ahora importamos las funciones de cada paso una sola vez
+# y nos pasamos los DataFrames directamente; los CSV intermedios solo se escriben si los pedimos con --keep-files.
+#
+# Cada sitio de config.yaml pasa por extract -> transform -> load por su cuenta (ver scheduler.py), así el sitio
+# más lento no detiene la limpieza ni la carga de los demás.
+
+# etapa --> (sufijo del archivo intermedio, si el índice se guarda)
+_INTERMEDIATE_FILES = {
+    "extract": ("articles", False),
+    "transform": ("articles_cleaned", True),
+}
+
 
+def main(news_sites_uids=None, keep_files=False, output_dir=".", workers=2, io_workers=4, load_mode="upsert",
+         full=False, files_format="csv", near_duplicates=False, term_frequencies=False, skip_unchanged=False,
+         metrics_path=None, profile=None, trace_memory=None, config_path=None):
+    if config_path:
+        stages.configure(config_path)
+    news_sites_uids = news_sites_uids or stages.news_sites()
+    stages.check_news_sites(news_sites_uids)
+    started_at = datetime.datetime.now()
+    now = started_at.strftime("%Y_%m_%d")
+
+    # las métricas solo se toman si se piden, medir cada función también cuesta
+    instrumentation = None
+    if metrics_path or profile or trace_memory:
+        instrumentation = Instrumentation(stages.instrument, profile=profile, trace_memory=trace_memory,
+                                          output_dir=output_dir)
+
+    scheduler = DagScheduler(
+        [
+            Stage("extract", "io", functools.partial(stages.extract_stage, full=full)),
+            Stage("transform", "cpu", functools.partial(stages.transform_stage, near_duplicates=near_duplicates,
+                                                        term_frequencies=term_frequencies,
+                                                        skip_unchanged=skip_unchanged)),
+            Stage("load", "db", functools.partial(stages.load_stage, mode=load_mode)),
+        ],
+        io_workers=io_workers,
+        cpu_workers=workers,
+        on_stage_done=_materializer(output_dir, now, files_format) if keep_files else None,
+        instrumentation=instrumentation,
+    )
+    results = scheduler.run(news_sites_uids)
 
-def _load():
-    logger.info("Starting load process")
-    for news_sites_uid in news_sites_uids:
-        clean_data_filename = "{}.csv".format(news_sites_uid)
-        subprocess.run(["python", "main.py", clean_data_filename], cwd=".\\load")
-        subprocess.run(["rm", clean_data_filename], shell=True, cwd="./load")
     print("*" * 50)
+    print(scheduler.report())
+    for news_sites_uid, result in results.items():
+        logger.info("Loaded {}: {}".format(news_sites_uid, result))
+    for news_sites_uid, error in scheduler.errors.items():
+        logger.error("{} failed at {}".format(news_sites_uid, error))
+
+    if instrumentation:
+        os.makedirs(output_dir, exist_ok=True)
+        metrics_path = metrics_path or os.path.join(output_dir, "metrics_{}.json".format(
+            started_at.strftime("%Y_%m_%d_%H%M%S")))
+        instrumentation.write(metrics_path,
+                              started_at=started_at.isoformat(),
+                              wall_time=scheduler.wall_time,
+                              news_sites=news_sites_uids,
+                              errors={uid: str(error) for uid, error in scheduler.errors.items()},
+                              options={"workers": workers, "io_workers": io_workers, "load_mode": load_mode,
+                                       "full": full, "near_duplicates": near_duplicates,
+                                       "term_frequencies": term_frequencies, "skip_unchanged": skip_unchanged,
+                                       "profile": profile, "trace_memory": trace_memory})
+
+    return results
+
+
+def _materializer(output_dir, now, files_format="csv"):
+    os.makedirs(output_dir, exist_ok=True)
+
+    def materialize(news_sites_uid, stage_name, df):
+        if stage_name not in _INTERMEDIATE_FILES:
+            return
+
+        suffix, index = _INTERMEDIATE_FILES[stage_name]
+        filename = os.path.join(output_dir, "{}_{}_{}.{}".format(news_sites_uid, now, suffix, files_format))
+        logger.info("Saving intermediate file {}".format(filename))
+        if files_format == "csv":
+            if index:
+                # igual que transform/main.py (las listas de --term-frequencies como JSON)
+                df = stages.load_module("transform")._csv_frame(df)
+            df.to_csv(filename, index=index, encoding="utf-8-sig")
+        elif index:
+            # mismos tipos que transform/main.py --format parquet (uid de 16 bytes, n_tokens enteros)
+            stages.load_module("transform")._write_parquet(df, filename)
+        else:
+            df.to_parquet(filename, index=False, compression="zstd")
+
+    return materialize
 
 
 if __name__ == "__main__":
-    now = datetime.datetime.now().strftime("%Y_%m_%d")
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("news_sites",
+                        help="News sites to process (all the sites in the configuration by default)",
+                        nargs="*")
+    parser.add_argument("--config",
+                        help="Configuration file with the news sites (extract/config.yaml by default)",
+                        type=str)
+    parser.add_argument("--keep-files",
+                        help="Also write the intermediate file of every stage",
+                        action="store_true")
+    parser.add_argument("--output-dir",
+                        help="Where the intermediate files are written",
+                        type=str,
+                        default=".")
+    parser.add_argument("--format",
+                        help="Format of the intermediate files",
+                        choices=["csv", "parquet"],
+                        default="csv")
+    parser.add_argument("--near-duplicates",
+                        help="Also drop articles nearly identical to one already seen, across sites and runs",
+                        action="store_true")
+    parser.add_argument("--workers",
+                        help="Number of processes running the transform step",
+                        type=int,
+                        default=2)
+    parser.add_argument("--io-workers",
+                        help="Number of sites extracted at the same time",
+                        type=int,
+                        default=4)
+    parser.add_argument("--load-mode",
+                        help="How the load step writes into newspaper.db",
+                        choices=["orm", "bulk", "upsert"],
+                        default="upsert")
+    parser.add_argument("--full",
+                        help="Fetch every article on the homepage, even the ones already seen",
+                        action="store_true")
+    parser.add_argument("--skip-unchanged",
+                        help="Only clean and load the articles that are new or whose title or body changed",
+                        action="store_true")
+    parser.add_argument("--term-frequencies",
+                        help="Also store how many times every word appears in each article (terms tables)",
+                        action="store_true")
+    parser.add_argument("--metrics",
+                        help="Write wall time, CPU time, peak RSS and row counts of every stage and step to this "
+                             "JSON file",
+                        type=str)
+    parser.add_argument("--profile",
+                        help="Run cProfile on a stage or step (transform, transform._tokenize_columns, ...) and "
+                             "save a .prof file per call in --output-dir",
+                        type=str)
+    parser.add_argument("--trace-memory",
+                        help="Run tracemalloc on a stage or step and add its peak and top allocations to the metrics",
+                        type=str)
+
+    args = parser.parse_args()
+    main(news_sites_uids=args.news_sites,
+         keep_files=args.keep_files,
+         output_dir=args.output_dir,
+         workers=args.workers,
+         io_workers=args.io_workers,
+         load_mode=args.load_mode,
+         full=args.full,
+         files_format=args.format,
+         near_duplicates=args.near_duplicates,
+         term_frequencies=args.term_frequencies,
+         skip_unchanged=args.skip_unchanged,
+         metrics_path=args.metrics,
+         profile=args.profile,
+         trace_memory=args.trace_memory,
+         config_path=args.config)
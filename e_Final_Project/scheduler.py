@@ -0,0 +1,123 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Cada sitio de noticias recorre sus etapas (extract -> transform -> load) por su cuenta: en cuanto un sitio termina
+# una etapa se manda a la siguiente, sin esperar a los demás sitios. Cada etapa corre en un executor distinto:
+#   io  --> hilos, para las descargas (la mayor parte del tiempo se espera a la red)
+#   cpu --> procesos, para la limpieza y tokenización
+#   db  --> un solo hilo, así solo hay un proceso escribiendo en newspaper.db a la vez
+
+
+class Stage:
+    def __init__(self, name, executor, function):
+        # function(news_site_uid, resultado_de_la_etapa_anterior)
+        self.name = name
+        self.executor = executor
+        self.function = function
+
+
+class StageFailed(Exception):
+    pass
+
+
+def _timed_call(function, news_site_uid, previous, stage_name=None, instrumentation=None):
+    # corre dentro del executor, así el tiempo no incluye lo que la tarea esperó en la cola
+    start = time.perf_counter()
+    metrics = None
+    if instrumentation is None:
+        result = function(news_site_uid, previous)
+    else:
+        # metrics: lo que se midió en otro proceso (etapa cpu), None si se guardó directo en instrumentation
+        result, metrics = instrumentation.call_stage(stage_name, news_site_uid, function, previous)
+
+    return result, time.perf_counter() - start, metrics
+
+
+class DagScheduler:
+    def __init__(self, stages, io_workers=4, cpu_workers=2, on_stage_done=None, instrumentation=None):
+        self.stages = stages
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers
+        # on_stage_done(news_site_uid, stage_name, result) se llama en el hilo principal
+        self.on_stage_done = on_stage_done
+        # instrumentation.Instrumentation opcional: métricas de cada etapa y de las funciones de cada paso
+        self.instrumentation = instrumentation
+        self.timings = {}
+        self.errors = {}
+        self.wall_time = None
+
+    def run(self, news_sites_uids):
+        results = {}
+        start = time.perf_counter()
+        executors = {
+            "io": ThreadPoolExecutor(max_workers=self.io_workers),
+            # spawn: no conviene hacer fork de un proceso que ya tiene hilos descargando
+            "cpu": ProcessPoolExecutor(max_workers=self.cpu_workers, mp_context=multiprocessing.get_context("spawn")),
+            "db": ThreadPoolExecutor(max_workers=1),
+        }
+
+        if self.instrumentation:
+            # en este proceso se instala una sola vez antes de mandar tareas a los hilos
+            self.instrumentation.install([stage.name for stage in self.stages])
+
+        try:
+            pending = {}
+            for news_site_uid in news_sites_uids:
+                self.timings[news_site_uid] = {}
+                pending[self._submit(executors, news_site_uid, 0, None)] = (news_site_uid, 0)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    news_site_uid, index = pending.pop(future)
+                    stage = self.stages[index]
+
+                    try:
+                        result, elapsed, metrics = future.result()
+                    except Exception as e:
+                        # si un sitio falla los demás siguen su camino
+                        logger.exception("Stage {} failed for {}".format(stage.name, news_site_uid))
+                        self.errors[news_site_uid] = StageFailed("{}: {}".format(stage.name, e))
+                        continue
+
+                    self.timings[news_site_uid][stage.name] = elapsed
+                    if metrics:
+                        self.instrumentation.merge(metrics)
+                    logger.info("{} finished {} in {:.2f} s".format(news_site_uid, stage.name, elapsed))
+                    if self.on_stage_done:
+                        self.on_stage_done(news_site_uid, stage.name, result)
+
+                    if index + 1 < len(self.stages):
+                        pending[self._submit(executors, news_site_uid, index + 1, result)] = (news_site_uid, index + 1)
+                    else:
+                        results[news_site_uid] = result
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True)
+            if self.instrumentation:
+                self.instrumentation.uninstall()
+            self.wall_time = time.perf_counter() - start
+
+        return results
+
+    def _submit(self, executors, news_site_uid, index, previous):
+        stage = self.stages[index]
+
+        return executors[stage.executor].submit(_timed_call, stage.function, news_site_uid, previous, stage.name,
+                                                self.instrumentation)
+
+    def report(self):
+        names = [stage.name for stage in self.stages]
+        lines = ["{:<15}".format("site") + "".join("{:>12}".format(name) for name in names)]
+        for news_site_uid, timings in self.timings.items():
+            cells = "".join("{:>12}".format("{:.2f} s".format(timings[name]) if name in timings else "-")
+                            for name in names)
+            lines.append("{:<15}{}".format(news_site_uid, cells))
+        lines.append("wall time: {:.2f} s, sum of stage times: {:.2f} s".format(
+            self.wall_time or 0, sum(sum(timings.values()) for timings in self.timings.values())))
+
+        return "\n".join(lines)
@@ -0,0 +1,140 @@
+import importlib.util
+import os
+import sys
+import threading
+
+# Cada paso (extract, transform, load) es una carpeta con su propio main.py y módulos que se importan entre sí con
+# imports "planos" (import common, from base import Base, ...). Aquí agregamos esas carpetas al sys.path y cargamos
+# cada main.py con un nombre distinto (extract_main, transform_main, load_main) para poder usarlos en el mismo proceso.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ["extract", "transform", "load"]
+# scheduler.py corre los pasos de varios sitios en hilos: sin el lock, un hilo puede recibir de sys.modules un módulo
+# que otro hilo todavía está cargando
+_modules_lock = threading.RLock()
+
+# funciones de cada paso que mide instrumentation.Instrumentation (ver instrument)
+INSTRUMENTED_FUNCTIONS = {
+    "extract": ["_fetch_article"],
+    "transform": ["_read_data", "_add_content_hash_column", "_add_newspaper_uid_column", "_extract_host",
+                  "_fill_missing_bodies", "_generate_uids_for_rows", "_remove_new_lines_from_body",
+                  "_remove_duplicate_entries", "_remove_unchanged_articles", "_tokenize_columns",
+                  "_remove_near_duplicate_entries", "_drop_rows_with_missing_values", "_term_frequencies",
+                  "_drop_token_columns", "_save_df"],
+    "load": ["_orm_load", "_bulk_load", "_upsert_load", "_load_term_frequencies"],
+}
+
+
+def load_module(stage, module_name="main"):
+    name = "{}_{}".format(stage, module_name)
+    with _modules_lock:
+        if name in sys.modules:
+            return sys.modules[name]
+
+        directory = os.path.join(BASE_DIR, stage)
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+
+        spec = importlib.util.spec_from_file_location(name, os.path.join(directory, "{}.py".format(module_name)))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+
+    return module
+
+
+def instrument(instrumentation, stage_names=STAGES):
+    # Cambia las funciones de cada main.py por una versión que las mide (instrumentation.patch). Los pasos se llaman
+    # entre ellas por nombre dentro del módulo, así que basta con reemplazar el atributo, sin tocar los main.py.
+    for stage in stage_names:
+        module = load_module(stage)
+        for function_name in INSTRUMENTED_FUNCTIONS[stage]:
+            instrumentation.patch(module, function_name, "{}.{}".format(stage, function_name))
+
+
+def extract(news_site_uid, full=False, mark_seen=True):
+    # Regresa los artículos como DataFrame con las mismas columnas que el CSV de extract
+    # mark_seen: con False las urls no se marcan como vistas hasta llamar a mark_seen (ver load_stage)
+    frame_writer = load_module("extract", "writer").FrameWriter()
+    writer = load_module("extract")._news_scraper(news_site_uid, full=full, writer=frame_writer,
+                                                  mark_seen=mark_seen)
+
+    return writer.to_frame()
+
+
+def mark_seen(articles, news_site_uid):
+    # articles: lo que regresó extract (o solo su columna article_links); la siguiente corrida ya no baja estas urls
+    load_module("extract")._mark_seen(news_site_uid, articles["article_links"].dropna())
+
+
+def transform(articles, news_site_uid, workers=1, near_duplicates=False, term_frequencies=False,
+              skip_unchanged=False):
+    transform_main = load_module("transform")
+    options = {
+        "workers": workers,
+        "term_frequencies": term_frequencies,
+        # los artículos que ya están en newspaper.db sin cambios no se vuelven a limpiar ni a cargar
+        "loaded_articles_db": transform_main.LOADED_ARTICLES_DB if skip_unchanged else None,
+    }
+    if not near_duplicates:
+        return transform_main.transform(articles, news_site_uid, **options)
+
+    # el índice está en disco (transform/near_duplicates.db), así lo comparten los procesos de todos los sitios
+    index = transform_main.near_duplicate_index()
+    try:
+        return transform_main.transform(articles, news_site_uid, near_duplicates_index=index, **options)
+    finally:
+        index.close()
+
+
+def load(articles, mode="upsert", batch_size=None):
+    load_main = load_module("load")
+
+    return load_main.load(articles, mode=mode, batch_size=batch_size or load_main.DEFAULT_BATCH_SIZE)
+
+
+def configure(config_path):
+    # Lee y valida otro archivo de configuración en lugar de extract/config.yaml (ver extract/sites.py)
+    return load_module("extract").load_registry(config_path)
+
+
+def news_sites():
+    # todos los sitios de la configuración, en el orden del archivo
+    return load_module("extract").registry().uids
+
+
+def check_news_sites(news_sites_uids):
+    # un sitio que no está en la configuración falla aquí y no a la mitad de la corrida
+    site_registry = load_module("extract").registry()
+    unknown = [news_site_uid for news_site_uid in news_sites_uids if news_site_uid not in site_registry]
+    if unknown:
+        raise ValueError("Unknown news sites {}, {} has {}".format(", ".join(unknown), site_registry.path,
+                                                                   ", ".join(site_registry.uids)))
+
+
+# Misma firma para las tres etapas, function(news_site_uid, resultado_anterior), como las usa scheduler.DagScheduler
+
+# {news_site_uid: urls que sacó extract_stage}, se marcan como vistas cuando load_stage guardó el sitio. Las dos
+# etapas corren en hilos del proceso principal (ver scheduler.py), así que comparten este diccionario.
+_pending_links = {}
+
+
+def extract_stage(news_site_uid, _previous, full=False):
+    articles = extract(news_site_uid, full=full, mark_seen=False)
+    _pending_links[news_site_uid] = articles[["article_links"]]
+
+    return articles
+
+
+def transform_stage(news_site_uid, articles, workers=1, near_duplicates=False, term_frequencies=False,
+                    skip_unchanged=False):
+    return transform(articles, news_site_uid, workers=workers, near_duplicates=near_duplicates,
+                     term_frequencies=term_frequencies, skip_unchanged=skip_unchanged)
+
+
+def load_stage(news_site_uid, cleaned_articles, mode="upsert"):
+    result = load(cleaned_articles, mode=mode)
+    # si transform o load fallan las urls no se marcan y la siguiente corrida vuelve a bajar esos artículos
+    mark_seen(_pending_links.pop(news_site_uid), news_site_uid)
+
+    return result
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# las pruebas cargan los módulos de cada paso con stages.load_module, igual que pipeline.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
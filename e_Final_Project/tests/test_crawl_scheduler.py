@@ -0,0 +1,65 @@
+import pytest
+
+import stages
+
+stages.load_module("extract")
+crawl_scheduler = stages.load_module("extract", "crawl_scheduler")
+
+
+def test_bucket_allows_a_burst_then_paces_requests():
+    bucket = crawl_scheduler.DomainBucket(rate=2, burst=2, min_rate=0.5)
+
+    assert bucket.reserve(100.0) == 0
+    assert bucket.reserve(100.0) == 0
+    assert bucket.reserve(100.0) == pytest.approx(0.5)
+    assert bucket.reserve(100.0) == pytest.approx(1.0)
+    # sin gastar: la siguiente ficha llega en 1.5 s
+    assert bucket.delay(100.0) == pytest.approx(1.5)
+
+
+def test_throttled_halves_the_rate_once_per_pause_down_to_min_rate():
+    bucket = crawl_scheduler.DomainBucket(rate=4, burst=4, min_rate=1)
+
+    assert bucket.throttled(10.0, pause=2)
+    assert bucket.rate == 2
+    # las peticiones que ya iban en camino no lo vuelven a bajar
+    assert not bucket.throttled(11.0, pause=2)
+    assert bucket.delay(11.0) == pytest.approx(1.0)
+    assert bucket.throttled(12.5, pause=2)
+    assert bucket.throttled(20.0, pause=2)
+    assert bucket.rate == 1
+
+
+def test_succeeded_recovers_up_to_the_max_rate():
+    bucket = crawl_scheduler.DomainBucket(rate=4, burst=4, min_rate=1)
+    bucket.throttled(0.0, pause=0)
+    for _ in range(1000):
+        bucket.succeeded()
+
+    assert bucket.rate == 4
+
+
+def test_bucket_never_reaches_a_zero_rate():
+    bucket = crawl_scheduler.DomainBucket(rate=0, burst=0, min_rate=0)
+    bucket.reserve(0.0)
+    bucket.limit(0, 0)
+    for pause in range(20):
+        bucket.throttled(pause * 100.0, pause=1)
+
+    assert bucket.rate > 0
+    assert bucket.delay(10000.0) >= 0
+
+
+def test_parse_crawl_delay_reads_fractional_values_for_our_agent():
+    lines = ["User-agent: *", "Crawl-delay: 2", "", "User-agent: python-requests", "Crawl-delay: 0.5"]
+
+    assert crawl_scheduler.parse_crawl_delay(lines, "python-requests/2.34") == 0.5
+    assert crawl_scheduler.parse_crawl_delay(lines, "other-bot/1.0") == 2
+    assert crawl_scheduler.parse_crawl_delay(["User-agent: *", "Disallow: /x"], "bot") is None
+
+
+def test_retry_after_seconds():
+    assert crawl_scheduler.retry_after_seconds("3") == 3
+    assert crawl_scheduler.retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert crawl_scheduler.retry_after_seconds("soon") is None
+    assert crawl_scheduler.retry_after_seconds(None) is None
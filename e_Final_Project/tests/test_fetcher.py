@@ -0,0 +1,105 @@
+import threading
+
+import requests
+
+import stages
+
+fetcher = stages.load_module("extract", "fetcher")
+standin_server = stages.load_module("extract", "standin_server")
+
+SITES = ["eluniversal", "elpais"]
+
+
+class ConcurrencyProbe:
+    # fetch que baja la página del servidor local y anota cuántas descargas hay al mismo tiempo, en total y por sitio
+    def __init__(self):
+        self.running = {}
+        self.peak = {}
+        self._lock = threading.Lock()
+
+    def _count(self, key, step):
+        with self._lock:
+            self.running[key] = self.running.get(key, 0) + step
+            self.peak[key] = max(self.peak.get(key, 0), self.running[key])
+
+    def __call__(self, news_site_uid, link):
+        self._count(None, 1)
+        self._count(news_site_uid, 1)
+        try:
+            return requests.get(link).text
+        finally:
+            self._count(news_site_uid, -1)
+            self._count(None, -1)
+
+
+def _pages(count):
+    return {"/{}/{}.html".format(news_site_uid, number): "{} {}".format(news_site_uid, number)
+            for news_site_uid in SITES for number in range(count)}
+
+
+def _jobs(server, news_site_uid, count):
+    return [(news_site_uid, "{}/{}/{}.html".format(server.url, news_site_uid, number)) for number in range(count)]
+
+
+def test_results_come_back_in_the_order_of_the_jobs():
+    with standin_server.StandInServer(_pages(10)) as server:
+        jobs = _jobs(server, "elpais", 10) + _jobs(server, "eluniversal", 10)
+        results = fetcher.FetchEngine(max_concurrency=6).run(jobs, ConcurrencyProbe())
+
+    assert results == [server.pages[link[len(server.url):]] for _, link in jobs]
+
+
+def test_downloads_stay_under_the_global_and_site_limits():
+    probe = ConcurrencyProbe()
+    with standin_server.StandInServer(_pages(20), latency=0.02) as server:
+        jobs = _jobs(server, "elpais", 20) + _jobs(server, "eluniversal", 20)
+        fetcher.FetchEngine(max_concurrency=6).run(jobs, probe)
+
+    # config.yaml limita cada sitio a 4 descargas
+    assert probe.peak[None] <= 6
+    assert probe.peak["elpais"] <= 4
+    assert probe.peak["eluniversal"] <= 4
+
+
+def test_engines_running_at_the_same_time_share_the_global_limit():
+    # varios extract en el mismo proceso, cada uno en su hilo: juntos no pasan de max_concurrency
+    probe = ConcurrencyProbe()
+    with standin_server.StandInServer(_pages(20), latency=0.02) as server:
+        threads = [threading.Thread(target=fetcher.FetchEngine(max_concurrency=6).run,
+                                    args=(_jobs(server, news_site_uid, 20), probe))
+                   for news_site_uid in SITES]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert probe.peak[None] <= 6
+    assert probe.peak["elpais"] <= 4
+    assert probe.peak["eluniversal"] <= 4
+
+
+def test_on_result_gets_every_download_on_the_loop_thread():
+    received = []
+    with standin_server.StandInServer(_pages(10)) as server:
+        jobs = _jobs(server, "elpais", 10)
+        results = fetcher.FetchEngine(max_concurrency=6).run(
+            jobs, ConcurrencyProbe(),
+            on_result=lambda news_site_uid, link, page: received.append((link, page, threading.get_ident())))
+
+    # con on_result no se guardan los resultados
+    assert results == [None] * len(jobs)
+    assert sorted(link for link, _, _ in received) == sorted(link for _, link in jobs)
+    assert all(page == server.pages[link[len(server.url):]] for link, page, _ in received)
+    assert len(set(thread for _, _, thread in received)) == 1
+
+
+def test_downloads_take_turns_between_domains():
+    # 127.0.0.1 y localhost son el mismo servidor pero dos dominios para crawl_scheduler
+    order = []
+    with standin_server.StandInServer(_pages(3)) as server:
+        other_url = server.url.replace("127.0.0.1", "localhost")
+        jobs = (_jobs(server, "elpais", 3)
+                + [("elpais", link.replace(server.url, other_url)) for _, link in _jobs(server, "elpais", 3)])
+        fetcher.FetchEngine(max_concurrency=1).run(jobs, lambda news_site_uid, link: order.append(link))
+
+    assert [link.startswith(server.url) for link in order] == [True, False] * 3
@@ -0,0 +1,65 @@
+import stages
+
+frontier = stages.load_module("extract", "frontier")
+
+
+def _frontier(tmp_path, max_size=100):
+    return frontier.Frontier(str(tmp_path / "frontier.db"), max_size=max_size)
+
+
+def test_links_come_out_by_priority_then_discovery_order(tmp_path):
+    queue = _frontier(tmp_path)
+    assert queue.push_many("site", ["b", "a"], priority=1) == 2
+    assert queue.push_many("site", ["c"], priority=0) == 1
+
+    assert queue.peek("site", 10) == ["c", "b", "a"]
+    assert queue.take("site", 2) == ["c", "b"]
+    assert queue.take("site", 2) == ["a"]
+    assert queue.take("site", 2) == []
+
+
+def test_push_deduplicates_and_keeps_the_best_priority(tmp_path):
+    queue = _frontier(tmp_path)
+    queue.push_many("site", ["a", "b"], priority=1)
+
+    assert queue.push_many("site", ["a", "b", "c"], priority=0) == 1
+    assert queue.size("site") == 3
+    # a y b suben a la prioridad 0 pero conservan su orden de descubrimiento
+    assert queue.peek("site", 10) == ["a", "b", "c"]
+
+
+def test_taken_links_stay_until_removed(tmp_path):
+    queue = _frontier(tmp_path)
+    queue.push_many("site", ["a", "b", "c"])
+    queue.push_many("other", ["x"])
+    queue.take("site", 2)
+
+    assert queue.peek("site", 10) == ["c"]
+    assert queue.size("site") == 3
+    assert queue.remove_taken("site") == 2
+    assert queue.peek("site", 10) == ["c"]
+    assert len(queue) == 2
+
+
+def test_release_returns_links_of_an_unfinished_run(tmp_path):
+    queue = _frontier(tmp_path)
+    queue.push_many("site", ["a", "b"])
+    queue.take("site", 2)
+    queue.close()
+
+    # la corrida se cayó: la siguiente abre la cola de nuevo
+    queue = _frontier(tmp_path)
+    assert queue.take("site", 10) == []
+    assert queue.release("site") == 2
+    assert queue.take("site", 10) == ["a", "b"]
+
+
+def test_trim_drops_the_deepest_newest_links_but_not_taken_ones(tmp_path):
+    queue = _frontier(tmp_path, max_size=3)
+    queue.push_many("site", ["a", "b"], priority=0)
+    queue.take("site", 1)
+
+    assert queue.push_many("site", ["c", "d", "e"], priority=1) == 1
+    assert queue.size("site") == 3
+    assert queue.peek("site", 10) == ["b", "c"]
+    assert queue.remove_taken("site") == 1
@@ -0,0 +1,67 @@
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+import stages
+
+load_main = stages.load_module("load")
+
+
+def _articles(**changes):
+    articles = pd.DataFrame({
+        "uid": ["a", "b"],
+        "body": ["body a", "body b"],
+        "host": ["example.com", "example.com"],
+        "title": ["title a", "title b"],
+        "newspaper_uid": ["site", "site"],
+        "n_tokens_body": [2, 2],
+        "n_tokens_title": [2, 2],
+        "article_links": ["https://example.com/a", "https://example.com/b"],
+        "content_hash": ["hash a", "hash b"],
+    })
+    for column, values in changes.items():
+        articles[column] = values
+
+    return articles
+
+
+def _load(tmp_path, articles):
+    filename = str(tmp_path / "site_cleaned.csv")
+    articles.to_csv(filename, index=False)
+
+    return load_main.main(filename, mode="upsert", engine=create_engine("sqlite:///{}".format(tmp_path / "db")))
+
+
+def test_upsert_inserts_then_skips_unchanged_articles(tmp_path):
+    assert _load(tmp_path, _articles()) == {"inserted": 2, "updated": 0, "skipped": 0}
+    assert _load(tmp_path, _articles()) == {"inserted": 0, "updated": 0, "skipped": 2}
+
+
+def test_upsert_updates_only_changed_articles(tmp_path):
+    _load(tmp_path, _articles())
+
+    changed = _articles(body=["body a", "new body b"], content_hash=["hash a", "new hash b"])
+    assert _load(tmp_path, changed) == {"inserted": 0, "updated": 1, "skipped": 1}
+    engine = create_engine("sqlite:///{}".format(tmp_path / "db"))
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT body FROM articles WHERE id = 'b'")).scalar() == "new body b"
+
+
+def test_upsert_treats_missing_values_as_null(tmp_path):
+    # las celdas vacías del CSV llegan como NaN, se guardan como NULL y al volver a cargarlas no cuentan como cambio
+    articles = _articles(host=[None, "example.com"])
+    _load(tmp_path, articles)
+
+    assert _load(tmp_path, articles)["skipped"] == 2
+
+
+def test_upsert_treats_missing_content_hash_as_null(tmp_path):
+    articles = _articles(content_hash=[None, "hash b"])
+    _load(tmp_path, articles)
+
+    assert _load(tmp_path, articles)["skipped"] == 2
+
+
+def test_upsert_with_a_repeated_article_in_the_same_file(tmp_path):
+    articles = pd.concat([_articles(), _articles().iloc[[1]]], ignore_index=True)
+
+    assert _load(tmp_path, articles) == {"inserted": 2, "updated": 0, "skipped": 1}
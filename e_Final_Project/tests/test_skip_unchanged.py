@@ -0,0 +1,41 @@
+import pandas as pd
+from sqlalchemy import create_engine
+
+import stages
+
+load_main = stages.load_module("load")
+transform_main = stages.load_module("transform")
+
+
+def _load(tmp_path, **term_frequencies):
+    articles = pd.DataFrame({
+        "uid": ["a"],
+        "body": ["body a"],
+        "host": ["example.com"],
+        "title": ["title a"],
+        "newspaper_uid": ["site"],
+        "n_tokens_body": [2],
+        "n_tokens_title": [2],
+        "article_links": ["https://example.com/a"],
+        "content_hash": ["hash a"],
+    })
+    for column, values in term_frequencies.items():
+        articles[column] = values
+    filename = str(tmp_path / "newspaper.db")
+    load_main.load(articles, engine=create_engine("sqlite:///{}".format(filename)))
+
+    return filename
+
+
+def test_loaded_articles_are_skipped(tmp_path):
+    filename = _load(tmp_path)
+
+    assert transform_main._loaded_content_hashes(["a", "b"], filename) == {"a": "hash a"}
+
+
+def test_articles_without_terms_are_not_skipped_with_term_frequencies(tmp_path):
+    filename = _load(tmp_path)
+    assert transform_main._loaded_content_hashes(["a"], filename, term_frequencies=True) == {}
+
+    filename = _load(tmp_path, tf_terms_body=[["body"]], tf_counts_body=[[1]])
+    assert transform_main._loaded_content_hashes(["a"], filename, term_frequencies=True) == {"a": "hash a"}
@@ -0,0 +1,61 @@
+import csv
+import os
+
+import stages
+
+writer = stages.load_module("extract", "writer")
+
+
+class Article:
+    def __init__(self, number):
+        self.article_links = "https://example.com/{}.html".format(number)
+        self.body = "body {}".format(number)
+        self.title = "title {}".format(number)
+        self.content_hash = "hash {}".format(number)
+
+
+def _rows(filename):
+    with open(filename, mode="r", newline="", encoding="utf-8") as file:
+        return list(csv.DictReader(file))
+
+
+def test_resume_truncates_to_the_last_checkpoint(tmp_path):
+    filename = str(tmp_path / "articles.csv")
+    article_writer = writer.ArticleWriter(filename, flush_every=2).open()
+    for number in range(3):
+        article_writer.write(Article(number))
+    # el proceso se cae: la tercera fila quedó después del checkpoint, más una fila a medias
+    article_writer._file.write("https://example.com/3.html,bo")
+    article_writer._file.flush()
+
+    resumed = writer.ArticleWriter(filename, flush_every=2).open()
+
+    assert resumed.rows_written == 2
+    assert resumed.written_links == {"https://example.com/0.html", "https://example.com/1.html"}
+    resumed.write(Article(2))
+    resumed.close()
+    assert [row["title"] for row in _rows(filename)] == ["title 0", "title 1", "title 2"]
+    assert not os.path.exists(filename + ".checkpoint")
+
+
+def test_failed_run_keeps_the_checkpoint(tmp_path):
+    filename = str(tmp_path / "articles.csv")
+    try:
+        with writer.ArticleWriter(filename, flush_every=10) as article_writer:
+            article_writer.write(Article(0))
+            raise RuntimeError("crash")
+    except RuntimeError:
+        pass
+
+    assert os.path.exists(filename + ".checkpoint")
+    assert writer.ArticleWriter(filename).open().written_links == {"https://example.com/0.html"}
+
+
+def test_without_resume_starts_a_new_file(tmp_path):
+    filename = str(tmp_path / "articles.csv")
+    with writer.ArticleWriter(filename) as article_writer:
+        article_writer.write(Article(0))
+    with writer.ArticleWriter(filename, resume=False) as article_writer:
+        article_writer.write(Article(1))
+
+    assert [row["title"] for row in _rows(filename)] == ["title 1"]
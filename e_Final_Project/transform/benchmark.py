@@ -0,0 +1,311 @@
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import language
+import main as transform
+import near_duplicates
+import tokenizer
+
+# Para correrlo (desde la carpeta transform):
+#   python benchmark.py stages --rows 1000000
+#   python benchmark.py formats
+#   python benchmark.py stream --rows 50000
+#   python benchmark.py near-duplicates --rows 10000 50000 100000
+
+logger = logging.getLogger(__name__)
+
+_WORDS = ("gobierno presidente ciudad salud pandemia economía mercado cultura deporte elecciones "
+          "escuela hospital ciencia empresa mundo país").split()
+
+
+def synthetic_articles(rows, seed=0, missing_body_ratio=0.05):
+    # Frame con las mismas columnas que genera el paso extract (article_links, body, title)
+    rng = np.random.default_rng(seed)
+    words = np.array(_WORDS)
+    slugs = ["-".join(words[rng.integers(0, len(words), 4)]) for _ in range(min(rows, 5000))]
+    paragraphs = ["{}\n{}\r\n".format(" ".join(words[rng.integers(0, len(words), 40)]),
+                                       " ".join(words[rng.integers(0, len(words), 40)]))
+                  for _ in range(min(rows, 5000))]
+
+    article_links = ["https://elpais.com/{}/{}-{}.html".format(index % 97, slugs[index % len(slugs)], index)
+                     for index in range(rows)]
+    body = pd.Series([paragraphs[index % len(paragraphs)] for index in range(rows)], dtype=object)
+    body[rng.random(rows) < missing_body_ratio] = np.nan
+    title = [slugs[(index * 7) % len(slugs)].replace("-", " ").capitalize() for index in range(rows)]
+
+    return pd.DataFrame({"article_links": article_links, "body": body, "title": title})
+
+
+# Implementaciones originales (fila por fila) para comparar
+
+def _legacy_fill_missing_bodies(df):
+    missing_bodies_mask = df["body"].isna()
+    missing_bodies = (df[missing_bodies_mask]["article_links"]
+                      .str.extract(r"(?P<missing_bodies>[^/]+)$")
+                      .apply(lambda column: column.map(lambda body: body.split("-")))
+                      .apply(lambda column: column.map(lambda body_word_list: " ".join(body_word_list)))
+                      )
+    df.loc[missing_bodies_mask, "body"] = missing_bodies.loc[:, "missing_bodies"]
+
+    return df
+
+
+def _legacy_generate_uids_for_rows(df):
+    uids = (df
+            .apply(lambda row: hashlib.md5(bytes(row["article_links"].encode())), axis=1)
+            .apply(lambda hash_object: hash_object.hexdigest())
+            )
+    df["uid"] = uids
+    df.set_index("uid", inplace=True)
+
+    return df
+
+
+def _legacy_remove_new_lines_from_body(df):
+    strippped_body = (df
+                      .apply(lambda row: row["body"], axis=1)
+                      .apply(lambda body: list(body))
+                      .apply(lambda letters: list(map(lambda letter: letter.replace("\n", " "), letters)))
+                      .apply(lambda letters: list(map(lambda letter: letter.replace("\r", " "), letters)))
+                      .apply(lambda letters: "".join(letters))
+                      )
+    df["body"] = strippped_body
+
+    return df
+
+
+def _legacy_tokenize_column(df, column_name, language_name):
+    resources = language.resources(language_name)
+    stop_words = resources.stop_words
+    tokenize_column = (df
+                       .dropna()
+                       .apply(lambda row: resources.tokenize(row[column_name]), axis=1)
+                       .apply(lambda tokens: list(filter(lambda token: token.isalpha(), tokens)))
+                       .apply(lambda tokens: list(map(lambda token: token.lower(), tokens)))
+                       .apply(lambda word_list: list(filter(lambda word: word not in stop_words, word_list)))
+                       .apply(lambda valid_word_list: len(valid_word_list))
+                       )
+    df["n_tokens_{}".format(column_name)] = tokenize_column
+
+    return df
+
+
+STAGES = [
+    ("_fill_missing_bodies", _legacy_fill_missing_bodies, transform._fill_missing_bodies),
+    ("_generate_uids_for_rows", _legacy_generate_uids_for_rows, transform._generate_uids_for_rows),
+    ("_remove_new_lines_from_body", _legacy_remove_new_lines_from_body, transform._remove_new_lines_from_body),
+]
+
+
+def _timed(stage, df):
+    start = time.perf_counter()
+    df = stage(df)
+
+    return df, time.perf_counter() - start
+
+
+def bench_stages(args):
+    legacy_df = synthetic_articles(args.rows)
+    current_df = legacy_df.copy()
+
+    print("{:<30} {:>12} {:>12} {:>9}".format("stage", "before (s)", "after (s)", "speedup"))
+    for name, legacy_stage, current_stage in STAGES:
+        current_df, current_time = _timed(current_stage, current_df)
+        if args.skip_legacy:
+            print("{:<30} {:>12} {:>12.3f} {:>9}".format(name, "-", current_time, "-"))
+            continue
+
+        legacy_df, legacy_time = _timed(legacy_stage, legacy_df)
+        # la salida tiene que ser idéntica
+        pd.testing.assert_frame_equal(legacy_df, current_df)
+        print("{:<30} {:>12.3f} {:>12.3f} {:>8.1f}x".format(name, legacy_time, current_time,
+                                                          legacy_time / current_time))
+
+
+def bench_tokenize(args):
+    df = synthetic_articles(args.rows)
+    df = transform._fill_missing_bodies(df)
+    # algunas filas sin título para comprobar que se respetan los NaN igual que antes
+    df.loc[df.index[::50], "title"] = np.nan
+
+    legacy_df = df.copy()
+    start = time.perf_counter()
+    legacy_df = _legacy_tokenize_column(legacy_df, "title", "spanish")
+    legacy_df = _legacy_tokenize_column(legacy_df, "body", "spanish")
+    legacy_time = time.perf_counter() - start
+    print("{:<30} {:>12.3f} {:>10.0f} rows/s".format("row-wise apply", legacy_time, len(df) / legacy_time))
+
+    for workers in args.workers:
+        current_df = df.copy()
+        start = time.perf_counter()
+        current_df = tokenizer.tokenize_columns(current_df, ["title", "body"], "spanish", workers=workers,
+                                                chunk_size=args.chunk_size)
+        current_time = time.perf_counter() - start
+        pd.testing.assert_frame_equal(legacy_df, current_df)
+        print("{:<30} {:>12.3f} {:>10.0f} rows/s".format("tokenize_columns workers={}".format(workers),
+                                                         current_time, len(df) / current_time))
+
+
+def _default_format_files():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+    return (sorted(glob.glob(os.path.join(base_dir, "..", "extract", "*_articles.csv")))
+            + sorted(glob.glob(os.path.join(base_dir, "..", "..", "d_Data_systems", "*_cleaned.csv"))))
+
+
+def _timed_call(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+
+    return result, time.perf_counter() - start
+
+
+def bench_formats(args):
+    # CSV contra Parquet para los archivos intermedios: tiempo de escritura, de lectura y tamaño en disco.
+    # Con --copies cada archivo se repite varias veces para medir tiempos más grandes; ojo, las filas repetidas
+    # favorecen mucho a Parquet (el diccionario de cada columna se las queda), el tamaño real es el de --copies 1.
+    import pyarrow.parquet  # noqa: F401 (que el import no cuente en el primer archivo)
+
+    print("{:<45} {:>8} {:>11} {:>11} {:>11}".format("file", "format", "write (s)", "read (s)", "size (KB)"))
+    with tempfile.TemporaryDirectory() as directory:
+        for filename in args.files or _default_format_files():
+            cleaned = filename.endswith("_cleaned.csv")
+            df = transform._read_data(filename)
+            if cleaned:
+                df = df.set_index("uid")
+            df = pd.concat([df] * args.copies)
+
+            csv_filename = os.path.join(directory, "articles.csv")
+            parquet_filename = os.path.join(directory, "articles.parquet")
+            if cleaned:
+                write_csv = lambda: df.to_csv(csv_filename, encoding="utf-8-sig")
+                write_parquet = lambda: transform._write_parquet(df, parquet_filename)
+            else:
+                write_csv = lambda: df.to_csv(csv_filename, index=False, encoding="utf-8")
+                write_parquet = lambda: df.to_parquet(parquet_filename, index=False, compression="zstd")
+
+            for name, write, path in (("csv", write_csv, csv_filename), ("parquet", write_parquet, parquet_filename)):
+                _, write_time = _timed_call(write)
+                _, read_time = _timed_call(transform._read_data, path)
+                print("{:<45} {:>8} {:>11.3f} {:>11.3f} {:>11.0f}".format(
+                    os.path.basename(filename), name, write_time, read_time, os.path.getsize(path) / 1024))
+
+
+def _traced(function, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, elapsed, peak
+
+
+def bench_stream(args):
+    # Todo el archivo en memoria contra stream() por bloques: tiempo y pico de memoria de python (tracemalloc).
+    # El archivo limpio tiene que quedar idéntico byte por byte.
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "elpais_benchmark_articles.csv")
+        synthetic_articles(args.rows).to_csv(filename, index=False, encoding="utf-8")
+        cleaned_filename = transform._cleaned_filename(filename)
+
+        def whole_file():
+            transform._save_df(transform.main(filename), filename)
+
+        _, whole_time, whole_peak = _traced(whole_file)
+        with open(cleaned_filename, mode="rb") as file:
+            expected = file.read()
+
+        print("{:<25} {:>10} {:>12}".format("mode", "time (s)", "peak (MB)"))
+        print("{:<25} {:>10.3f} {:>12.1f}".format("whole file", whole_time, whole_peak / 2 ** 20))
+        for chunk_size in args.chunk_sizes:
+            _, chunk_time, chunk_peak = _traced(transform.stream, filename, chunk_size=chunk_size)
+            with open(cleaned_filename, mode="rb") as file:
+                assert file.read() == expected, "chunk_size={} changed the cleaned file".format(chunk_size)
+            print("{:<25} {:>10.3f} {:>12.1f}".format("chunk_size={}".format(chunk_size), chunk_time,
+                                                      chunk_peak / 2 ** 20))
+
+
+def _synthetic_bodies(rows, words_per_body=300, vocabulary=20000, duplicate_ratio=0.05, changed_words=0.01, seed=0):
+    # cuerpos con palabras al azar; una parte son copias de otro cuerpo con changed_words de las palabras cambiadas
+    rng = np.random.default_rng(seed)
+    words = np.array(["palabra{}".format(index) for index in range(vocabulary)])
+    bodies = [list(words[rng.integers(0, vocabulary, words_per_body)]) for _ in range(rows)]
+    planted = {}
+    for index in rng.choice(np.arange(1, rows), int(rows * duplicate_ratio), replace=False):
+        original = int(rng.integers(0, index))
+        body = list(bodies[original])
+        for position in rng.choice(words_per_body, int(words_per_body * changed_words), replace=False):
+            body[position] = words[rng.integers(0, vocabulary)]
+        bodies[index] = body
+        planted[str(index)] = str(original)
+
+    return bodies, planted
+
+
+def bench_near_duplicates(args):
+    # Tiempo de LshIndex.deduplicate por artículo conforme crece el índice (tiene que mantenerse casi constante,
+    # no crecer con el número de artículos como una comparación de todos contra todos) y cuántas copias encuentra
+    print("{:>10} {:>10} {:>12} {:>10} {:>10}".format("rows", "time (s)", "articles/s", "planted", "found"))
+    for rows in args.rows:
+        bodies, planted = _synthetic_bodies(rows)
+        with tempfile.TemporaryDirectory() as directory:
+            index = near_duplicates.LshIndex(os.path.join(directory, "near_duplicates.db"))
+            duplicates = {}
+            start = time.perf_counter()
+            for batch_start in range(0, rows, args.batch_size):
+                batch = range(batch_start, min(batch_start + args.batch_size, rows))
+                duplicates.update(index.deduplicate([str(row) for row in batch], [bodies[row] for row in batch]))
+            elapsed = time.perf_counter() - start
+            index.close()
+
+        # una copia de una copia puede reportarse contra cualquiera de las dos, basta con que se encuentre
+        found = sum(1 for uid in planted if uid in duplicates)
+        print("{:>10} {:>10.2f} {:>12.0f} {:>10} {:>10}".format(rows, elapsed, rows / elapsed, len(planted), found))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    stages_parser = subparsers.add_parser("stages", help="Row-wise vs vectorized transform stages")
+    stages_parser.add_argument("--rows", type=int, default=1000000, help="Rows in the synthetic article frame")
+    stages_parser.add_argument("--skip-legacy", action="store_true", help="Only time the current implementation")
+    stages_parser.set_defaults(func=bench_stages)
+
+    tokenize_parser = subparsers.add_parser("tokenize", help="Row-wise tokenization vs the chunked process pool")
+    tokenize_parser.add_argument("--rows", type=int, default=20000, help="Rows in the synthetic article frame")
+    tokenize_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    tokenize_parser.add_argument("--chunk-size", type=int, default=tokenizer.DEFAULT_CHUNK_SIZE)
+    tokenize_parser.set_defaults(func=bench_tokenize)
+
+    formats_parser = subparsers.add_parser("formats", help="CSV vs Parquet intermediate files")
+    formats_parser.add_argument("files", nargs="*", help="Article files (extract/*_articles.csv and the "
+                                                         "d_Data_systems cleaned files by default)")
+    formats_parser.add_argument("--copies", type=int, default=1, help="Times each file is repeated")
+    formats_parser.set_defaults(func=bench_formats)
+
+    stream_parser = subparsers.add_parser("stream", help="Whole-file transform vs chunked stream()")
+    stream_parser.add_argument("--rows", type=int, default=50000, help="Rows in the synthetic article file")
+    stream_parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[1000, transform.DEFAULT_CHUNK_SIZE])
+    stream_parser.set_defaults(func=bench_stream)
+
+    near_duplicates_parser = subparsers.add_parser("near-duplicates", help="MinHash/LSH dedup as the index grows")
+    near_duplicates_parser.add_argument("--rows", type=int, nargs="+", default=[10000, 50000, 100000])
+    near_duplicates_parser.add_argument("--batch-size", type=int, default=transform.DEFAULT_CHUNK_SIZE)
+    near_duplicates_parser.set_defaults(func=bench_near_duplicates)
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    args.func(args)
@@ -0,0 +1,75 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Copia local de las stopwords de nltk (mismo formato que nltk_data/corpora/stopwords) para poder trabajar sin red
+VENDORED_STOPWORDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "stopwords")
+
+
+class LanguageResources:
+    def __init__(self, language, tokenize, stop_words):
+        self.language = language
+        self.tokenize = tokenize
+        self.stop_words = stop_words
+
+
+# {language: LanguageResources}, se llena la primera vez que se pide cada idioma (una vez por proceso)
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def resources(language):
+    if language not in _registry:
+        with _registry_lock:
+            if language not in _registry:
+                _registry[language] = LanguageResources(language, _load_tokenizer(), _load_stop_words(language))
+
+    return _registry[language]
+
+
+def _load_tokenizer():
+    # nltk se importa hasta que de verdad vamos a tokenizar, así las corridas que no tokenizan no pagan el import
+    import nltk
+
+    # word_tokenize necesita el modelo punkt para separar oraciones. Si no está lo bajamos una vez, como antes; sin
+    # punkt los conteos de palabras serían otros, así que si no se puede bajar preferimos fallar
+    if not _has_punkt(nltk):
+        for package in ("punkt_tab", "punkt"):
+            nltk.download(package, quiet=True)
+        if not _has_punkt(nltk):
+            raise LookupError("nltk punkt data not found and it could not be downloaded, install it with: "
+                              "python -m nltk.downloader punkt_tab punkt")
+
+    # se usa el punkt por defecto (inglés) como siempre, el conteo de palabras no cambia
+    return nltk.word_tokenize
+
+
+def _has_punkt(nltk):
+    try:
+        nltk.word_tokenize("punkt")
+    except LookupError:
+        return False
+
+    return True
+
+
+def _load_stop_words(language):
+    # los stop_words: vienen en minúsuculas
+    try:
+        import nltk
+        nltk.data.find("corpora/stopwords/{}".format(language))
+        from nltk.corpus import stopwords
+
+        return frozenset(stopwords.words(language))
+    except (ImportError, LookupError):
+        pass
+
+    vendored_path = os.path.join(VENDORED_STOPWORDS_DIR, language)
+    if not os.path.exists(vendored_path):
+        raise LookupError("No stopwords found for {}".format(language))
+
+    logger.info("Using vendored stopwords for {}".format(language))
+    with open(vendored_path, mode="r", encoding="utf-8") as file:
+        return frozenset(line.strip() for line in file if line.strip())
@@ -1,50 +1,178 @@
 import argparse
+import codecs
+import json
 import logging
+import os
+import sqlite3
+from collections import Counter
 from urllib.parse import urlparse
 import pandas as pd
 import hashlib
-import nltk # nltk: Ayuda a trabjar con lenguage natural
-from nltk.corpus import stopwords
-# stopwords : son palabras que no añaden ningún tipo de analisis posterior, por ejemplo "el, la",
-# palabras que se utilizan mucho en el lenguage pero no ayudan a determinar que está sucedienendo
-# dentro de nuestro análisis de texto
+import language
+import near_duplicates
+import tokenizer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_CHUNK_SIZE = 10000
 
-def main(filename):
+# los artículos que ya se cargaron: con ellos se llena el índice de casi duplicados la primera vez
+# (ver near_duplicate_index) y se revisa qué artículos no cambiaron (ver _remove_unchanged_articles)
+LOADED_ARTICLES_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "load", "newspaper.db")
+
+
+def main(filename, workers=1, near_duplicates_index=None, term_frequencies=False, loaded_articles_db=None):
     logger.info("Starting cleaning process")
 
     df = _read_data(filename)
     newspaper_uid = _extract_newspaper_uid(filename)
+
+    return transform(df, newspaper_uid, workers=workers, near_duplicates_index=near_duplicates_index,
+                     term_frequencies=term_frequencies, loaded_articles_db=loaded_articles_db)
+
+
+def stream(filename, output_format="csv", chunk_size=DEFAULT_CHUNK_SIZE, workers=1, near_duplicates_index=None,
+           term_frequencies=False, loaded_articles_db=None):
+    # Igual que main + _save_df pero leyendo el archivo en bloques de chunk_size filas: cada bloque pasa por las
+    # mismas etapas y se agrega al archivo limpio, así la memoria depende del tamaño del bloque y no del archivo.
+    # Lo único que se guarda entre bloques es el hash de los títulos ya vistos (ver _remove_duplicate_entries).
+    logger.info("Starting cleaning process in chunks of {} rows".format(chunk_size))
+
+    newspaper_uid = _extract_newspaper_uid(filename)
+    seen_titles = set()
+    chunks = (transform(df, newspaper_uid, workers=workers, seen_titles=seen_titles,
+                        near_duplicates_index=near_duplicates_index, term_frequencies=term_frequencies,
+                        loaded_articles_db=loaded_articles_db)
+              for df in _read_chunks(filename, chunk_size))
+
+    return _save_chunks(chunks, filename, output_format)
+
+
+def transform(df, newspaper_uid, workers=1, seen_titles=None, near_duplicates_index=None, term_frequencies=False,
+              loaded_articles_db=None):
+    # todas las etapas de limpieza sobre un DataFrame que ya está en memoria (pipeline.py lo llama directamente
+    # con lo que regresa el paso extract, sin pasar por un CSV)
+    # seen_titles: lo usa stream() para quitar duplicados entre bloques
+    # near_duplicates_index: un near_duplicates.LshIndex para quitar también los artículos casi iguales
+    # term_frequencies: agrega las palabras de título y body y cuántas veces aparece cada una (ver _term_frequencies)
+    # loaded_articles_db: ruta de newspaper.db; los artículos que ya están ahí con el mismo content_hash se quitan
+    #                     antes de tokenizar, así solo se procesa lo nuevo o lo que cambió
+    keep_tokens = near_duplicates_index is not None or term_frequencies
+
+    df = _add_content_hash_column(df)
     df = _add_newspaper_uid_column(df, newspaper_uid)
     df = _extract_host(df)
     df = _fill_missing_bodies(df)
     df = _generate_uids_for_rows(df)
     df = _remove_new_lines_from_body(df)
-    df = _tokenize_column(df, "title", "spanish")
-    df = _tokenize_column(df, "body", "spanish")
-    df = _remove_duplicate_entries(df, "title")
+    # quitar los títulos repetidos no depende de los tokens, así no tokenizamos filas que se van a eliminar
+    df = _remove_duplicate_entries(df, "title", seen_titles)
+    if loaded_articles_db:
+        df = _remove_unchanged_articles(df, loaded_articles_db, term_frequencies)
+    df = _tokenize_columns(df, ["title", "body"], "spanish", workers, keep_tokens=keep_tokens)
+    if near_duplicates_index is not None:
+        df = _remove_near_duplicate_entries(df, "body", near_duplicates_index)
     df = _drop_rows_with_missing_values(df)
+    if term_frequencies:
+        df = _term_frequencies(df, ["title", "body"])
+    if keep_tokens:
+        df = _drop_token_columns(df)
 
     return df
 
 
+def near_duplicate_index(path=near_duplicates.DEFAULT_INDEX_PATH, threshold=near_duplicates.DEFAULT_THRESHOLD,
+                         seed_db=LOADED_ARTICLES_DB):
+    index = near_duplicates.LshIndex(path, threshold=threshold)
+
+    if seed_db and len(index) == 0:
+        _seed_near_duplicate_index(index, seed_db)
+
+    return index
+
+
+def _seed_near_duplicate_index(index, seed_db):
+    # la primera vez agregamos los artículos que ya están cargados en newspaper.db, para no volver a cargar una
+    # nota que ya teníamos
+    if not os.path.exists(seed_db):
+        return
+
+    connection = sqlite3.connect("file:{}?mode=ro".format(seed_db), uri=True)
+    try:
+        articles = connection.execute("SELECT id, body FROM articles WHERE body IS NOT NULL").fetchall()
+    except sqlite3.OperationalError:
+        # la base de datos todavía no tiene la tabla articles
+        articles = []
+    finally:
+        connection.close()
+
+    resources = language.resources("spanish")
+    index.deduplicate([uid for uid, _ in articles],
+                      [tokenizer.valid_tokens(body, resources) for _, body in articles])
+    logger.info("Seeded near duplicates index with {} articles from {}".format(len(index), seed_db))
+
+
 def _read_data(filename):
     logger.info("Reading file {}".format(filename))
 
-    return pd.read_csv(filename, encoding="ISO-8859-1")
+    if filename.endswith(".parquet"):
+        return pd.read_parquet(filename)
+
+    return pd.read_csv(filename, encoding=_csv_encoding(filename))
+
+
+def _read_chunks(filename, chunk_size):
+    logger.info("Reading file {}".format(filename))
+
+    if filename.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(filename).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        # dtype=str: un bloque puede tener una columna completamente vacía y pandas la leería como float
+        yield from pd.read_csv(filename, encoding=_csv_encoding(filename), chunksize=chunk_size,
+                               dtype={"article_links": str, "body": str, "title": str})
+
+
+def _csv_encoding(filename):
+    # extract ahora escribe el CSV en UTF-8; los archivos viejos venían en ISO-8859-1.
+    # Revisamos todo el archivo antes de leerlo (por bloques, sin cargarlo en memoria), así stream() no descubre
+    # a la mitad que el encoding era otro.
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(filename, mode="rb") as file:
+        try:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                decoder.decode(block)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "ISO-8859-1"
+
+    return "utf-8"
 
 
 def _extract_newspaper_uid(filename):
     logger.info("Extracting newspaper uid")
-    newspaper_uid = filename.split("_")[0]
+    newspaper_uid = os.path.basename(filename).split("_")[0]
     logger.info("Newspaper uid detected: {}".format(newspaper_uid))
 
     return newspaper_uid
 
 
+def _add_content_hash_column(df):
+    # extract ya manda content_hash; para los archivos de antes lo calculamos aquí con la misma fórmula
+    # (news_page_objects.ArticlePage.content_hash), sobre el título y el body tal como se descargaron
+    if "content_hash" in df.columns:
+        return df
+
+    logger.info("Generating content hashes")
+    df["content_hash"] = [hashlib.md5("{}\n{}".format(title, body).encode()).hexdigest()
+                          for title, body in zip(df["title"].fillna(""), df["body"].fillna(""))]
+
+    return df
+
+
 def _add_newspaper_uid_column(df, newspaper_uid):
     logger.info("Filling newspaper_uid column with {}".format(newspaper_uid))
     df["newspaper_uid"] = newspaper_uid
@@ -68,14 +196,12 @@ def _fill_missing_bodies(df):
     # ([^/]+)$ --> vamos ir hasta el final de nuestro string
     # (?P<missing_bodies>[^/]+)$ --> colocar un nombre al grupo
 
-    # applymap nos permite generar un mapa de un valor a otro, es decir una transformación
-
-    missing_bodies = (df[missing_bodies_mask]["article_links"]
-                      .str.extract(r"(?P<missing_bodies>[^/]+)$")
-                      .applymap(lambda body: body.split("-"))
-                      .applymap(lambda body_word_list: " ".join(body_word_list))
+    # str.replace trabaja sobre toda la columna a la vez, es lo mismo que separar por "-" y volver a unir con " "
+    missing_bodies = (df.loc[missing_bodies_mask, "article_links"]
+                      .str.extract(r"(?P<missing_bodies>[^/]+)$", expand=False)
+                      .str.replace("-", " ", regex=False)
                       )
-    df.loc[missing_bodies_mask, "body"] = missing_bodies.loc[:, "missing_bodies"]
+    df.loc[missing_bodies_mask, "body"] = missing_bodies
 
     return df
 
@@ -85,14 +211,8 @@ def _generate_uids_for_rows(df):
     # hashlib --> normalmente se utiliza para operaciones criptográficas, pero la vamos a utilziar para generar un hash
     #            de la URL, de tal manera que tengamos un número único que mapee siempre a esa URL
 
-    # axis=0 -->columbas
-    # axis=1 -->filas
-
-    uids = (df
-            .apply(lambda row: hashlib.md5(bytes(row["article_links"].encode())), axis=1)
-            .apply(lambda hash_object: hash_object.hexdigest())
-            )
-    df["uid"] = uids
+    # en lugar de df.apply(..., axis=1), que arma una Serie por cada fila, recorremos directamente la columna
+    df["uid"] = [hashlib.md5(article_link.encode()).hexdigest() for article_link in df["article_links"]]
 
     # inplace --> le indica que queremos modificar directamente nuestra tabla
     df.set_index("uid", inplace=True)
@@ -102,71 +222,200 @@ def _generate_uids_for_rows(df):
 
 def _remove_new_lines_from_body(df):
     logger.info("Removing new lines from body")
-    strippped_body = (df
-                      .apply(lambda row: row["body"], axis=1)
-                      .apply(lambda body: list(body))
-                      .apply(lambda letters: list(map(lambda letter: letter.replace("\n", " "), letters)))
-                      .apply(lambda letters: list(map(lambda letter: letter.replace("\r", " "), letters)))
-                      .apply(lambda letters: "".join(letters))
-                      )
-    df["body"] = strippped_body
+    # cambiamos cada "\n" y cada "\r" por un espacio en toda la columna de una sola vez
+    df["body"] = (df["body"]
+                  .str.replace("\n", " ", regex=False)
+                  .str.replace("\r", " ", regex=False)
+                  )
 
     return df
 
 
-def _tokenize_column(df, column_name, language):
-    # una función que nos va a generar las transformaciones en la columna deseada (primero título y luego enn el body)
-    logger.info("Tokenizing column {}".format(column_name))
-    # si nunca hemos corrido nltk, nos va a pedir que bajemos los archivos adicionales, instalarla no
-    # es suficiente porque es una librería enorme, entonces la primera vez que corremos esta librería,
-    # nos pide que ajemos las librerías adicionales, se debe colocar el siguiente código
-    try:
-        nltk.data.find("tokenizers/punkt")
-        # punkt: librería para poder tokenizar, es decir dividir en palabras
-    except LookupError:
-        nltk.download("punkt")
+def _remove_unchanged_articles(df, loaded_articles_db, term_frequencies=False):
+    logger.info("Removing articles already loaded without changes")
+    loaded_hashes = _loaded_content_hashes(list(df.index), loaded_articles_db, term_frequencies)
+    unchanged = [loaded_hashes.get(uid) == content_hash for uid, content_hash in zip(df.index, df["content_hash"])]
+    logger.info("{} of {} articles are unchanged".format(sum(unchanged), len(unchanged)))
+
+    # copy(): las etapas siguientes agregan columnas, sin copia pandas no sabe si escribe sobre df o sobre el filtro
+    return df[[not is_unchanged for is_unchanged in unchanged]].copy()
+
+
+def _loaded_content_hashes(uids, loaded_articles_db, term_frequencies=False):
+    # {uid: content_hash} de los artículos que ya están en newspaper.db
+    # term_frequencies: solo cuentan los que ya tienen sus palabras en article_terms, los que se cargaron sin
+    #                   --term-frequencies se vuelven a procesar para llenar esa tabla
+    if not os.path.exists(loaded_articles_db):
+        return {}
 
+    query = "SELECT id, content_hash FROM articles WHERE id IN ({})"
+    if term_frequencies:
+        query += " AND EXISTS (SELECT 1 FROM article_terms WHERE article_terms.article_id = articles.id)"
+
+    connection = sqlite3.connect("file:{}?mode=ro".format(loaded_articles_db), uri=True)
     try:
-        nltk.data.find("stopwords")
-    except LookupError:
-        nltk.download("stopwords")
+        return dict(near_duplicates.select_in(connection, query, uids))
+    except sqlite3.OperationalError:
+        # todavía no hay tabla articles (o article_terms), o es de antes de que existiera content_hash
+        return {}
     finally:
-        stop_words = set(stopwords.words(language))
-        # los stop_words: vienen en minúsuculas
+        connection.close()
 
-    tokenize_column = (df
-                       .dropna() # Eliminamos las que no tienen datos, de lo contrario nltk existirá un error.
-                       .apply(lambda row: nltk.word_tokenize(row[column_name]), axis=1)
-                       .apply(lambda tokens: list(filter(lambda token: token.isalpha(), tokens))) # Eliminar palabras que no sean alfanuméricas
-                       .apply(lambda tokens: list(map(lambda token: token.lower(), tokens))) # convertir todos los tokesns a lowerCase
-                       .apply(lambda word_list: list(filter(lambda word: word not in stop_words, word_list))) # Eliminar las palabras que sean stop_words
-                       .apply(lambda valid_word_list: len(valid_word_list)) # obtener la longitud que tiene cada una de estas listas
-                       )
 
-    df["n_tokens_{}".format(column_name)] = tokenize_column
+def _tokenize_columns(df, column_names, language, workers=1, keep_tokens=False):
+    # genera las columnas n_tokens_<columna> (primero título y luego el body) en una sola pasada por las filas,
+    # repartiendo el trabajo entre varios procesos si workers > 1
+    # keep_tokens: también deja las palabras en tokens_<columna> para las etapas siguientes
+    logger.info("Tokenizing columns {} with {} workers".format(", ".join(column_names), workers))
 
-    return df
+    return tokenizer.tokenize_columns(df, column_names, language, workers=workers, keep_tokens=keep_tokens)
 
 
-def _remove_duplicate_entries(df, column_name):
+def _remove_duplicate_entries(df, column_name, seen=None):
     logger.info("Removing duplicate entries")
-    # keep: que tome los valores del primer duplicado o el último (last).
-    # inplace = realizamos la modificación directamente.
-    df.drop_duplicates(subset=[column_name], keep="first", inplace=True)
+    if seen is None:
+        # keep: que tome los valores del primer duplicado o el último (last).
+        # inplace = realizamos la modificación directamente.
+        df.drop_duplicates(subset=[column_name], keep="first", inplace=True)
+
+        return df
+
+    # Por bloques: seen guarda el md5 (16 bytes) de cada valor que ya apareció en un bloque anterior o en este, así
+    # nos quedamos con la primera aparición en todo el archivo, igual que drop_duplicates sobre el archivo completo
+    keep = []
+    for value in df[column_name]:
+        key = None if pd.isna(value) else hashlib.md5(str(value).encode()).digest()
+        keep.append(key not in seen)
+        seen.add(key)
+
+    return df[keep].copy()
+
+
+def _remove_near_duplicate_entries(df, column_name, index):
+    logger.info("Removing near duplicate entries")
+    # usamos las palabras que ya sacó _tokenize_columns; las filas sin palabras (NaN) se eliminan más adelante
+    tokens = df["tokens_{}".format(column_name)].dropna()
+    duplicates = index.deduplicate(tokens.index, tokens)
+
+    for uid, duplicate_of in duplicates.items():
+        logger.info("Article {} is a near duplicate of {}".format(uid, duplicate_of))
+
+    return df[~df.index.isin(list(duplicates))]
+
+
+def _term_frequencies(df, column_names):
+    logger.info("Counting term frequencies")
+    # Dos listas paralelas por columna: tf_terms_<columna> con las palabras, de la más a la menos frecuente, y
+    # tf_counts_<columna> con cuántas veces aparece cada una. El paso load cambia cada palabra por su id en la tabla
+    # terms y guarda los conteos en article_terms.
+    for column_name in column_names:
+        frequencies = [Counter(tokens).most_common() for tokens in df["tokens_{}".format(column_name)]]
+        df["tf_terms_{}".format(column_name)] = [[term for term, _ in counts] for counts in frequencies]
+        df["tf_counts_{}".format(column_name)] = [[count for _, count in counts] for counts in frequencies]
 
     return df
 
 
+def _drop_token_columns(df):
+    return df.drop(columns=[column for column in df.columns if column.startswith("tokens_")])
+
+
 def _drop_rows_with_missing_values(df):
     logger.info("Dropping rows with missing values")
+    df = df.dropna()
+
+    # si alguna fila no tenía título las columnas n_tokens quedaron como float; sin esas filas ya son enteras
+    # (así todos los bloques de stream() escriben los conteos igual)
+    return df.astype({column: "int64" for column in df.columns if column.startswith("n_tokens_")})
+
+
+def _cleaned_filename(filename, output_format="csv"):
+    return "{}_cleaned.{}".format(os.path.splitext(filename)[0], output_format)
+
+
+def _save_df(df, filename, output_format="csv"):
+    filename = _cleaned_filename(filename, output_format)
+    logger.info("Saving new file at location {}".format(filename))
 
-    return df.dropna()
+    if output_format == "parquet":
+        _write_parquet(df, filename)
+    else:
+        _csv_frame(df).to_csv(filename, encoding="utf-8-sig")
 
 
-def _save_df(df, filename):
-    filename = "{}_cleaned.csv".format(filename[:-4])
+def _save_chunks(chunks, filename, output_format="csv"):
+    # escribe cada bloque limpio al final del archivo en cuanto sale de transform()
+    filename = _cleaned_filename(filename, output_format)
     logger.info("Saving new file at location {}".format(filename))
-    df.to_csv(filename, encoding="utf-8-sig")
+    rows = 0
+    parquet_writer = None
+
+    try:
+        for index, df in enumerate(chunks):
+            if output_format == "parquet":
+                import pyarrow.parquet as pq
+
+                table = _parquet_table(df)
+                if parquet_writer is None:
+                    parquet_writer = pq.ParquetWriter(filename, table.schema, compression="zstd")
+                parquet_writer.write_table(table)
+            else:
+                # el BOM de utf-8-sig solo se escribe al principio del archivo, no en cada append
+                _csv_frame(df).to_csv(filename, mode="w" if index == 0 else "a", header=index == 0,
+                                      encoding="utf-8-sig")
+            rows += len(df)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+
+    return rows
+
+
+def _csv_frame(df):
+    # en el CSV las listas de _term_frequencies van como JSON; en Parquet son columnas de tipo lista
+    lists = [column for column in df.columns if column.startswith(("tf_terms_", "tf_counts_"))]
+    if not lists:
+        return df
+
+    return df.assign(**{column: [json.dumps(value, ensure_ascii=False) for value in df[column]] for column in lists})
+
+
+def _write_parquet(df, filename, compression="zstd"):
+    import pyarrow.parquet as pq
+
+    pq.write_table(_parquet_table(df), filename, compression=compression)
+
+
+def _parquet_table(df):
+    import pyarrow as pa
+
+    # Columnas con tipo fijo: el uid y el content_hash (md5) como 16 bytes en lugar de 32 caracteres hex, los
+    # n_tokens como enteros y lo demás como texto. El índice (uid) se guarda como la primera columna, igual que en
+    # el CSV.
+    df = df.reset_index()
+    types = _parquet_types()
+    schema = pa.schema([(column, types.get(column, pa.string())) for column in df.columns])
+    columns = {column: df[column] for column in df.columns}
+    for column in ("uid", "content_hash"):
+        if column in columns:
+            columns[column] = [bytes.fromhex(value) for value in df[column]]
+
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def _parquet_types():
+    import pyarrow as pa
+
+    return {
+        "uid": pa.binary(16),
+        "content_hash": pa.binary(16),
+        "n_tokens_title": pa.int32(),
+        "n_tokens_body": pa.int32(),
+        "tf_terms_title": pa.list_(pa.string()),
+        "tf_counts_title": pa.list_(pa.int32()),
+        "tf_terms_body": pa.list_(pa.string()),
+        "tf_counts_body": pa.list_(pa.int32()),
+    }
 
 
 if __name__ == "__main__":
@@ -178,10 +427,50 @@ if __name__ == "__main__":
     parser.add_argument("filename",
                         help="The path to the dirty data",
                         type=str)
+    parser.add_argument("--workers",
+                        help="Number of processes used to tokenize title and body",
+                        type=int,
+                        default=1)
+    parser.add_argument("--format",
+                        help="Format of the cleaned file",
+                        choices=["csv", "parquet"],
+                        default="csv")
+    parser.add_argument("--chunk-size",
+                        help="Clean the file in chunks of this many rows instead of reading it all at once "
+                             "(for files that do not fit in memory, {} is a good start)".format(DEFAULT_CHUNK_SIZE),
+                        type=int)
+    parser.add_argument("--near-duplicates",
+                        help="Also drop articles whose body is nearly the same as one already seen, in this file "
+                             "or in previous runs (MinHash/LSH index in transform/near_duplicates.db)",
+                        action="store_true")
+    parser.add_argument("--near-duplicates-threshold",
+                        help="Estimated Jaccard similarity of the body word shingles to count as a duplicate",
+                        type=float,
+                        default=near_duplicates.DEFAULT_THRESHOLD)
+    parser.add_argument("--skip-unchanged",
+                        help="Leave out the articles already in load/newspaper.db with the same title and body",
+                        action="store_true")
+    parser.add_argument("--term-frequencies",
+                        help="Add the words of title and body with the count of each one (tf_terms_* and "
+                             "tf_counts_* columns), for the terms tables of newspaper.db",
+                        action="store_true")
 
     arg = parser.parse_args()
-    df = main(arg.filename)
+    index = near_duplicate_index(threshold=arg.near_duplicates_threshold) if arg.near_duplicates else None
+    loaded_articles_db = LOADED_ARTICLES_DB if arg.skip_unchanged else None
+
+    if arg.chunk_size:
+        rows = stream(arg.filename, output_format=arg.format, chunk_size=arg.chunk_size, workers=arg.workers,
+                      near_duplicates_index=index, term_frequencies=arg.term_frequencies,
+                      loaded_articles_db=loaded_articles_db)
+        logger.info("Saved {} clean articles".format(rows))
+    else:
+        df = main(arg.filename, workers=arg.workers, near_duplicates_index=index,
+                  term_frequencies=arg.term_frequencies, loaded_articles_db=loaded_articles_db)
+
+        print(df)
 
-    print(df)
+        _save_df(df, arg.filename, output_format=arg.format)
 
-    _save_df(df, arg.filename)
+    if index is not None:
+        index.close()
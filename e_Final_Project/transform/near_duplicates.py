@@ -0,0 +1,190 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# el índice vive junto a este archivo, sin importar desde qué carpeta se corra el paso transform
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "near_duplicates.db")
+DEFAULT_THRESHOLD = 0.8
+
+# 128 permutaciones en 16 bandas de 8 filas: dos artículos caen en la misma cubeta de alguna banda con
+# probabilidad 1 - (1 - s^8)^16, que es casi 1 desde una similitud s de 0.8 y casi 0 por debajo de 0.5
+NUM_PERM = 128
+BANDS = 16
+SHINGLE_SIZE = 3
+
+# primo más grande que cabe en 32 bits, así las firmas se guardan como uint32
+_PRIME = 4294967291
+
+# sqlite no acepta más de 999 parámetros por consulta en versiones viejas, así que las consultas con una lista de
+# valores (WHERE ... IN (...)) se hacen por lotes
+SQLITE_BATCH_SIZE = 500
+
+
+def select_in(connection, query, values, batch_size=SQLITE_BATCH_SIZE):
+    # query lleva {} en el lugar de la lista: "SELECT uid, signature FROM lsh_signatures WHERE uid IN ({})"
+    values = list(values)
+    for start in range(0, len(values), batch_size):
+        batch = values[start:start + batch_size]
+        yield from connection.execute(query.format(",".join("?" * len(batch))), batch)
+
+
+class MinHasher:
+    # Firma MinHash de un conjunto de shingles (grupos de SHINGLE_SIZE palabras seguidas): la fracción de posiciones
+    # en que coinciden dos firmas estima la similitud de Jaccard entre los dos conjuntos.
+    def __init__(self, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=1):
+        # la semilla es fija: las firmas guardadas en el índice tienen que poder compararse entre corridas
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, 2 ** 32, size=(num_perm, 1), dtype=np.uint64)
+        self._b = generator.randint(0, 2 ** 32, size=(num_perm, 1), dtype=np.uint64)
+        self.shingle_size = shingle_size
+
+    def shingles(self, tokens):
+        if len(tokens) < self.shingle_size:
+            return {" ".join(tokens)} if tokens else set()
+
+        return {" ".join(tokens[start:start + self.shingle_size])
+                for start in range(len(tokens) - self.shingle_size + 1)}
+
+    def signature(self, tokens):
+        shingles = self.shingles(tokens)
+        if not shingles:
+            return None
+
+        # crc32 y no hash(): hash() de un str cambia en cada proceso
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64,
+                             count=len(shingles))
+        # (a * x + b) mod p para todas las permutaciones a la vez; a, b y x son menores que 2^32, no hay overflow
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+class LshIndex:
+    # Índice LSH guardado en sqlite para encontrar artículos casi iguales (la misma nota de agencia con otro título,
+    # o publicada en otro periódico) sin comparar cada artículo contra todos los demás: solo se comparan las firmas
+    # que comparten alguna cubeta. El índice se queda en disco, así se compara también contra corridas anteriores.
+    def __init__(self, path=DEFAULT_INDEX_PATH, threshold=DEFAULT_THRESHOLD, num_perm=NUM_PERM, bands=BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm ({}) must be a multiple of bands ({})".format(num_perm, bands))
+
+        self.path = path
+        self.threshold = threshold
+        self.bands = bands
+        self.hasher = MinHasher(num_perm)
+        self._rows = num_perm // bands
+        # isolation_level=None: las transacciones las abrimos nosotros con BEGIN IMMEDIATE (ver deduplicate)
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS lsh_settings ("
+                                 "name TEXT PRIMARY KEY, "
+                                 "value INTEGER NOT NULL"
+                                 ") WITHOUT ROWID")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS lsh_signatures ("
+                                 "uid TEXT PRIMARY KEY, "
+                                 "signature BLOB NOT NULL"
+                                 ") WITHOUT ROWID")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS lsh_buckets ("
+                                 "bucket BLOB NOT NULL, "
+                                 "uid TEXT NOT NULL, "
+                                 "PRIMARY KEY (bucket, uid)"
+                                 ") WITHOUT ROWID")
+        self._check_settings({"num_perm": num_perm, "bands": bands, "shingle_size": self.hasher.shingle_size})
+
+    def _check_settings(self, settings):
+        # con otros parámetros las firmas guardadas ya no se pueden comparar con las nuevas
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            stored = dict(self._connection.execute("SELECT name, value FROM lsh_settings"))
+            if not stored:
+                self._connection.executemany("INSERT INTO lsh_settings (name, value) VALUES (?, ?)",
+                                             settings.items())
+            elif stored != settings:
+                raise ValueError("{} was built with {}, not {}".format(self.path, stored, settings))
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+
+    def _buckets(self, signature):
+        # una cubeta por banda: número de banda + hash de las filas de la firma en esa banda
+        rows = self._rows
+
+        return [bytes([band]) + hashlib.md5(signature[band * rows:(band + 1) * rows].tobytes()).digest()[:8]
+                for band in range(self.bands)]
+
+    def deduplicate(self, uids, token_lists):
+        # Regresa {uid: uid del artículo que ya estaba} para los artículos que se parecen (similitud de Jaccard
+        # estimada >= threshold) a uno que ya estaba en el índice o que apareció antes en la misma lista.
+        # Los demás se agregan al índice.
+        articles = []
+        for uid, tokens in zip(uids, token_lists):
+            signature = self.hasher.signature(tokens)
+            # sin palabras no hay nada que comparar
+            if signature is not None:
+                articles.append((uid, signature, self._buckets(signature)))
+
+        # BEGIN IMMEDIATE: si otro proceso (otro sitio en pipeline.py) está agregando artículos, esperamos a que
+        # termine, así no se nos escapa un duplicado entre los dos
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            duplicates, added = self._find_duplicates(articles)
+            self._connection.executemany("INSERT OR REPLACE INTO lsh_signatures (uid, signature) VALUES (?, ?)",
+                                         ((uid, signature.tobytes()) for uid, signature, _ in added))
+            self._connection.executemany("INSERT OR IGNORE INTO lsh_buckets (bucket, uid) VALUES (?, ?)",
+                                         ((bucket, uid) for uid, _, buckets in added for bucket in buckets))
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+
+        return duplicates
+
+    def _find_duplicates(self, articles):
+        # cubeta --> uids, primero las que ya estaban en disco y luego las de esta lista conforme se agregan
+        buckets = self._stored_buckets(set(bucket for _, _, article_buckets in articles for bucket in article_buckets))
+        signatures = self._stored_signatures(set(uid for uids in buckets.values() for uid in uids))
+        duplicates = {}
+        added = []
+
+        for uid, signature, article_buckets in articles:
+            candidates = set(candidate for bucket in article_buckets for candidate in buckets.get(bucket, ()))
+            # el mismo artículo procesado otra vez no es duplicado de sí mismo
+            candidates.discard(uid)
+            duplicate_of = next((candidate for candidate in sorted(candidates)
+                                 if np.mean(signatures[candidate] == signature) >= self.threshold), None)
+
+            if duplicate_of is not None:
+                duplicates[uid] = duplicate_of
+                continue
+
+            signatures[uid] = signature
+            for bucket in article_buckets:
+                buckets.setdefault(bucket, []).append(uid)
+            added.append((uid, signature, article_buckets))
+
+        return duplicates, added
+
+    def _stored_buckets(self, buckets):
+        stored = {}
+        for bucket, uid in select_in(self._connection, "SELECT bucket, uid FROM lsh_buckets WHERE bucket IN ({})",
+                                     buckets):
+            stored.setdefault(bucket, []).append(uid)
+
+        return stored
+
+    def _stored_signatures(self, uids):
+        signatures = {}
+        for uid, signature in select_in(self._connection, "SELECT uid, signature FROM lsh_signatures WHERE uid IN ({})",
+                                        uids):
+            signatures[uid] = np.frombuffer(signature, dtype=np.uint32)
+
+        return signatures
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM lsh_signatures").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,74 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import language as language_resources
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def count_tokens(text, resources):
+    # En una sola pasada: tokenizar, quedarnos con las palabras alfabéticas, pasarlas a minúsculas y quitar las
+    # stop_words. Da el mismo resultado que los filter/map encadenados que teníamos antes.
+    # stop_words : son palabras que no añaden ningún tipo de analisis posterior, por ejemplo "el, la"
+    stop_words = resources.stop_words
+
+    return sum(1 for token in resources.tokenize(text) if token.isalpha() and token.lower() not in stop_words)
+
+
+def valid_tokens(text, resources):
+    # las mismas palabras que cuenta count_tokens, ya en minúsculas
+    stop_words = resources.stop_words
+    lowered = (token.lower() for token in resources.tokenize(text) if token.isalpha())
+
+    return [token for token in lowered if token not in stop_words]
+
+
+def _count_chunk(rows, language):
+    # rows: lista de tuplas con los textos de cada columna de una fila
+    # el tokenizador y las stopwords se cargan una sola vez por proceso
+    resources = language_resources.resources(language)
+
+    return [tuple(count_tokens(text, resources) for text in row) for row in rows]
+
+
+def _tokens_chunk(rows, language):
+    # como _count_chunk pero regresa las palabras de cada columna, para las etapas que las necesitan
+    resources = language_resources.resources(language)
+
+    return [tuple(valid_tokens(text, resources) for text in row) for row in rows]
+
+
+def _chunks(rows, chunk_size):
+    for start in range(0, len(rows), chunk_size):
+        yield rows[start:start + chunk_size]
+
+
+def tokenize_columns(df, column_names, language, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, keep_tokens=False):
+    # Agrega una columna n_tokens_<columna> por cada columna. Igual que antes solo se cuentan las filas sin valores
+    # faltantes (df.dropna()), las demás quedan en NaN y se eliminan más adelante.
+    # keep_tokens: también agrega tokens_<columna> con la lista de palabras de cada fila
+    complete_rows = df.dropna()
+    rows = list(zip(*(complete_rows[column_name] for column_name in column_names)))
+    chunk_function = _tokens_chunk if keep_tokens else _count_chunk
+
+    if workers > 1 and len(rows) > chunk_size:
+        # cada proceso recibe bloques de filas, así el costo de mandar los datos se reparte entre muchas filas
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(itertools.chain.from_iterable(
+                executor.map(chunk_function, _chunks(rows, chunk_size), itertools.repeat(language))))
+    else:
+        results = chunk_function(rows, language)
+
+    for position, column_name in enumerate(column_names):
+        if keep_tokens:
+            tokens = [row_tokens[position] for row_tokens in results]
+            df["tokens_{}".format(column_name)] = pd.Series(tokens, index=complete_rows.index, dtype=object)
+            counts = [len(column_tokens) for column_tokens in tokens]
+        else:
+            counts = [row_counts[position] for row_counts in results]
+
+        df["n_tokens_{}".format(column_name)] = pd.Series(counts, index=complete_rows.index, dtype="int64")
+
+    return df